@@ -0,0 +1,149 @@
+"""Who may see and change which teams, matches and players.
+
+A user can view the teams they own or are a member of, and a match when
+they can view either of its teams. Only owners make changes: a team is
+edited by its owner, a match by the owner of either team, and a player by
+the roster owner or the owner of the player's team.
+
+Checks on a single object cost at most one EXISTS query, and none when the
+owners are already loaded with the object. Once a view has asked for the
+user's teams (``Access.team_owners``), later checks in the same request are
+answered from that set.
+
+The async views ask the same questions with the ``a``-prefixed methods:
+both flavours share the decision and only differ in how a query, if one
+is needed, is run.
+"""
+from functools import cached_property
+
+from django.db.models import Q
+
+from .models import Match, Player, Team
+
+
+class Access:
+    """What ``user`` may see and change; use access_for() to share one per request"""
+
+    def __init__(self, user):
+        self.user = user
+
+    def _team_owners_query(self):
+        return Team.objects.filter(owner=self.user).order_by().values_list('pk', 'owner_id').union(
+            Team.members.through.objects.filter(user=self.user).values_list('team_id', 'team__owner_id')
+        )
+
+    @cached_property
+    def team_owners(self):
+        """{team id: owner id} of every team the user can view, in one query"""
+        return dict(self._team_owners_query())
+
+    async def ateam_owners(self):
+        """team_owners, loaded with the async ORM"""
+        if not self._knows_teams():
+            self.__dict__['team_owners'] = {pk: owner_id async for pk, owner_id in self._team_owners_query()}
+        return self.team_owners
+
+    def _knows_teams(self):
+        return 'team_owners' in self.__dict__
+
+    def teams(self):
+        """Teams the user can view"""
+        return Team.objects.viewable_by(self.user)
+
+    def owned_teams(self):
+        """Teams the user owns"""
+        return Team.objects.editable_by(self.user)
+
+    def member_teams(self):
+        """Teams of other owners that the user can view as a member"""
+        return Team.objects.filter(pk__in=[
+            pk for pk, owner_id in self.team_owners.items() if owner_id != self.user.pk
+        ])
+
+    def member_team_owners(self):
+        """Owner ids of member_teams()"""
+        return {owner_id for owner_id in self.team_owners.values() if owner_id != self.user.pk}
+
+    def matches(self):
+        """Matches the user can view"""
+        return Match.objects.involving(self.team_owners)
+
+    def players(self):
+        """Players the user can edit or remove"""
+        return Player.objects.editable_by(self.user)
+
+    def can_view_team(self, team):
+        return _answer(self._view_team(team))
+
+    async def acan_view_team(self, team):
+        return await _aanswer(self._view_team(team))
+
+    def can_edit_team(self, team):
+        return team.owner_id == self.user.pk
+
+    def can_view_match(self, match):
+        return _answer(self._view_match(match))
+
+    async def acan_view_match(self, match):
+        return await _aanswer(self._view_match(match))
+
+    def can_edit_match(self, match):
+        return _answer(self._edit_match(match))
+
+    async def acan_edit_match(self, match):
+        return await _aanswer(self._edit_match(match))
+
+    # Each check returns its answer, or the queryset whose exists() is the
+    # answer when it cannot be decided from what is already loaded
+
+    def _view_team(self, team):
+        if team.owner_id == self.user.pk:
+            return True
+        if self._knows_teams():
+            return team.pk in self.team_owners
+        return Team.members.through.objects.filter(team_id=team.pk, user_id=self.user.pk)
+
+    def _view_match(self, match):
+        team_ids = (match.team_A_id, match.team_B_id)
+        if self._knows_teams():
+            return any(team_id in self.team_owners for team_id in team_ids)
+        owners = _team_owners(match)
+        if owners is not None and self.user.pk in owners:
+            return True
+        memberships = Team.members.through.objects.filter(team_id__in=team_ids, user_id=self.user.pk)
+        if owners is not None:
+            return memberships
+        return Team.objects.filter(pk__in=team_ids).filter(
+            Q(owner_id=self.user.pk) | Q(pk__in=memberships.values('team_id'))
+        )
+
+    def _edit_match(self, match):
+        owners = _team_owners(match)
+        if owners is None and self._knows_teams():
+            # Teams missing from the set are not viewable, let alone owned
+            owners = {self.team_owners.get(match.team_A_id), self.team_owners.get(match.team_B_id)}
+        if owners is not None:
+            return self.user.pk in owners
+        return Team.objects.filter(pk__in=(match.team_A_id, match.team_B_id), owner_id=self.user.pk)
+
+
+def _answer(answer):
+    return answer if isinstance(answer, bool) else answer.exists()
+
+
+async def _aanswer(answer):
+    return answer if isinstance(answer, bool) else await answer.aexists()
+
+def _team_owners(match):
+    """Owner ids of the match's teams if both teams are loaded, else None"""
+    if Match.team_A.is_cached(match) and Match.team_B.is_cached(match):
+        return {match.team_A.owner_id, match.team_B.owner_id}
+    return None
+
+
+def access_for(request):
+    """The Access of ``request.user``, created once per request"""
+    access = getattr(request, '_access', None)
+    if access is None or access.user is not request.user:
+        access = request._access = Access(request.user)
+    return access
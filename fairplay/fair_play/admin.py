@@ -1,11 +1,11 @@
 from django.contrib import admin
-from .models import Player, Team, Match
+from .models import Job, Player, Team, Match
 
 # Register your models here.
 
 @admin.register(Player)
 class PlayerAdmin(admin.ModelAdmin):
-    list_display = ('get_username', 'position', 'rating', 'team')
+    list_display = ('get_username', 'position', 'rating', 'learned_rating', 'team')
     list_filter = ('position', 'rating', 'team')
     search_fields = ('user__username',)
     ordering = ('-rating', 'user__username')
@@ -17,20 +17,19 @@ class PlayerAdmin(admin.ModelAdmin):
 
 @admin.register(Team)
 class TeamAdmin(admin.ModelAdmin):
-    list_display = ('name', 'created_at', 'player_count', 'total_rating')
+    list_display = ('name', 'created_at', 'player_count', 'total_rating', 'avg_rating')
     search_fields = ('name',)
     ordering = ('-created_at',)
-    
-    def player_count(self, obj):
-        return obj.players.count()
-    player_count.short_description = 'Players'
-    
-    def total_rating(self, obj):
-        return sum(player.rating for player in obj.players.all())
-    total_rating.short_description = 'Total Rating'
 
 @admin.register(Match)
 class MatchAdmin(admin.ModelAdmin):
     list_display = ('team_A', 'team_B', 'date_created')
     list_filter = ('date_created',)
     ordering = ('-date_created',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'owner', 'status', 'attempts', 'created_at', 'finished_at', 'worker')
+    list_filter = ('status', 'kind')
+    ordering = ('-created_at',)
@@ -0,0 +1,397 @@
+"""A JSON API for rosters, teams, matches and match history, under /api/.
+
+Reads are ``.values()`` projections over the joins each endpoint needs: no
+model instances are built and no related object is loaded one row at a
+time. Writes go through the forms the pages use and answer with the
+changed resource.
+
+Every response carries an ETag made of the roster versions of the owners
+whose data it shows (see caching.py). A write to an owner's players,
+teams, matches or match stats gives the owner a new version. The versions
+are known before any row is read, so a client polling with
+``If-None-Match`` gets ``304 Not Modified`` for a cache lookup and at most
+one small query. ``If-Match`` makes a PATCH or DELETE conditional: it is
+refused with ``412 Precondition Failed`` when the owner's data changed
+since the client read it.
+
+Requests are authenticated by the session, as the pages are, and writes
+need the CSRF token in an ``X-CSRFToken`` header. Lists are paged with
+cursors; a page's ``next`` is the URL of the page after it.
+"""
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from .access import access_for
+from .balancing import BALANCERS, DEFAULT_BALANCER
+from .caching import roster_version
+from .db import retry_on_locked, save_fresh
+from .forms import MatchForm, MatchResultForm, PlayerSearchForm, PlayerUpdateForm
+from .jobs import enqueue, job_status
+from .models import CAREER_FIELDS, Match, MatchParticipation, Player, PlayerCareerStats, Team
+from .pagination import KeysetPaginator
+from .ratings import is_decided, update_match_ratings
+from .roster import MIN_TEAMS, add_owner_as_player, regenerate_teams
+from .routers import analytics_generation, for_analytics
+
+# Rows per page of the paged lists
+API_PAGE_SIZE = 100
+
+PLAYER_FIELDS = ('id', 'owner_id', 'team_id', 'position', 'rating', 'learned_rating')
+PLAYER_NAMES = {
+    'username': F('user__username'), 'first_name': F('user__first_name'), 'last_name': F('user__last_name'),
+}
+TEAM_FIELDS = ('id', 'name', 'created_at', 'owner_id', 'player_count', 'total_rating', 'avg_rating')
+MATCH_FIELDS = ('id', 'status', 'played_at', 'location', 'score_a', 'score_b', 'date_created')
+MATCH_TEAMS = {
+    'team_a_id': F('team_A_id'), 'team_a': F('team_A__name'),
+    'team_b_id': F('team_B_id'), 'team_b': F('team_B__name'),
+}
+PARTICIPATION_FIELDS = ('match_id', 'team_id', 'player_id', 'minutes_played', 'goals', 'assists', 'match_rating')
+# The match of a participation, named as in MATCH_FIELDS and MATCH_TEAMS
+PARTICIPATION_MATCH = {
+    'status': F('match__status'), 'played_at': F('match__played_at'), 'location': F('match__location'),
+    'score_a': F('match__score_a'), 'score_b': F('match__score_b'),
+    'team_a_id': F('match__team_A_id'), 'team_a': F('match__team_A__name'),
+    'team_b_id': F('match__team_B_id'), 'team_b': F('match__team_B__name'),
+}
+# Form field -> API field, where they differ
+MATCH_FORM_FIELDS = {'team_A': 'team_a_id', 'team_B': 'team_b_id'}
+
+
+class ApiError(Exception):
+    """Ends an API request with ``status`` and a JSON body describing the problem"""
+
+    def __init__(self, status, message, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors
+
+    def response(self):
+        body = {'error': str(self)}
+        if self.errors is not None:
+            body['errors'] = self.errors
+        return JsonResponse(body, status=self.status)
+
+
+def api_view(*methods):
+    """Answer anonymous users, other methods and ApiErrors with JSON, rather than redirects and pages"""
+    def decorate(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return ApiError(401, 'Authentication required.').response()
+            if request.method not in methods:
+                response = ApiError(405, f'{request.method} is not allowed here.').response()
+                response['Allow'] = ', '.join(methods)
+                return response
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as error:
+                return error.response()
+        return wrapper
+    return decorate
+
+
+def _body(request):
+    """The JSON object sent with a write"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ApiError(400, 'The request body is not valid JSON.')
+    if not isinstance(data, dict):
+        raise ApiError(400, 'The request body must be a JSON object.')
+    return data
+
+
+def _invalid(form, names=None):
+    """The ApiError for a form that did not validate, with errors under the API's field names"""
+    names = names or {}
+    errors = {names.get(field, field): messages for field, messages in form.errors.get_json_data().items()}
+    return ApiError(400, 'Invalid data.', errors)
+
+
+def _first(queryset):
+    row = queryset.first()
+    if row is None:
+        raise ApiError(404, 'Not found.')
+    return row
+
+
+def _etag(request, version):
+    # What a list holds depends on who asks, not only on the owners' data
+    return quote_etag(f'{request.user.pk}-{version}')
+
+
+def _respond(request, version, build, status=200, conditional=True):
+    """``build()`` as JSON with the ETag of ``version``; 304 instead if the client has it"""
+    etag = _etag(request, version)
+    response = get_conditional_response(request, etag=etag) if conditional else None
+    if response is None:
+        response = JsonResponse(build(), status=status)
+    response['ETag'] = etag
+    # Clients may keep the body, but must check it is current before using it
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _check_precondition(request, version):
+    """Refuse a write whose If-Match names another version of the data"""
+    if get_conditional_response(request, etag=_etag(request, version)) is not None:
+        raise ApiError(412, 'The data changed since you read it.')
+
+
+def _page(request, rows, ordering):
+    """One page of ``rows``, a .values() queryset, with the URLs of its neighbours"""
+    page = KeysetPaginator(rows, ordering, API_PAGE_SIZE).page(request.GET, 'cursor')
+    return {
+        'results': list(page),
+        'next': f'{request.path}?{page.next_query}' if page.has_next else None,
+        'previous': f'{request.path}?{page.previous_query}' if page.has_previous else None,
+    }
+
+
+def _player_rows(players):
+    return players.values(*PLAYER_FIELDS, **PLAYER_NAMES)
+
+
+def _team_rows(teams):
+    """``teams`` with their players and members, in three queries however many there are"""
+    rows = list(teams.order_by('-created_at', '-pk').values(*TEAM_FIELDS, owner_username=F('owner__username')))
+    by_id = {}
+    for row in rows:
+        row['players'] = []
+        row['members'] = []
+        by_id[row['id']] = row
+    if not by_id:
+        return rows
+    players = _player_rows(Player.objects.filter(team_id__in=list(by_id)).order_by('user__username', 'pk'))
+    for player in players:
+        by_id[player['team_id']]['players'].append(player)
+    members = Team.members.through.objects.filter(team_id__in=list(by_id)).order_by(
+        'user__username'
+    ).values_list('team_id', 'user__username')
+    for team_id, username in members:
+        by_id[team_id]['members'].append(username)
+    return rows
+
+
+def _match_detail(pk):
+    """A match with the stats of everyone who played in it"""
+    match = Match.objects.filter(pk=pk).values(*MATCH_FIELDS, **MATCH_TEAMS).first()
+    match['participations'] = list(MatchParticipation.objects.filter(match_id=pk).order_by(
+        'team_id', 'player__user__username'
+    ).values(*PARTICIPATION_FIELDS, username=F('player__user__username'), position=F('player__position')))
+    return match
+
+
+@api_view('GET', 'POST')
+def players_view(request):
+    """The user's roster; POST adds a registered user to it"""
+    if request.method == 'POST':
+        return _add_player(request)
+    return _respond(request, roster_version(request.user.pk), lambda: _page(
+        request, _player_rows(Player.objects.filter(owner=request.user)), ['user__username']
+    ))
+
+
+def _add_player(request):
+    data = _body(request)
+    form = PlayerSearchForm({
+        'username': data.get('username'), 'position_override': data.get('position') or '',
+        'rating': data.get('rating', 70),
+    })
+    if not form.is_valid():
+        raise _invalid(form, {'position_override': 'position'})
+    username = form.cleaned_data['username']
+    user = User.objects.select_related('profile').filter(username=username).first()
+    if user is None:
+        form.add_error('username', f'User "{username}" not found.')
+        raise _invalid(form)
+    player = Player.objects.create(
+        user=user, owner=request.user, rating=form.cleaned_data['rating'],
+        position=form.cleaned_data['position_override'] or user.profile.preferred_position,
+    )
+    row = _player_rows(Player.objects.filter(pk=player.pk)).first()
+    response = _respond(request, roster_version(request.user.pk), lambda: row, status=201, conditional=False)
+    response['Location'] = reverse('api_player', args=[player.pk])
+    return response
+
+
+@api_view('GET', 'PATCH', 'DELETE')
+def player_view(request, pk):
+    """A player the user can edit; PATCH changes position and rating, DELETE removes the player"""
+    players = access_for(request).players().filter(pk=pk)
+    if request.method == 'GET':
+        row = _first(_player_rows(players))
+        return _respond(request, roster_version(row['owner_id']), lambda: row)
+
+    player = _first(players)
+    _check_precondition(request, roster_version(player.owner_id))
+    if request.method == 'DELETE':
+        retry_on_locked(player.delete)()
+        return HttpResponse(status=204)
+
+    data = _body(request)
+    fields = PlayerUpdateForm._meta.fields
+    form = PlayerUpdateForm({field: data.get(field, getattr(player, field)) for field in fields}, instance=player)
+    if not form.is_valid():
+        raise _invalid(form)
+    # Only the edited fields, as on the player page
+    save_fresh(player, fields)
+    row = _player_rows(Player.objects.filter(pk=pk)).first()
+    return _respond(request, roster_version(player.owner_id), lambda: row, conditional=False)
+
+
+@api_view('GET', 'POST')
+def teams_view(request):
+    """The teams the user owns or plays in; POST drafts the user's roster into new teams"""
+    if request.method == 'POST':
+        return _generate_teams(request)
+    access = access_for(request)
+    team_ids = list(access.team_owners)
+    return _respond(
+        request, roster_version(request.user.pk, *access.team_owners.values()),
+        lambda: {'results': _team_rows(Team.objects.filter(pk__in=team_ids))}
+    )
+
+
+def _position_limits(limits):
+    """{position code: count} quotas of the 'positions' engine"""
+    if limits is None:
+        return {}
+    if not isinstance(limits, dict) or not all(
+        code in Player.Position.names and isinstance(count, int) and count >= 0 for code, count in limits.items()
+    ):
+        codes = ', '.join(Player.Position.names)
+        raise ApiError(400, f'Position limits must map position codes ({codes}) to counts.')
+    return limits
+
+
+def _generate_teams(request):
+    data = _body(request)
+    team_names = data.get('team_names')
+    if not isinstance(team_names, list) or not all(isinstance(name, str) for name in team_names):
+        raise ApiError(400, 'team_names must be a list of names.')
+    team_names = [name.strip() for name in team_names if name.strip()]
+    if len(set(team_names)) < MIN_TEAMS:
+        raise ApiError(400, f'Please provide at least {MIN_TEAMS} different team names.')
+    engine = data.get('engine', DEFAULT_BALANCER)
+    if engine not in BALANCERS:
+        raise ApiError(400, 'Please choose a valid balancing method.')
+    minimums, maximums = _position_limits(data.get('minimums')), _position_limits(data.get('maximums'))
+    learned = bool(data.get('learned_ratings'))
+
+    # As on the team form, the user plays in the teams they draft
+    add_owner_as_player(request.user)
+    if settings.FAIRPLAY_BACKGROUND_JOBS:
+        job = enqueue(
+            'generate_teams', owner=request.user, idempotency_key=request.headers.get('Idempotency-Key'),
+            team_names=team_names, engine=engine, minimums=minimums, maximums=maximums, learned=learned
+        )
+        response = JsonResponse(job_status(job), status=202)
+        response['Location'] = reverse('job_status', args=[job.pk])
+        return response
+    try:
+        teams = regenerate_teams(request.user.pk, team_names, engine, minimums, maximums, learned)
+    except ValueError as error:
+        raise ApiError(400, str(error))
+    return JsonResponse({'results': _team_rows(Team.objects.filter(pk__in=[team.pk for team in teams]))}, status=201)
+
+
+@api_view('GET')
+def team_view(request, pk):
+    """A team the user can view, with its players and members"""
+    owner_id = _first(access_for(request).teams().filter(pk=pk).values_list('owner_id', flat=True))
+    return _respond(request, roster_version(owner_id), lambda: _team_rows(Team.objects.filter(pk=pk))[0])
+
+
+@api_view('GET', 'POST')
+def matches_view(request):
+    """Matches of the teams the user can view, latest first (``?status=`` filters); POST schedules one"""
+    if request.method == 'POST':
+        return _create_match(request)
+    access = access_for(request)
+    matches = access.matches()
+    status = request.GET.get('status')
+    if status:
+        if status not in Match.Status.values:
+            raise ApiError(400, f'status must be one of {", ".join(Match.Status.values)}.')
+        matches = matches.filter(status=status)
+    return _respond(request, roster_version(request.user.pk, *access.team_owners.values()), lambda: _page(
+        request, matches.values(*MATCH_FIELDS, **MATCH_TEAMS), ['-played_at', '-date_created']
+    ))
+
+
+def _create_match(request):
+    data = _body(request)
+    form = MatchForm(request.user, {
+        'team_A': data.get('team_a_id'), 'team_B': data.get('team_b_id'),
+        'played_at': data.get('played_at'), 'location': data.get('location') or '',
+    })
+    if not form.is_valid():
+        raise _invalid(form, MATCH_FORM_FIELDS)
+    with transaction.atomic():
+        match = form.save()
+        MatchParticipation.objects.create_for_match(match)
+        if is_decided(match):
+            update_match_ratings(match)
+    # Both teams belong to the user
+    response = _respond(
+        request, roster_version(request.user.pk), lambda: _match_detail(match.pk), status=201, conditional=False
+    )
+    response['Location'] = reverse('api_match', args=[match.pk])
+    return response
+
+
+@api_view('GET', 'PATCH')
+def match_view(request, pk):
+    """A match the user can view, with its players' stats; PATCH records the result"""
+    access = access_for(request)
+    if request.method == 'PATCH':
+        return _record_result(request, access, pk)
+    # Both teams of a match belong to the same owner
+    owner_id = _first(access.matches().filter(pk=pk).values_list('team_A__owner_id', flat=True))
+    return _respond(request, roster_version(owner_id), lambda: _match_detail(pk))
+
+
+def _record_result(request, access, pk):
+    match = _first(Match.objects.select_related('team_A', 'team_B').filter(pk=pk))
+    if not access.can_edit_match(match):
+        raise ApiError(403, 'Only team owners can record match results.')
+    owner_id = match.team_A.owner_id
+    _check_precondition(request, roster_version(owner_id))
+    data = _body(request)
+    fields = MatchResultForm._meta.fields
+    form = MatchResultForm({field: data.get(field, getattr(match, field)) for field in fields}, instance=match)
+    if not form.is_valid():
+        raise _invalid(form)
+    save_fresh(match, fields)
+    return _respond(request, roster_version(owner_id), lambda: _match_detail(pk), conditional=False)
+
+
+@api_view('GET')
+def history_view(request):
+    """The user's matches on every roster they are on, latest first, with their career totals"""
+    # Participations belong to the user's players; their owners' versions cover them
+    owner_ids = Player.objects.filter(user=request.user).order_by().values_list('owner_id', flat=True).distinct()
+    version = f'{roster_version(*owner_ids)}{analytics_generation()}'
+
+    def build():
+        participations = for_analytics(MatchParticipation.objects.filter(player__user=request.user)).values(
+            *PARTICIPATION_FIELDS, **PARTICIPATION_MATCH, team_name=F('team__name')
+        )
+        history = _page(request, participations, ['-match__played_at', '-match__date_created'])
+        career = for_analytics(PlayerCareerStats.objects.filter(user=request.user)).values(*CAREER_FIELDS).first()
+        history['career'] = career or dict.fromkeys(CAREER_FIELDS, 0)
+        return history
+
+    return _respond(request, version, build)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class FairPlayConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'fair_play'
+
+    def ready(self):
+        # Connect the cache invalidation, connection setup, query timing and
+        # rating hooks, and register the background job kinds
+        from . import caching, db, metrics, ratings, standings, tasks  # noqa: F401
@@ -0,0 +1,129 @@
+"""Async versions of the read views that take most of the traffic.
+
+Under ASGI (``FAIRPLAY_ASYNC_VIEWS``, see fair_play/urls.py) these replace
+``teams_display_view``, ``match_list_view`` and ``match_detail_view``.
+Waiting on the database no longer holds a worker thread for each request.
+Each request's queries go through Django's async ORM (``aget``, ``async for``,
+``aexists``).
+
+Django 4.2 has a few gaps, and each is crossed with one ``sync_to_async`` hop:
+
+* there is no async ``request.user`` (``auser()`` comes in 5.0), so the
+  session and user are loaded in one hop;
+* there is no async prefetching (5.0), so participations are loaded with
+  select_related instead;
+* templates render synchronously. That also keeps the cached fragments
+  lazy: a cache hit still runs no queries.
+
+The pages and the queries they run are the same as the sync views'.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404
+from django.shortcuts import redirect, render
+
+from .access import access_for
+from .caching import fragment_timeout, roster_version
+from .models import Match
+from .pagination import KeysetPaginator
+from .views import MATCHES_PER_PAGE
+
+_render = sync_to_async(render)
+
+
+@sync_to_async
+def _is_authenticated(request):
+    # Evaluates the lazy request.user, session included
+    return request.user.is_authenticated
+
+
+def async_login_required(view):
+    """login_required for async views"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await _is_authenticated(request):
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@async_login_required
+async def teams_display_view(request):
+    """Display the generated teams with their players"""
+    user = request.user
+    access = access_for(request)
+    await access.ateam_owners()
+    owned_teams = access.owned_teams().prefetch_related('players__user', 'members')
+    member_teams = access.member_teams().prefetch_related('players__user', 'members', 'owner')
+    member_owners = access.member_team_owners()
+    # Both sections are cached fragments, so the teams themselves are only
+    # loaded, while rendering, on a cache miss
+    owned_version, member_version = await sync_to_async(
+        lambda: (roster_version(user.pk), roster_version(*member_owners))
+    )()
+    return await _render(request, 'teams_display.html', {
+        'owned_teams': owned_teams,
+        'member_teams': member_teams,
+        'owned_version': owned_version,
+        'member_version': member_version,
+        'fragment_timeout': fragment_timeout()
+    })
+
+
+@async_login_required
+async def match_list_view(request):
+    """Display all matches for teams the user owns or is a member of"""
+    access = access_for(request)
+    team_owners = await access.ateam_owners()
+    matches = access.matches().select_related('team_A', 'team_B')
+
+    ordering = ['-played_at', '-date_created']
+    upcoming = KeysetPaginator(
+        matches.filter(status=Match.Status.SCHEDULED), ordering, MATCHES_PER_PAGE
+    ).page(request.GET, 'upcoming')
+    played = KeysetPaginator(
+        matches.filter(status=Match.Status.PLAYED), ordering, MATCHES_PER_PAGE
+    ).page(request.GET, 'played')
+
+    # Pages are read while rendering, and only when the fragment is not cached
+    matches_version = await sync_to_async(roster_version)(request.user.pk, *team_owners.values())
+    return await _render(request, 'match_list.html', {
+        'upcoming_matches': upcoming,
+        'played_matches': played,
+        'matches_version': matches_version,
+        'fragment_timeout': fragment_timeout()
+    })
+
+
+@async_login_required
+async def match_detail_view(request, pk):
+    """Display match details with rosters and participations"""
+    try:
+        match = await Match.objects.select_related('team_A', 'team_B').aget(pk=pk)
+    except Match.DoesNotExist:
+        raise Http404('No Match matches the given query.')
+
+    access = access_for(request)
+    if not await access.acan_view_match(match):
+        messages.error(request, 'You do not have access to this match.')
+        return redirect('match_list')
+
+    # One query for both teams, split here rather than in two queries
+    team_a_participations = []
+    team_b_participations = []
+    participations = match.participations.select_related('player__user').order_by('pk')
+    async for participation in participations:
+        if participation.team_id == match.team_A_id:
+            team_a_participations.append(participation)
+        elif participation.team_id == match.team_B_id:
+            team_b_participations.append(participation)
+
+    return await _render(request, 'match_detail.html', {
+        'match': match,
+        'team_a_participations': team_a_participations,
+        'team_b_participations': team_b_participations,
+        'can_edit': await access.acan_edit_match(match)
+    })
@@ -0,0 +1,443 @@
+"""Team balancing engines.
+
+Every engine works on a plain sequence of ratings and returns, for each
+rating, the index of the team it was assigned to. Team sizes never differ by
+more than one player, so engines can be swapped freely.
+"""
+import heapq
+import time
+from bisect import bisect_left
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, engines fall back to pure Python
+    np = None
+
+
+BALANCERS = {}
+DEFAULT_BALANCER = 'local_search'
+
+# Marks a one-way move (swap with an empty slot) in the swap searches
+_MOVE = object()
+
+
+def register(cls):
+    """Class decorator adding an engine to the registry under ``cls.name``"""
+    BALANCERS[cls.name] = cls
+    return cls
+
+
+def get_balancer(name, **options):
+    """Instantiate the engine registered as ``name``"""
+    try:
+        balancer_class = BALANCERS[name]
+    except KeyError:
+        raise ValueError(f'Unknown balancing engine "{name}"')
+    return balancer_class(**options)
+
+
+def balancer_choices():
+    """(name, label) pairs for every registered engine, for use in forms"""
+    return [(name, balancer_class.label) for name, balancer_class in BALANCERS.items()]
+
+
+def team_totals(ratings, assignment, num_teams):
+    """Sum of ratings per team"""
+    totals = [0] * num_teams
+    for rating, team in zip(ratings, assignment):
+        totals[team] += rating
+    return totals
+
+
+def rating_spread(ratings, assignment, num_teams):
+    """Difference between the strongest and the weakest team"""
+    totals = team_totals(ratings, assignment, num_teams)
+    return max(totals) - min(totals)
+
+
+def _descending(ratings):
+    # Stable, so callers can pre-sort equal ratings by a tiebreaker
+    return sorted(range(len(ratings)), key=lambda i: -ratings[i])
+
+
+def _best_partner(ratings, givers, candidates, gap):
+    """Pair (i, j) with 0 < r_i - r_j < gap and r_i - r_j closest to gap / 2.
+
+    ``candidates`` must be sorted by rating; None stands for a zero-rated
+    ghost. Returns ``(new gap, i, j)`` or None when no swap narrows the gap.
+    """
+    if not givers or not candidates:
+        return None
+    values = [ratings[j] if j is not None else 0 for j in candidates]
+
+    if np is not None:
+        giver_ratings = np.fromiter((ratings[i] for i in givers), dtype=float, count=len(givers))
+        values_array = np.asarray(values, dtype=float)
+        idx = np.searchsorted(values_array, giver_ratings - gap / 2)
+        best_score, best = gap, None
+        for neighbour in (idx - 1, idx):
+            neighbour = np.clip(neighbour, 0, len(values) - 1)
+            diff = giver_ratings - values_array[neighbour]
+            score = np.where((diff > 0) & (diff < gap), np.abs(gap - 2 * diff), np.inf)
+            k = int(np.argmin(score))
+            if score[k] < best_score:
+                best_score, best = score[k], (float(score[k]), givers[k], candidates[int(neighbour[k])])
+        return best
+
+    best_score, best = gap, None
+    for i in givers:
+        idx = bisect_left(values, ratings[i] - gap / 2)
+        for neighbour in (idx - 1, idx):
+            if 0 <= neighbour < len(values):
+                diff = ratings[i] - values[neighbour]
+                if 0 < diff < gap and abs(gap - 2 * diff) < best_score:
+                    best_score = abs(gap - 2 * diff)
+                    best = (best_score, i, candidates[neighbour])
+    return best
+
+
+class Balancer:
+    """Base class for balancing engines"""
+    name = None
+    label = None
+
+    def assign(self, ratings, num_teams, positions=None):
+        """Return the team index (0..num_teams-1) for every rating.
+
+        ``positions`` runs parallel to ``ratings``; engines that do not care
+        about positions ignore it.
+        """
+        raise NotImplementedError
+
+
+@register
+class SnakeDraftBalancer(Balancer):
+    """Snake draft: A B C, C B A, A B C, ... over players sorted by rating"""
+    name = 'snake'
+    label = 'Snake draft'
+
+    def assign(self, ratings, num_teams, positions=None):
+        assignment = [0] * len(ratings)
+        for index, i in enumerate(_descending(ratings)):
+            iteration_number, position_in_iteration = divmod(index, num_teams)
+            if iteration_number % 2 == 1:
+                position_in_iteration = num_teams - 1 - position_in_iteration
+            assignment[i] = position_in_iteration
+        return assignment
+
+
+@register
+class GreedyBalancer(Balancer):
+    """Greedy LPT: give each player, best first, to the weakest team that still has room"""
+    name = 'greedy'
+    label = 'Greedy (LPT)'
+
+    def assign(self, ratings, num_teams, positions=None):
+        base, extra = divmod(len(ratings), num_teams)
+        sizes = [0] * num_teams
+        heap = [(0, team) for team in range(num_teams)]
+        assignment = [0] * len(ratings)
+
+        for i in _descending(ratings):
+            while True:
+                total, team = heapq.heappop(heap)
+                # A team is full at base + 1 players, or at base once every
+                # "extra" slot has been handed out to other teams
+                if sizes[team] == base + 1 or (sizes[team] == base and extra == 0):
+                    continue
+                break
+            if sizes[team] == base:
+                extra -= 1
+            sizes[team] += 1
+            assignment[i] = team
+            heapq.heappush(heap, (total + ratings[i], team))
+        return assignment
+
+
+@register
+class KarmarkarKarpBalancer(Balancer):
+    """Balanced largest differencing method (Karmarkar-Karp for k teams).
+
+    Players are sorted and cut into rounds of ``num_teams``; each round is a
+    partial partition with one player per team. The two partitions with the
+    largest spread are repeatedly merged, heaviest side onto lightest side,
+    which keeps team sizes equal.
+    """
+    name = 'karmarkar_karp'
+    label = 'Karmarkar-Karp differencing'
+
+    def assign(self, ratings, num_teams, positions=None):
+        order = _descending(ratings)
+        # Pad with zero-rated placeholders so every round is complete
+        order += [None] * (-len(order) % num_teams)
+
+        heap = []
+        for counter, start in enumerate(range(0, len(order), num_teams)):
+            subsets = [
+                (ratings[i] if i is not None else 0, [i])
+                for i in order[start:start + num_teams]
+            ]
+            heap.append((-(subsets[0][0] - subsets[-1][0]), counter, subsets))
+        heapq.heapify(heap)
+        counter = len(heap)
+
+        while len(heap) > 1:
+            _, _, first = heapq.heappop(heap)
+            _, _, second = heapq.heappop(heap)
+            first.sort(key=lambda subset: -subset[0])
+            second.sort(key=lambda subset: subset[0])
+            merged = [
+                (a_total + b_total, a_members + b_members)
+                for (a_total, a_members), (b_total, b_members) in zip(first, second)
+            ]
+            merged.sort(key=lambda subset: -subset[0])
+            heapq.heappush(heap, (-(merged[0][0] - merged[-1][0]), counter, merged))
+            counter += 1
+
+        assignment = [0] * len(ratings)
+        if heap:
+            for team, (_, members) in enumerate(heap[0][2]):
+                for i in members:
+                    if i is not None:
+                        assignment[i] = team
+        return assignment
+
+
+@register
+class LocalSearchBalancer(Balancer):
+    """Karmarkar-Karp start refined by pairwise swaps within a time budget.
+
+    Each step looks at a pair of teams and swaps the two players whose rating
+    difference is closest to half the gap between the teams (or moves one
+    player to a team with one player fewer). Both teams end up inside their
+    old range, so the overall spread never grows.
+    """
+    name = 'local_search'
+    label = 'Karmarkar-Karp + swap refinement'
+
+    def __init__(self, time_budget=0.02, start='karmarkar_karp', clock=time.perf_counter):
+        self.time_budget = time_budget
+        self.start = start
+        self.clock = clock
+
+    def assign(self, ratings, num_teams, positions=None):
+        assignment = get_balancer(self.start).assign(ratings, num_teams)
+        if num_teams < 2 or not ratings:
+            return assignment
+
+        deadline = self.clock() + self.time_budget
+        members = [[] for _ in range(num_teams)]
+        for i, team in enumerate(assignment):
+            members[team].append(i)
+        totals = team_totals(ratings, assignment, num_teams)
+
+        while self.clock() < deadline:
+            swap = self._find_swap(ratings, members, totals)
+            if swap is None:
+                break
+            heavy, light, i, j = swap
+            moved = ratings[i] - (ratings[j] if j is not None else 0)
+            members[heavy].remove(i)
+            members[light].append(i)
+            if j is not None:
+                members[light].remove(j)
+                members[heavy].append(j)
+            totals[heavy] -= moved
+            totals[light] += moved
+
+        for team, team_members in enumerate(members):
+            for i in team_members:
+                assignment[i] = team
+        return assignment
+
+    def _find_swap(self, ratings, members, totals):
+        by_total = sorted(range(len(totals)), key=lambda team: -totals[team])
+        # Try the widest gaps first: heaviest vs lightest, then inwards
+        pairs = sorted(
+            ((heavy, light) for a, heavy in enumerate(by_total) for light in by_total[a + 1:]),
+            key=lambda pair: totals[pair[1]] - totals[pair[0]]
+        )
+        for heavy, light in pairs:
+            gap = totals[heavy] - totals[light]
+            if gap <= 0:
+                break
+            candidates = sorted(members[light], key=lambda j: ratings[j])
+            if len(members[heavy]) > len(members[light]):
+                # A zero-rated ghost lets a player move without a partner
+                candidates.insert(0, None)
+            best = _best_partner(ratings, members[heavy], candidates, gap)
+            if best is not None:
+                return (heavy, light) + best[1:]
+        return None
+
+
+@register
+class PositionBalancer(Balancer):
+    """Balance ratings while enforcing per-team position quotas.
+
+    ``quotas`` maps a position to ``(minimum, maximum)`` players per team and
+    either bound may be None. Missing bounds default to an even spread of the
+    position (its count divided by the number of teams, rounded down for the
+    minimum and up for the maximum), so one team cannot end up with two
+    goalkeepers while another has none.
+
+    Players are drafted position by position, tightest quota first: every
+    team receives its minimum of the position, best player to the weakest
+    team, then the rest go to teams with free room that are still under their
+    maximum. Quota-preserving swaps then narrow the rating spread within the
+    time budget.
+    """
+    name = 'positions'
+    label = 'Position quotas + swap refinement'
+
+    def __init__(self, quotas=None, time_budget=0.05, clock=time.perf_counter):
+        self.quotas = quotas or {}
+        self.time_budget = time_budget
+        self.clock = clock
+
+    def bounds(self, positions, num_teams):
+        """Effective (minimum, maximum) per position; ValueError if infeasible"""
+        counts = Counter(positions)
+        bounds = {}
+        for position, count in counts.items():
+            minimum, maximum = self.quotas.get(position, (None, None))
+            if minimum is None:
+                minimum = count // num_teams
+            if maximum is None:
+                maximum = -(-count // num_teams)
+            if minimum * num_teams > count:
+                raise ValueError(
+                    f'{num_teams} teams with at least {minimum} {position} each need '
+                    f'{minimum * num_teams} players, but only {count} available.'
+                )
+            if maximum * num_teams < count:
+                raise ValueError(
+                    f'{count} {position} players do not fit in {num_teams} teams '
+                    f'with at most {maximum} each.'
+                )
+            bounds[position] = (minimum, maximum)
+
+        for position, (minimum, _) in self.quotas.items():
+            if minimum and position not in counts:
+                raise ValueError(f'Each team needs {minimum} {position}, but there are none.')
+        if sum(minimum for minimum, _ in bounds.values()) > len(positions) // num_teams:
+            raise ValueError('The position minimums add up to more players than a team can hold.')
+        return bounds
+
+    def assign(self, ratings, num_teams, positions=None):
+        if positions is None:
+            positions = [None] * len(ratings)
+        bounds = self.bounds(positions, num_teams)
+
+        base, extra = divmod(len(ratings), num_teams)
+        capacity = [base + (team < extra) for team in range(num_teams)]
+        buckets = {}
+        for i in _descending(ratings):
+            buckets.setdefault(positions[i], []).append(i)
+        # Positions with the least slack in their maximum are placed first
+        order = sorted(buckets, key=lambda position: bounds[position][1] * num_teams - len(buckets[position]))
+
+        assignment = [None] * len(ratings)
+        totals = [0] * num_teams
+        sizes = [0] * num_teams
+        counts = [dict.fromkeys(buckets, 0) for _ in range(num_teams)]
+
+        def place(i, team):
+            assignment[i] = team
+            totals[team] += ratings[i]
+            sizes[team] += 1
+            counts[team][positions[i]] += 1
+
+        #Step1- Deal every team its minimum of each position
+        leftovers = {}
+        for position in order:
+            players = buckets[position]
+            dealt = bounds[position][0] * num_teams
+            for start in range(0, dealt, num_teams):
+                weakest_first = sorted(range(num_teams), key=lambda team: totals[team])
+                for i, team in zip(players[start:start + num_teams], weakest_first):
+                    place(i, team)
+            leftovers[position] = players[dealt:]
+
+        #Step2- Hand out the rest, most free room first so no quota gets stranded
+        for position in order:
+            maximum = bounds[position][1]
+            for i in leftovers[position]:
+                eligible = [
+                    team for team in range(num_teams)
+                    if sizes[team] < capacity[team] and counts[team][position] < maximum
+                ]
+                if not eligible:
+                    raise ValueError('Could not satisfy the position quotas with these players.')
+                place(i, max(eligible, key=lambda team: (capacity[team] - sizes[team], -totals[team])))
+
+        #Step3- Swap players between teams while the quotas still hold
+        members = [[] for _ in range(num_teams)]
+        for i, team in enumerate(assignment):
+            members[team].append(i)
+        deadline = self.clock() + self.time_budget
+        while self.clock() < deadline:
+            swap = self._find_swap(ratings, positions, bounds, members, totals, counts)
+            if swap is None:
+                break
+            heavy, light, i, j = swap
+            moved = ratings[i] - (ratings[j] if j is not None else 0)
+            members[heavy].remove(i)
+            members[light].append(i)
+            counts[heavy][positions[i]] -= 1
+            counts[light][positions[i]] += 1
+            if j is not None:
+                members[light].remove(j)
+                members[heavy].append(j)
+                counts[light][positions[j]] -= 1
+                counts[heavy][positions[j]] += 1
+            totals[heavy] -= moved
+            totals[light] += moved
+
+        for team, team_members in enumerate(members):
+            for i in team_members:
+                assignment[i] = team
+        return assignment
+
+    @staticmethod
+    def _find_swap(ratings, positions, bounds, members, totals, counts):
+        by_total = sorted(range(len(totals)), key=lambda team: -totals[team])
+        pairs = sorted(
+            ((heavy, light) for a, heavy in enumerate(by_total) for light in by_total[a + 1:]),
+            key=lambda pair: totals[pair[1]] - totals[pair[0]]
+        )
+        for heavy, light in pairs:
+            gap = totals[heavy] - totals[light]
+            if gap <= 0:
+                break
+            givers, takers = {}, {}
+            for i in members[heavy]:
+                givers.setdefault(positions[i], []).append(i)
+            for j in sorted(members[light], key=lambda j: ratings[j]):
+                takers.setdefault(positions[j], []).append(j)
+            if len(members[heavy]) > len(members[light]):
+                takers[_MOVE] = [None]
+
+            best = None
+            for given, given_players in givers.items():
+                can_leave = (
+                    counts[heavy][given] - 1 >= bounds[given][0]
+                    and counts[light][given] + 1 <= bounds[given][1]
+                )
+                for taken, candidates in takers.items():
+                    # Same-position swaps never change the counts
+                    if taken != given:
+                        if not can_leave:
+                            continue
+                        if taken is not _MOVE and (
+                            counts[light][taken] - 1 < bounds[taken][0]
+                            or counts[heavy][taken] + 1 > bounds[taken][1]
+                        ):
+                            continue
+                    found = _best_partner(ratings, given_players, candidates, gap)
+                    if found is not None and (best is None or found[0] < best[0]):
+                        best = found
+            if best is not None:
+                return (heavy, light) + best[1:]
+        return None
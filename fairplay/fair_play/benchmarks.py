@@ -0,0 +1,232 @@
+"""Per-URL latency and query-count benchmarks, run by the ``benchmark`` command.
+
+Every URL name in ``fair_play.urls`` gets at least one case. Requests run
+through the test client as a seeded roster owner, each inside a transaction
+that is rolled back, so write endpoints can be timed repeatedly against the
+same data.
+"""
+import json
+import math
+import time
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import urls
+from .models import Job, Match, MatchParticipation, Player, Team
+
+# ``data`` may be a callable returning fresh data (e.g. an upload) per request;
+# ``headers`` are extra request headers
+BenchmarkCase = namedtuple('BenchmarkCase', 'label url_name method args data headers', defaults=(None,))
+# Matches whatever ETag a resource has, so the conditional GET is answered with a 304
+ANY_ETAG = {'If-None-Match': '*'}
+
+# Rows in the uploaded file of the roster import case
+IMPORT_ROWS = 40
+
+# Extra milliseconds a p95 may grow by before it counts as a regression,
+# so sub-millisecond views are not flagged for scheduler noise
+LATENCY_SLACK_MS = 2.0
+
+
+class BenchmarkSetupError(Exception):
+    """The owner lacks the data (teams, matches, ...) needed by the cases"""
+
+
+def url_names():
+    return [pattern.name for pattern in urls.urlpatterns if pattern.name]
+
+
+def benchmark_cases(owner):
+    """The cases for every URL, using ``owner``'s players, teams and matches"""
+    player = Player.objects.filter(owner=owner).exclude(user=owner).first()
+    teams = list(Team.objects.filter(owner=owner)[:2])
+    match = Match.objects.filter(team_A__owner=owner).order_by('-pk').first()
+    outsider = Player.objects.exclude(owner=owner).exclude(
+        user__in=Player.objects.filter(owner=owner).values('user')
+    ).select_related('user').first()
+    recruits = list(User.objects.exclude(
+        pk__in=Player.objects.filter(owner=owner).values('user')
+    ).values_list('username', flat=True)[:IMPORT_ROWS])
+
+    stat_sheet = {'form-TOTAL_FORMS': 0, 'form-INITIAL_FORMS': 0}
+    if match is not None:
+        participation_ids = MatchParticipation.objects.filter(match=match).values_list('pk', flat=True)
+        for i, participation_id in enumerate(participation_ids):
+            stat_sheet.update({
+                f'form-{i}-id': participation_id, f'form-{i}-minutes_played': 90,
+                f'form-{i}-goals': 0, f'form-{i}-assists': i % 2, f'form-{i}-match_rating': 7,
+            })
+        stat_sheet['form-TOTAL_FORMS'] = stat_sheet['form-INITIAL_FORMS'] = len(participation_ids)
+
+    def roster_file():
+        rows = ''.join(f'{username},,{70 + i % 20}\n' for i, username in enumerate(recruits))
+        return {'file': SimpleUploadedFile('roster.csv', f'username,position,rating\n{rows}'.encode())}
+
+    if player is None or len(teams) < 2 or match is None or outsider is None:
+        raise BenchmarkSetupError(
+            f'{owner.username} needs players, two teams and a match; run seed_data first.'
+        )
+    # A finished job for the status pages; never picked up by a worker
+    job, _ = Job.objects.get_or_create(
+        owner=owner, idempotency_key='benchmark',
+        defaults={'kind': 'generate_teams', 'status': Job.Status.SUCCEEDED, 'result': {'teams': 2}}
+    )
+
+    return [
+        BenchmarkCase('index', 'index', 'get', (), None),
+        BenchmarkCase('register', 'register', 'get', (), None),
+        BenchmarkCase('login', 'login', 'get', (), None),
+        BenchmarkCase('logout', 'logout', 'get', (), None),
+        BenchmarkCase('playeradd', 'playeradd', 'get', (), None),
+        BenchmarkCase('playeradd POST', 'playeradd', 'post', (), {
+            'username': outsider.user.username, 'rating': 70
+        }),
+        BenchmarkCase('playerimport', 'playerimport', 'get', (), None),
+        BenchmarkCase('playerimport POST', 'playerimport', 'post', (), roster_file),
+        BenchmarkCase('player_autocomplete', 'player_autocomplete', 'get', (), {
+            'q': outsider.user.username[:6]
+        }),
+        BenchmarkCase('playerslist', 'playerslist', 'get', (), None),
+        BenchmarkCase('playerdelete', 'playerdelete', 'get', (player.pk,), None),
+        BenchmarkCase('playerdelete POST', 'playerdelete', 'post', (player.pk,), {}),
+        BenchmarkCase('playerupdate', 'playerupdate', 'get', (player.pk,), None),
+        BenchmarkCase('playerupdate POST', 'playerupdate', 'post', (player.pk,), {
+            'position': player.position, 'rating': 75
+        }),
+        BenchmarkCase('reset', 'reset', 'get', (), None),
+        BenchmarkCase('reset POST', 'reset', 'post', (), {}),
+        BenchmarkCase('team_form', 'team_form', 'get', (), None),
+        BenchmarkCase('generate_teams POST', 'generate_teams', 'post', (), {
+            'num_teams': 2, 'team_1_name': 'Red', 'team_2_name': 'Blue'
+        }),
+        BenchmarkCase('teams_display', 'teams_display', 'get', (), None),
+        BenchmarkCase('team_history', 'team_history', 'get', (teams[0].pk,), None),
+        BenchmarkCase('team_roster_export', 'team_roster_export', 'get', (teams[0].pk, 'csv'), None),
+        BenchmarkCase('team_matches_export', 'team_matches_export', 'get', (teams[0].pk, 'csv'), None),
+        BenchmarkCase('standings', 'standings', 'get', (), None),
+        BenchmarkCase('match_list', 'match_list', 'get', (), None),
+        BenchmarkCase('match_export csv', 'match_export', 'get', ('csv',), None),
+        BenchmarkCase('match_export ndjson', 'match_export', 'get', ('ndjson',), None),
+        BenchmarkCase('match_create', 'match_create', 'get', (), None),
+        BenchmarkCase('match_create POST', 'match_create', 'post', (), {
+            'team_A': teams[0].pk, 'team_B': teams[1].pk, 'location': 'Benchmark Park'
+        }),
+        BenchmarkCase('match_detail', 'match_detail', 'get', (match.pk,), None),
+        BenchmarkCase('match_stats', 'match_stats', 'get', (match.pk,), None),
+        BenchmarkCase('match_stats POST', 'match_stats', 'post', (match.pk,), stat_sheet),
+        BenchmarkCase('match_record_result', 'match_record_result', 'get', (match.pk,), None),
+        BenchmarkCase('match_record_result POST', 'match_record_result', 'post', (match.pk,), {
+            'score_a': 2, 'score_b': 1, 'status': Match.Status.PLAYED
+        }),
+        BenchmarkCase('my_history', 'my_history', 'get', (), None),
+        BenchmarkCase('my_history_export', 'my_history_export', 'get', ('csv',), None),
+        BenchmarkCase('job_detail', 'job_detail', 'get', (job.pk,), None),
+        BenchmarkCase('job_status', 'job_status', 'get', (job.pk,), None),
+        BenchmarkCase('metrics', 'metrics', 'get', (), None),
+        BenchmarkCase('api_players', 'api_players', 'get', (), None),
+        BenchmarkCase('api_players 304', 'api_players', 'get', (), None, ANY_ETAG),
+        BenchmarkCase('api_players POST', 'api_players', 'post', (), {'username': outsider.user.username}),
+        BenchmarkCase('api_player', 'api_player', 'get', (player.pk,), None),
+        BenchmarkCase('api_player PATCH', 'api_player', 'patch', (player.pk,), {'rating': 75}),
+        BenchmarkCase('api_player DELETE', 'api_player', 'delete', (player.pk,), None),
+        BenchmarkCase('api_teams', 'api_teams', 'get', (), None),
+        BenchmarkCase('api_teams 304', 'api_teams', 'get', (), None, ANY_ETAG),
+        BenchmarkCase('api_teams POST', 'api_teams', 'post', (), {'team_names': ['Red', 'Blue']}),
+        BenchmarkCase('api_team', 'api_team', 'get', (teams[0].pk,), None),
+        BenchmarkCase('api_matches', 'api_matches', 'get', (), None),
+        BenchmarkCase('api_matches 304', 'api_matches', 'get', (), None, ANY_ETAG),
+        BenchmarkCase('api_matches POST', 'api_matches', 'post', (), {
+            'team_a_id': teams[0].pk, 'team_b_id': teams[1].pk, 'location': 'Benchmark Park'
+        }),
+        BenchmarkCase('api_match', 'api_match', 'get', (match.pk,), None),
+        BenchmarkCase('api_match PATCH', 'api_match', 'patch', (match.pk,), {
+            'score_a': 2, 'score_b': 1, 'status': Match.Status.PLAYED
+        }),
+        BenchmarkCase('api_history', 'api_history', 'get', (), None),
+        BenchmarkCase('api_history 304', 'api_history', 'get', (), None, ANY_ETAG),
+    ]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def run_case(owner, case, repeat=20, warmup=2):
+    """Time ``case`` and return its status, query count and p50/p95 in milliseconds"""
+    client = Client()
+    url = reverse(case.url_name, args=case.args)
+    timings = []
+    queries = 0
+    status = None
+    for run in range(warmup + repeat):
+        # Logging in again keeps the logout case from affecting the next run
+        client.force_login(owner)
+        data = case.data() if callable(case.data) else case.data
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                if case.method == 'get':
+                    response = client.get(url, data, headers=case.headers)
+                elif case.url_name.startswith('api_'):
+                    # The API reads JSON bodies
+                    response = getattr(client, case.method)(
+                        url, data, content_type='application/json', headers=case.headers
+                    )
+                else:
+                    response = client.post(url, data, headers=case.headers)
+                if response.streaming:
+                    # Exports run their queries while the body is read
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        if run >= warmup:
+            timings.append(elapsed * 1000)
+            queries = max(queries, len(ctx.captured_queries))
+            status = response.status_code
+    return {
+        'status': status,
+        'queries': queries,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Regressions of ``results`` against a baseline, as readable messages.
+
+    A case regresses when it runs more queries than before, or when its p95
+    grows by more than ``tolerance`` (a fraction) plus LATENCY_SLACK_MS.
+    """
+    regressions = []
+    for label, result in results.items():
+        before = baseline.get('cases', {}).get(label)
+        if before is None:
+            continue
+        if result['queries'] > before['queries']:
+            regressions.append(f"{label}: {before['queries']} -> {result['queries']} queries")
+        limit = before['p95_ms'] * (1 + tolerance) + LATENCY_SLACK_MS
+        if result['p95_ms'] > limit:
+            regressions.append(f"{label}: p95 {before['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results, dataset):
+    with open(path, 'w') as file:
+        json.dump({'dataset': dataset, 'cases': results}, file, indent=2, sort_keys=True)
+        file.write('\n')
@@ -0,0 +1,73 @@
+"""Per-owner roster versions and the cache keys built from them.
+
+Every write to an owner's players, teams, memberships or matches gives the
+owner a new roster version (see ``roster_changed``). Fragments and computed
+stats are cached under keys that include the versions they depend on, so a
+write invalidates them in O(1) without tracking which keys exist.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import roster_changed
+from .routers import analytics_generation
+
+
+def _version_key(owner_id):
+    return f'fair_play:roster_version:{owner_id}'
+
+
+def _new_version():
+    # Never reused, even when an evicted version is recreated, so a fragment
+    # cached under an old version can not come back to life
+    return time.time_ns()
+
+
+def fragment_timeout():
+    return getattr(settings, 'FAIRPLAY_FRAGMENT_TIMEOUT', 60 * 60)
+
+
+def roster_versions(owner_ids):
+    """{owner id: current roster version}, starting one for owners without"""
+    keys = {_version_key(owner_id): owner_id for owner_id in set(owner_ids)}
+    found = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def roster_version(*owner_ids):
+    """A single token for the roster versions of one or more owners"""
+    versions = sorted(roster_versions(owner_ids).items())
+    if len(versions) == 1:
+        return f'{versions[0][0]}.{versions[0][1]}'
+    return hashlib.md5(repr(versions).encode()).hexdigest()
+
+
+def cached_for_owners(name, owner_ids, compute):
+    """``compute()``, cached until the roster of any of ``owner_ids`` changes.
+
+    Values computed from an analytics replica are also keyed on its snapshot.
+    """
+    key = f'fair_play:{name}:{roster_version(*owner_ids)}{analytics_generation()}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, fragment_timeout())
+    return value
+
+
+@receiver(roster_changed)
+def bump_roster_versions(sender, owner_ids, **kwargs):
+    def bump():
+        cache.set_many({_version_key(owner_id): _new_version() for owner_id in owner_ids}, timeout=None)
+    bump()
+    # A reader may cache fragments of the old data under the new version
+    # before the write commits; bump once more after the commit
+    transaction.on_commit(bump)
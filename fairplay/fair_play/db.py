@@ -0,0 +1,99 @@
+"""SQLite connection tuning and retries for writes that find the database locked.
+
+Every new SQLite connection gets the pragmas in ``FAIRPLAY_SQLITE_PRAGMAS``.
+The defaults turn on write-ahead logging, where readers no longer block the
+writer or each other. ``synchronous=NORMAL`` is safe with WAL (a power cut
+may lose the last commits but never corrupts the file). They also set a
+busy timeout and larger mmap and page caches. With ``CONN_MAX_AGE`` the
+cost is paid once per connection, not once per request.
+
+SQLite still allows one writer at a time. A transaction that read before
+writing cannot wait for another writer's lock: it fails at once with
+"database is locked". ``retry_on_locked`` reruns such short transactions
+with a randomized exponential backoff.
+"""
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Attempts, first backoff and backoff cap (seconds) of retry_on_locked
+WRITE_ATTEMPTS = 5
+WRITE_RETRY_DELAY = 0.05
+WRITE_RETRY_MAX_DELAY = 1.0
+
+LOCKED_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'FAIRPLAY_SQLITE_PRAGMAS', {})
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply FAIRPLAY_SQLITE_PRAGMAS to a new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    # On the raw connection, so the pragmas are not logged or counted as
+    # queries of whatever request happened to open the connection
+    for name, value in sqlite_pragmas().items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def is_locked_error(error):
+    return isinstance(error, OperationalError) and any(message in str(error) for message in LOCKED_MESSAGES)
+
+
+def retry_on_locked(func=None, *, attempts=WRITE_ATTEMPTS, delay=WRITE_RETRY_DELAY,
+                    max_delay=WRITE_RETRY_MAX_DELAY, using=None):
+    """Run ``func`` in a transaction, retried while the database is locked.
+
+    Use as a decorator, bare or with arguments, or wrap a callable in place:
+    ``retry_on_locked(reset_roster)(owner_id)``. The wrapped function must be
+    safe to run again: a failed attempt is rolled back, but anything it did
+    outside the database (sleeping, mutating objects) is not. To save an
+    edited model instance, use ``save_fresh``. Inside
+    another transaction ``func`` simply runs, since only the outermost
+    transaction can be retried.
+    """
+    if func is None:
+        return functools.partial(retry_on_locked, attempts=attempts, delay=delay, max_delay=max_delay, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if transaction.get_connection(using).in_atomic_block:
+            return func(*args, **kwargs)
+        for attempt in range(attempts):
+            try:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+            except OperationalError as error:
+                if not is_locked_error(error) or attempt == attempts - 1:
+                    raise
+            # Random ("full jitter") backoff keeps the losers of one
+            # collision from colliding again
+            time.sleep(random.uniform(0, min(max_delay, delay * 2 ** attempt)))
+    return wrapper
+
+
+def save_fresh(instance, fields):
+    """Write ``fields`` of ``instance`` to its row, retried while the database is locked.
+
+    Each attempt loads the row again and saves the new values on that copy.
+    The post_save hooks compare a model with the values it was loaded with
+    (team aggregates, career totals) and then take the saved values as
+    loaded. A retried ``instance.save`` would find the values of the
+    rolled-back attempt there and skip its updates. Returns the saved copy.
+    """
+    @retry_on_locked
+    def save():
+        fresh = type(instance)._default_manager.get(pk=instance.pk)
+        for field in fields:
+            setattr(fresh, field, getattr(instance, field))
+        fresh.save(update_fields=fields)
+        return fresh
+    return save()
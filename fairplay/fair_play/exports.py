@@ -0,0 +1,165 @@
+"""Streaming CSV and NDJSON exports of match history and team rosters.
+
+Rows come from ``values_list`` queries over the needed joins, read with
+``.iterator()`` so the database cursor is consumed a chunk at a time, and
+each row is encoded and sent as soon as it is read. Memory use does not
+depend on how many rows are exported. The queries run on the analytics
+database when one is configured (see routers.py).
+
+Under ASGI (``FAIRPLAY_ASYNC_VIEWS``) Django would read a synchronous
+stream to the end before sending any of it, so the lines are handed over
+as an async iterator instead, a batch per ``sync_to_async`` hop.
+"""
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, Q
+from django.http import StreamingHttpResponse
+
+from .models import Match, MatchParticipation, Team, TeamMembership
+from .routers import for_analytics
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+# Rows fetched from the database cursor at a time
+EXPORT_CHUNK_SIZE = 2000
+# Lines read per sync_to_async hop when streaming under ASGI
+EXPORT_ASYNC_BATCH = 500
+
+MATCH_COLUMNS = (
+    'match_id', 'played_at', 'status', 'location', 'team', 'opponent', 'goals_for', 'goals_against', 'result'
+)
+PARTICIPATION_COLUMNS = MATCH_COLUMNS + (
+    'username', 'position', 'minutes_played', 'goals', 'assists', 'match_rating'
+)
+ROSTER_COLUMNS = ('username', 'first_name', 'last_name', 'position', 'rating', 'joined_at', 'left_at', 'current')
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_value(value):
+    """_value(), with free text that would be read as a formula quoted by a leading apostrophe"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return _value(value)
+
+
+def encode_rows(columns, rows, fmt):
+    """Lines of a CSV file (with a header) or of NDJSON, one per row"""
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow(map(_csv_value, row))
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(columns, map(_value, row))), separators=(',', ':')) + '\n'
+
+
+async def _async_lines(lines):
+    """``lines`` as an async iterator, read a batch at a time on the request's sync thread.
+
+    That thread holds the database connection the rows are read with.
+    """
+    read_batch = sync_to_async(lambda: ''.join(islice(lines, EXPORT_ASYNC_BATCH)))
+    try:
+        # Every line ends with a newline, so only the end gives an empty batch
+        while batch := await read_batch():
+            yield batch
+    finally:
+        # Closes the database cursor if the client went away part way
+        await sync_to_async(lines.close)()
+
+
+def export_response(filename, columns, rows, fmt):
+    """A StreamingHttpResponse downloading ``rows`` as ``filename.<fmt>``"""
+    lines = encode_rows(columns, rows, fmt)
+    if settings.FAIRPLAY_ASYNC_VIEWS:
+        lines = _async_lines(lines)
+    response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+def _match_line(team_id, team_name, status, played_at, location, team_a_id, team_a_name, team_b_name,
+                score_a, score_b, match_id):
+    """MATCH_COLUMNS of a match seen from the side of ``team_id``"""
+    is_team_a = team_id == team_a_id
+    goals_for, goals_against = (score_a, score_b) if is_team_a else (score_b, score_a)
+    result = ''
+    if status == Match.Status.PLAYED and goals_for is not None and goals_against is not None:
+        result = 'W' if goals_for > goals_against else 'D' if goals_for == goals_against else 'L'
+    return (
+        match_id, played_at, status, location, team_name, team_b_name if is_team_a else team_a_name,
+        goals_for, goals_against, result
+    )
+
+
+# Fields read for _match_line, after the team id and name
+_MATCH_FIELDS = (
+    'match__status', 'match__played_at', 'match__location', 'match__team_A_id', 'match__team_A__name',
+    'match__team_B__name', 'match__score_a', 'match__score_b', 'match_id'
+)
+_PARTICIPATION_ORDER = ('-match__played_at', '-match__date_created', 'match_id', 'team_id', 'player__user__username')
+
+
+def _participation_rows(participations):
+    rows = for_analytics(participations).order_by(*_PARTICIPATION_ORDER).values_list(
+        'team_id', 'team__name', *_MATCH_FIELDS,
+        'player__user__username', 'player__position', 'minutes_played', 'goals', 'assists', 'match_rating'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield _match_line(*row[:11]) + row[11:]
+
+
+def player_history_rows(user):
+    """PARTICIPATION_COLUMNS of every match ``user`` took part in, on any roster"""
+    return _participation_rows(MatchParticipation.objects.filter(player__user=user))
+
+
+def owner_history_rows(owner):
+    """PARTICIPATION_COLUMNS of every participation in matches of ``owner``'s teams"""
+    team_ids = list(for_analytics(Team.objects.filter(owner=owner)).values_list('pk', flat=True))
+    return _participation_rows(MatchParticipation.objects.filter(team_id__in=team_ids))
+
+
+def team_match_rows(team):
+    """MATCH_COLUMNS of every match ``team`` played or is scheduled to play"""
+    rows = for_analytics(Match.objects.filter(Q(team_A=team) | Q(team_B=team))).order_by(
+        '-played_at', '-date_created', '-pk'
+    ).values_list(
+        *(field.replace('match__', '', 1) for field in _MATCH_FIELDS[:-1]), 'pk'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield _match_line(team.pk, team.name, *row)
+
+
+def team_roster_rows(team):
+    """ROSTER_COLUMNS of everyone who has been on ``team``, current members first"""
+    rows = for_analytics(TeamMembership.objects.filter(team=team)).order_by(
+        F('left_at').asc(nulls_first=True), 'player__user__username'
+    ).values_list(
+        'player__user__username', 'player__user__first_name', 'player__user__last_name',
+        'player__position', 'player__rating', 'joined_at', 'left_at'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield row + (row[-1] is None,)
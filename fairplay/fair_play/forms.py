@@ -1,7 +1,9 @@
 from django import forms
 from .models import Player, Team, Match, MatchParticipation
+from .roster import MIN_TEAMS
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.utils.functional import cached_property
 
 class PlayerSearchForm(forms.Form):
     username = forms.CharField(
@@ -9,7 +11,9 @@ class PlayerSearchForm(forms.Form):
         widget=forms.TextInput(attrs={
             'class':'form-control',
             'placeholder':'Search for Username...',
-            'autocomplete':'on'
+            # Suggestions come from the player_autocomplete endpoint instead
+            'autocomplete':'off',
+            'list':'username-suggestions'
         }),
         help_text='Enter the username of a registered player'
     )
@@ -33,9 +37,33 @@ class PlayerSearchForm(forms.Form):
     )
     
 
+class PlayerUpdateForm(forms.ModelForm):
+    """Position and rating of a roster player"""
+    class Meta:
+        model = Player
+        fields = ['position', 'rating']
+
+
+class RosterImportForm(forms.Form):
+    file = forms.FileField(
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.csv,.json,.jsonl,.ndjson'
+        }),
+        help_text='CSV with a header row, a JSON array or JSON lines, with username, position and rating'
+    )
+    format = forms.ChoiceField(
+        choices=[('', 'From the file name'), ('csv', 'CSV'), ('json', 'JSON / JSON lines')],
+        required=False,
+        widget=forms.Select(attrs={
+            'class': 'form-control'
+        }),
+    )
+
+
 class TeamForm(forms.Form):
     number_of_teams = forms.IntegerField(
-        min_value=2,
+        min_value=MIN_TEAMS,
         max_value=10,
         label = 'No of Teams',
         widget=forms.NumberInput(attrs={
@@ -135,8 +163,8 @@ class MatchForm(forms.ModelForm):
     def __init__(self, user, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Only show teams owned by the current user
-        self.fields['team_A'].queryset = Team.objects.filter(owner=user)
-        self.fields['team_B'].queryset = Team.objects.filter(owner=user)
+        self.fields['team_A'].queryset = Team.objects.editable_by(user)
+        self.fields['team_B'].queryset = Team.objects.editable_by(user)
     
     def clean(self):
         cleaned_data = super().clean()
@@ -169,3 +197,90 @@ class MatchResultForm(forms.ModelForm):
         }
 
     
+
+
+class ParticipationStatsForm(forms.ModelForm):
+    """One row of a match's stat sheet"""
+    class Meta:
+        model = MatchParticipation
+        fields = ['minutes_played', 'goals', 'assists', 'match_rating']
+        widgets = {
+            'minutes_played': forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'min': '0'}),
+            'goals': forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'min': '0'}),
+            'assists': forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'min': '0'}),
+            'match_rating': forms.NumberInput(attrs={
+                'class': 'form-control form-control-sm',
+                'min': '1',
+                'max': '10'
+            }),
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for field in ('minutes_played', 'goals', 'assists'):
+            value = cleaned_data.get(field)
+            if value is not None and value < 0:
+                self.add_error(field, 'Cannot be negative.')
+        return cleaned_data
+
+
+class LoadedRowField(forms.ModelChoiceField):
+    """The hidden row id of a model formset, resolved from rows already loaded.
+
+    The stock field runs one ``queryset.get()`` per form.
+    """
+
+    def __init__(self, rows, *args, **kwargs):
+        self.rows = rows
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.rows[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
+class BaseStatSheetFormSet(forms.BaseModelFormSet):
+    """Stat sheet of a whole match; checked as a whole before anything is saved"""
+
+    def __init__(self, *args, match, **kwargs):
+        self.match = match
+        super().__init__(*args, **kwargs)
+
+    @cached_property
+    def rows(self):
+        return {row.pk: row for row in self.get_queryset()}
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        field = form.fields[self.model._meta.pk.name]
+        form.fields[self.model._meta.pk.name] = LoadedRowField(
+            self.rows, field.queryset, required=field.required, widget=field.widget
+        )
+
+    def clean(self):
+        super().clean()
+        if any(self.errors) or self.match.score_a is None or self.match.score_b is None:
+            return
+        goals = {self.match.team_A_id: 0, self.match.team_B_id: 0}
+        for form in self.forms:
+            team_id = form.instance.team_id
+            goals[team_id] = goals.get(team_id, 0) + (form.cleaned_data.get('goals') or 0)
+        for team, score in ((self.match.team_A, self.match.score_a), (self.match.team_B, self.match.score_b)):
+            if goals[team.pk] > score:
+                raise forms.ValidationError(
+                    f'{team.name} players are credited with {goals[team.pk]} goals but the team scored {score}.'
+                )
+
+
+StatSheetFormSet = forms.modelformset_factory(
+    MatchParticipation,
+    form=ParticipationStatsForm,
+    formset=BaseStatSheetFormSet,
+    extra=0,
+    # Rows are the match's participations; a posted form cannot add one
+    edit_only=True
+)
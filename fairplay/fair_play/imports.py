@@ -0,0 +1,211 @@
+"""Bulk roster import from CSV or JSON files.
+
+Rows are read lazily from the file (a JSON array is decoded one object at a
+time too) and handled in chunks: each chunk costs one query to resolve its
+usernames (with their profiles), one to find which of them are already on
+the roster and one ``bulk_create``, however many rows it holds. Every row
+is validated with ``PlayerSearchForm``, the form behind ``add_player_view``,
+and a bad row is reported without stopping the import.
+"""
+import csv
+import io
+import json
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .forms import PlayerSearchForm
+from .models import Player, notify_owners, roster_changed
+
+IMPORT_BATCH_SIZE = 100
+FORMATS = ('csv', 'json')
+# Bytes read from a JSON file at a time
+JSON_CHUNK_SIZE = 64 * 1024
+
+RowError = namedtuple('RowError', 'row username message')
+ImportResult = namedtuple('ImportResult', 'created errors')
+
+# 'Striker', 'striker' and 'ST' all mean Player.Position.ST
+POSITION_ALIASES = {
+    **{value.lower(): value for value in Player.Position.values},
+    **{name.lower(): value for name, value in zip(Player.Position.names, Player.Position.values)},
+}
+
+
+class ImportFormatError(Exception):
+    """The file cannot be read as the expected format"""
+
+
+def detect_format(filename):
+    """'csv' or 'json' from a file name, or None if the extension is unknown"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'csv':
+        return 'csv'
+    if extension in ('json', 'jsonl', 'ndjson'):
+        return 'json'
+    return None
+
+
+def read_csv(file):
+    """Rows of a CSV file with a header line (username, position, rating)"""
+    reader = csv.DictReader(file)
+    if not reader.fieldnames or 'username' not in [name.strip().lower() for name in reader.fieldnames]:
+        raise ImportFormatError('The CSV file needs a header row with a "username" column.')
+    try:
+        for row in reader:
+            yield {(key or '').strip().lower(): value for key, value in row.items()}
+    except csv.Error as error:
+        raise ImportFormatError(f'Line {reader.line_num}: {error}')
+
+
+def read_json(file):
+    """Objects of a JSON array or of JSON lines, decoded one at a time.
+
+    A malformed object stops the import as soon as it is complete; the rest
+    of the file is not read.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    # Line of the file the buffer starts on
+    line = 1
+    exhausted = False
+    while True:
+        # Skip the separators around objects: whitespace, '[', ',' and ']'
+        while position < len(buffer) and buffer[position] in ' \t\r\n[],':
+            position += 1
+        if position < len(buffer):
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                # No string, number or literal spans a line break, so an error
+                # with one after it is not an object cut in two by the chunk
+                # boundary
+                if exhausted or buffer.find('\n', error.pos) != -1:
+                    number = line + buffer.count('\n', 0, error.pos)
+                    raise ImportFormatError(f'Invalid JSON on line {number}: {error.msg}.')
+            else:
+                if not isinstance(item, dict):
+                    raise ImportFormatError('Every JSON item must be an object with a "username" key.')
+                yield {str(key).lower(): value for key, value in item.items()}
+                continue
+        if exhausted:
+            return
+        chunk = file.read(JSON_CHUNK_SIZE)
+        exhausted = not chunk
+        line += buffer.count('\n', 0, position)
+        buffer, position = buffer[position:] + chunk, 0
+
+
+def read_rows(file, fmt):
+    """Rows of a binary or text file, as dicts with lower-case keys"""
+    if fmt not in FORMATS:
+        raise ImportFormatError(f'Unsupported format "{fmt}", use one of: {", ".join(FORMATS)}.')
+    if not isinstance(file, io.TextIOBase):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        yield from (read_csv(file) if fmt == 'csv' else read_json(file))
+    except UnicodeDecodeError:
+        raise ImportFormatError('The file is not UTF-8 encoded text.')
+
+
+def _form_data(row):
+    position = row.get('position_override', row.get('position'))
+    position = '' if position is None else str(position).strip()
+    rating = row.get('rating')
+    rating = '' if rating is None else str(rating).strip()
+    return {
+        'username': '' if row.get('username') is None else str(row['username']).strip(),
+        'position_override': POSITION_ALIASES.get(position.lower(), position),
+        # Like add_player_view, a missing rating means the form's initial 70
+        'rating': rating or PlayerSearchForm.base_fields['rating'].initial,
+    }
+
+
+def _form_errors(form):
+    return '; '.join(
+        f'{field}: {" ".join(errors)}' if field != '__all__' else ' '.join(errors)
+        for field, errors in form.errors.items()
+    )
+
+
+def _import_chunk(owner, chunk, seen):
+    """Validate and insert one chunk of (row number, row) pairs"""
+    errors = []
+    valid = []
+    for number, row in chunk:
+        form = PlayerSearchForm(_form_data(row))
+        if form.is_valid():
+            valid.append((number, form.cleaned_data))
+        else:
+            errors.append(RowError(number, str(row.get('username') or ''), _form_errors(form)))
+
+    usernames = {data['username'] for _, data in valid}
+    users = {
+        user['username']: user
+        for user in User.objects.filter(username__in=usernames).values(
+            'id', 'username', 'profile__preferred_position'
+        )
+    }
+    on_roster = set(
+        Player.objects.filter(owner=owner, user_id__in=[user['id'] for user in users.values()])
+        .values_list('user_id', flat=True)
+    )
+
+    players = []
+    for number, data in valid:
+        user = users.get(data['username'])
+        if user is None:
+            errors.append(RowError(number, data['username'], f'User "{data["username"]}" not found.'))
+        elif user['id'] in on_roster or user['id'] in seen:
+            errors.append(RowError(number, data['username'], f'{data["username"]} is already on your roster.'))
+        else:
+            seen.add(user['id'])
+            players.append(Player(
+                user_id=user['id'],
+                owner=owner,
+                position=data['position_override'] or user['profile__preferred_position'] or Player.Position.ST,
+                rating=data['rating']
+            ))
+    Player.objects.bulk_create(players)
+    return len(players), errors
+
+
+def import_roster(owner, rows, batch_size=IMPORT_BATCH_SIZE):
+    """Add the players described by ``rows`` to ``owner``'s roster.
+
+    Each chunk of ``batch_size`` rows is inserted in its own transaction.
+    Returns an ImportResult with the number of players created and a
+    RowError for every rejected row, numbered from 1 (a CSV header is not
+    counted). A file that stops being readable part way through keeps the
+    rows before that point and reports the problem as its last error.
+    """
+    created = 0
+    errors = []
+    seen = set()
+    chunk = []
+
+    def flush():
+        nonlocal created
+        with transaction.atomic():
+            count, chunk_errors = _import_chunk(owner, chunk, seen)
+        created += count
+        errors.extend(chunk_errors)
+        chunk.clear()
+
+    number = 0
+    try:
+        for number, row in enumerate(rows, start=1):
+            chunk.append((number, row))
+            if len(chunk) >= batch_size:
+                flush()
+    except ImportFormatError as error:
+        errors.append(RowError(number + 1, '', str(error)))
+    if chunk:
+        flush()
+    if created:
+        # bulk_create sends no post_save, so cached roster pages are
+        # invalidated here, once
+        notify_owners(roster_changed, owner_ids=[owner.pk])
+    return ImportResult(created, sorted(errors))
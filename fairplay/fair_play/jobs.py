@@ -0,0 +1,213 @@
+"""Background jobs kept in the database, so no message broker is needed.
+
+Views queue slow work with ``enqueue()`` and answer at once with a page
+that polls the job's status. ``manage.py run_jobs`` runs the queued jobs
+on a pool of threads (and optionally several processes). Job kinds are
+registered with ``@task`` (see fair_play.tasks).
+
+Workers claim a job with a conditional UPDATE (``WHERE status = 'queued'``),
+so two workers never run the same job, on SQLite or any other database.
+A claimed job is leased for ``LEASE_SECONDS``. If its worker dies, the job
+is queued again once the lease runs out, up to ``MAX_ATTEMPTS`` times in
+all, and so is a job that found the database locked. Task functions
+should therefore be safe to run twice.
+
+A request carrying an idempotency key (the ``Idempotency-Key`` header, or
+the ``idempotency_key`` field the job forms render) gets the job queued
+for that key the first time, so a double submit or a retried POST does
+not run the work twice.
+"""
+import logging
+import os
+import socket
+import threading
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections, connection
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from .db import is_locked_error, retry_on_locked
+from .metrics import track
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker may hold a job before it is presumed lost
+LEASE_SECONDS = 15 * 60
+# Runs of one job, the first included, before it is given up on
+MAX_ATTEMPTS = 3
+# Seconds before a job that found the database locked is tried again
+RETRY_DELAY = 5
+
+Task = namedtuple('Task', 'function label next_url')
+
+TASKS = {}
+
+
+def task(name, label, next_url=None):
+    """Register ``function(job)`` as the job kind ``name``.
+
+    Its return value, which must be JSON serializable, is stored as the
+    job's result; a ``'message'`` in it is shown to the user. ``next_url``
+    names the page to go to once the job has succeeded.
+    """
+    def register(function):
+        TASKS[name] = Task(function, label, next_url)
+        return function
+    return register
+
+
+def enqueue(kind, owner=None, idempotency_key=None, **arguments):
+    """Queue a ``kind`` job, or return the owner's job queued under ``idempotency_key``"""
+    if kind not in TASKS:
+        raise ValueError(f'Unknown job kind "{kind}"')
+    idempotency_key = idempotency_key or None
+    if idempotency_key is not None:
+        existing = Job.objects.filter(owner=owner, idempotency_key=idempotency_key).first()
+        if existing is not None:
+            return existing
+    try:
+        return retry_on_locked(Job.objects.create)(
+            kind=kind, owner=owner, idempotency_key=idempotency_key, arguments=arguments
+        )
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        # The same request, queued by a concurrent submit
+        return Job.objects.get(owner=owner, idempotency_key=idempotency_key)
+
+
+def job_status(job):
+    """The job as a JSON-serializable dict, for status polling"""
+    entry = TASKS.get(job.kind)
+    status = {
+        'id': job.pk,
+        'kind': job.kind,
+        'label': entry.label if entry else job.kind,
+        'status': job.status,
+        'finished': job.finished,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'result': job.result,
+        'error': job.error if job.status == Job.Status.FAILED else '',
+        'next_url': None,
+    }
+    if job.status == Job.Status.SUCCEEDED and entry and entry.next_url:
+        status['next_url'] = reverse(entry.next_url)
+    return status
+
+
+@retry_on_locked
+def requeue_lost():
+    """Queue again the running jobs whose lease ran out, failing those out of attempts"""
+    now = timezone.now()
+    lost = Job.objects.filter(status=Job.Status.RUNNING, lease_expires_at__lt=now)
+    failed = lost.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=Job.Status.FAILED, finished_at=now, lease_expires_at=None,
+        error='The worker running this job stopped before it finished.'
+    )
+    requeued = lost.update(status=Job.Status.QUEUED, worker='', lease_expires_at=None, run_after=now)
+    return failed + requeued
+
+
+def claim(worker):
+    """Mark the next due job as running on ``worker`` and return it; None if nothing is due"""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.Status.QUEUED, run_after__lte=now).order_by('run_after', 'pk')
+    # Other workers may take some of these first
+    for pk in due.values_list('pk', flat=True)[:10]:
+        claimed = retry_on_locked(due.filter(pk=pk).update)(
+            status=Job.Status.RUNNING, worker=worker, attempts=F('attempts') + 1, started_at=now,
+            lease_expires_at=now + timedelta(seconds=LEASE_SECONDS)
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record how it went"""
+    entry = TASKS.get(job.kind)
+    try:
+        if entry is None:
+            raise ValueError(f'Unknown job kind "{job.kind}"')
+        with track(f'job:{job.kind}'):
+            result = entry.function(job)
+    except Exception as error:
+        if is_locked_error(error) and job.attempts < MAX_ATTEMPTS:
+            logger.warning('Job %s found the database locked, retrying', job.pk)
+            changes = {
+                'status': Job.Status.QUEUED, 'worker': '',
+                'run_after': timezone.now() + timedelta(seconds=RETRY_DELAY * job.attempts),
+            }
+        else:
+            # A ValueError carries a message for the user (an empty roster, a
+            # quota it cannot meet). Anything else is a bug, whose traceback
+            # goes to the log only
+            if isinstance(error, ValueError):
+                logger.info('Job %s (%s) failed: %s', job.pk, job.kind, error)
+                message = str(error)
+            else:
+                logger.exception('Job %s (%s) failed', job.pk, job.kind)
+                message = f'{entry.label} failed unexpectedly. Please try again later.'
+            changes = {'status': Job.Status.FAILED, 'error': message, 'finished_at': timezone.now()}
+    else:
+        changes = {'status': Job.Status.SUCCEEDED, 'result': result, 'error': '', 'finished_at': timezone.now()}
+    changes['lease_expires_at'] = None
+    # Only if the job is still ours: after a lost lease another worker owns it
+    retry_on_locked(Job.objects.filter(pk=job.pk, worker=job.worker, status=Job.Status.RUNNING).update)(
+        **changes
+    )
+    for field, value in changes.items():
+        setattr(job, field, value)
+    return job
+
+
+def worker_name(index=0):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def work(name, stop, poll=1.0, burst=False, max_jobs=None):
+    """Run jobs on this thread until ``stop`` is set (or, with ``burst``, the queue is empty).
+
+    Returns the number of jobs run.
+    """
+    done = 0
+    try:
+        while not stop.is_set() and (max_jobs is None or done < max_jobs):
+            # As the request cycle does: drop connections past CONN_MAX_AGE or broken
+            close_old_connections()
+            job = claim(name)
+            if job is None:
+                if requeue_lost():
+                    continue
+                if burst:
+                    break
+                stop.wait(poll)
+                continue
+            run_job(job)
+            done += 1
+    finally:
+        connection.close()
+    return done
+
+
+def run_workers(threads=1, poll=1.0, burst=False, stop=None):
+    """Run ``threads`` worker threads until ``stop`` is set; returns the number of jobs run"""
+    stop = stop or threading.Event()
+    counts = [0] * threads
+
+    def target(index):
+        counts[index] = work(worker_name(index), stop, poll=poll, burst=burst)
+
+    pool = [threading.Thread(target=target, args=(index,), name=f'fair_play-worker-{index}') for index in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(counts)
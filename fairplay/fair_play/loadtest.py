@@ -0,0 +1,232 @@
+"""Concurrent load against the WSGI and ASGI handlers, run by the ``loadtest`` command.
+
+Requests go to the same application objects a server calls:
+``get_wsgi_application()``, called from a fixed pool of worker threads
+(gunicorn's gthread workers), or ``get_asgi_application()``, awaited on
+one event loop (uvicorn). Nothing goes over the network, so the numbers
+measure the handlers and views, not a server's HTTP parsing.
+
+``clients`` simulated users send GETs of the read views back to back and
+``writers`` more users send POSTs. Latency counts from when a request is
+sent, so it includes any wait for a free WSGI thread or the write lock. A
+5xx response (such as "database is locked") counts as an error. The write
+cases really commit: the defaults rewrite a match result and a player
+with unchanged values. Other cases (say 'generate_teams POST', which
+replaces the owner's teams and their matches) are for a scratch copy of
+the database.
+
+SQLite answers from memory in microseconds, which hides the waiting that
+async views exist to overlap. ``query_latency`` adds a sleep to every
+query, modelling a database server across the network.
+"""
+import asyncio
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+
+from .benchmarks import percentile
+
+SERVERS = ('wsgi', 'asgi')
+# The read views served by async_views under ASGI
+READ_CASES = ('teams_display', 'match_list', 'match_detail')
+# Writes that can be repeated without changing the data
+WRITE_CASES = ('match_record_result POST', 'playerupdate POST')
+# Sent as both the CSRF cookie and the X-CSRFToken header
+CSRF_TOKEN = 'loadtest' * 4
+
+
+def _requests(cases):
+    """(method, path, query string, body) of each case"""
+    requests = []
+    for case in cases:
+        data = urlencode(case.data or {})
+        path = reverse(case.url_name, args=case.args)
+        if case.method == 'post':
+            requests.append(('POST', path, '', data.encode()))
+        else:
+            requests.append(('GET', path, data, b''))
+    return requests
+
+
+@contextmanager
+def query_latency(ms):
+    """Sleep ``ms`` milliseconds before every query on connections opened meanwhile"""
+    if not ms:
+        yield
+        return
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(ms / 1000)
+        return execute(sql, params, many, context)
+
+    def add_delay(sender, connection, **kwargs):
+        # A thread's connection object reconnects for every request
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    connection_created.connect(add_delay)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(add_delay)
+
+
+def _wsgi_send(application, request, cookie):
+    method, path, query, body = request
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver', 'HTTP_COOKIE': cookie, 'HTTP_X_CSRFTOKEN': CSRF_TOKEN,
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded', 'CONTENT_LENGTH': str(len(body)),
+        'REMOTE_ADDR': '127.0.0.1', 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    body = application(environ, lambda line, headers: status.append(int(line.split()[0])))
+    try:
+        for _ in body:
+            pass
+    finally:
+        body.close()
+    return status[0]
+
+
+async def _asgi_send(application, request, cookie):
+    method, path, query, body = request
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [
+            (b'host', b'testserver'), (b'cookie', cookie.encode()), (b'x-csrftoken', CSRF_TOKEN.encode()),
+            (b'content-type', b'application/x-www-form-urlencoded'), (b'content-length', str(len(body)).encode()),
+        ],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    sent = False
+    status = []
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            # Nothing more to read; a server would report a disconnect here
+            await asyncio.Event().wait()
+        sent = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def _run_wsgi(clients, total, threads):
+    application = get_wsgi_application()
+    # Worker threads of the server; requests beyond this many wait in its queue
+    workers = ThreadPoolExecutor(threads)
+    samples = []
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def client(kind, requests, cookie):
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            started = time.perf_counter()
+            status = workers.submit(_wsgi_send, application, requests[n % len(requests)], cookie).result()
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.append((kind, elapsed * 1000, status))
+
+    threads = [threading.Thread(target=client, args=args) for args in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    workers.shutdown()
+    return elapsed, samples
+
+
+def _run_asgi(clients, total):
+    application = get_asgi_application()
+    samples = []
+    counter = iter(range(total))
+
+    async def client(kind, requests, cookie):
+        for n in counter:
+            started = time.perf_counter()
+            status = await _asgi_send(application, requests[n % len(requests)], cookie)
+            samples.append((kind, (time.perf_counter() - started) * 1000, status))
+
+    async def main():
+        started = time.perf_counter()
+        await asyncio.gather(*(client(*args) for args in clients))
+        return time.perf_counter() - started
+
+    return asyncio.run(main()), samples
+
+
+def _stats(samples, elapsed):
+    timings = [ms for ms, _ in samples]
+    statuses = [status for _, status in samples]
+    return {
+        'requests': len(samples),
+        'rps': round(len(samples) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'errors': sum(status >= 500 for status in statuses),
+        'statuses': sorted(set(statuses)),
+    }
+
+
+def run_load(owner, cases, server, clients=32, total=400, threads=8, latency_ms=0, write_cases=(), writers=0):
+    """Send ``total`` requests from ``clients`` readers of ``cases`` and ``writers`` writers of ``write_cases``.
+
+    All simulated users are logged in as ``owner``. Returns the throughput
+    (requests per second), p50/p95 latency in milliseconds, errors and
+    status codes of the reads and, with writers, of the writes.
+    """
+    reads = _requests(cases)
+    writes = _requests(write_cases)
+    # One session per simulated user, as separate browsers would have
+    sessions = [Client() for _ in range(clients + (writers if writes else 0))]
+    for session in sessions:
+        session.force_login(owner)
+    cookies = [
+        f'{settings.SESSION_COOKIE_NAME}={session.cookies[settings.SESSION_COOKIE_NAME].value}; '
+        f'{settings.CSRF_COOKIE_NAME}={CSRF_TOKEN}'
+        for session in sessions
+    ]
+    users = [('reads', reads, cookie) for cookie in cookies[:clients]]
+    users += [('writes', writes, cookie) for cookie in cookies[clients:]]
+    try:
+        with query_latency(latency_ms):
+            if server == 'wsgi':
+                elapsed, samples = _run_wsgi(users, total, threads)
+            else:
+                elapsed, samples = _run_asgi(users, total)
+    finally:
+        for session in sessions:
+            session.logout()
+    result = {'server': server, 'async_views': settings.FAIRPLAY_ASYNC_VIEWS}
+    for kind in ('reads', 'writes'):
+        kind_samples = [(ms, status) for sample_kind, ms, status in samples if sample_kind == kind]
+        result[kind] = _stats(kind_samples, elapsed) if kind_samples else None
+    return result
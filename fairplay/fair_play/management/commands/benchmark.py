@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from fair_play.benchmarks import (
+    BenchmarkSetupError, benchmark_cases, compare, load_baseline, run_case, save_baseline, url_names
+)
+from fair_play.models import Match, MatchParticipation, Player, Team
+
+
+class Command(BaseCommand):
+    help = "Time every fair_play URL and compare query counts and latency with a stored baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', help='Roster owner to browse as (default: owner of the latest match)')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per case (default 20)')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per case (default 2)')
+        parser.add_argument('--only', nargs='+', metavar='LABEL', help='Only run these cases')
+        parser.add_argument(
+            '--baseline', default=str(settings.BASE_DIR / 'benchmark_baseline.json'),
+            help='Baseline file to compare with (default: benchmark_baseline.json next to manage.py)'
+        )
+        parser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Allowed p95 growth as a fraction of the baseline (default 0.25)'
+        )
+        parser.add_argument('--check', action='store_true', help='Exit with an error if anything regressed')
+
+    def handle(self, *args, **options):
+        owner = self.get_owner(options['owner'])
+        try:
+            cases = benchmark_cases(owner)
+        except BenchmarkSetupError as error:
+            raise CommandError(str(error))
+
+        uncovered = set(url_names()) - {case.url_name for case in cases}
+        for name in sorted(uncovered):
+            self.stderr.write(f'No benchmark case for URL "{name}"')
+        if options['only']:
+            cases = [case for case in cases if case.label in options['only']]
+
+        results = {}
+        self.stdout.write(f"{'case':<28}{'status':>7}{'queries':>9}{'p50 ms':>10}{'p95 ms':>10}")
+        # The test client talks to "testserver"
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for case in cases:
+                result = run_case(owner, case, options['repeat'], options['warmup'])
+                results[case.label] = result
+                self.stdout.write(
+                    f"{case.label:<28}{result['status']:>7}{result['queries']:>9}"
+                    f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                )
+
+        dataset = {
+            'users': User.objects.count(),
+            'players': Player.objects.count(),
+            'teams': Team.objects.count(),
+            'matches': Match.objects.count(),
+            'participations': MatchParticipation.objects.count(),
+        }
+        baseline = load_baseline(options['baseline'])
+        if options['save_baseline']:
+            save_baseline(options['baseline'], results, dataset)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
+            return
+        if baseline is None:
+            self.stdout.write(f"No baseline at {options['baseline']}, run with --save-baseline to store one")
+            return
+
+        if baseline.get('dataset') != dataset:
+            self.stderr.write(f"Baseline was recorded on a different dataset: {baseline.get('dataset')}")
+        regressions = compare(results, baseline, options['tolerance'])
+        for regression in regressions:
+            self.stdout.write(self.style.WARNING(f'Regression: {regression}'))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+        elif options['check']:
+            raise CommandError(f'{len(regressions)} regressions against the baseline')
+
+    def get_owner(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'Unknown user "{username}"')
+        match = Match.objects.select_related('team_A__owner').order_by('-pk').first()
+        if match is None:
+            raise CommandError('No matches found; run seed_data first.')
+        return match.team_A.owner
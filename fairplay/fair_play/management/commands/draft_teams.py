@@ -0,0 +1,78 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from fair_play.balancing import BALANCERS, DEFAULT_BALANCER
+from fair_play.models import Player
+from fair_play.roster import MIN_TEAMS, RosterSnapshot, draft_rosters, position_quotas, save_drafts
+
+
+class Command(BaseCommand):
+    help = "Regenerate balanced teams for many roster owners in one pass"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Owners whose teams should be regenerated')
+        parser.add_argument('--all', action='store_true', help='Regenerate teams for every owner with players')
+        parser.add_argument('--teams', type=int, default=2, help='Number of teams per owner (default 2)')
+        parser.add_argument('--names', nargs='+', help='Team names (defaults to "Team 1", "Team 2", ...)')
+        parser.add_argument('--engine', choices=list(BALANCERS), default=DEFAULT_BALANCER)
+        parser.add_argument(
+            '--learned-ratings', action='store_true',
+            help='Balance on the ratings learned from match results instead of the hand-set ones'
+        )
+        parser.add_argument(
+            '--min', action='append', default=[], metavar='POSITION=N',
+            help='With --engine positions: at least N players of POSITION (GK, DF, MD, ST) per team'
+        )
+        parser.add_argument(
+            '--max', action='append', default=[], metavar='POSITION=N',
+            help='With --engine positions: at most N players of POSITION per team'
+        )
+
+    def handle(self, *args, **options):
+        if options['all'] == bool(options['usernames']):
+            raise CommandError('Pass either some usernames or --all.')
+
+        team_names = options['names'] or [f'Team {i}' for i in range(1, options['teams'] + 1)]
+        if len(set(team_names)) < MIN_TEAMS:
+            raise CommandError(f'At least {MIN_TEAMS} different team names are needed.')
+
+        owner_ids = None
+        if options['usernames']:
+            found = dict(User.objects.filter(username__in=options['usernames']).values_list('username', 'id'))
+            missing = sorted(set(options['usernames']) - set(found))
+            if missing:
+                raise CommandError(f'Unknown users: {", ".join(missing)}')
+            owner_ids = list(found.values())
+
+        snapshot = RosterSnapshot.for_owners(owner_ids, learned=options['learned_ratings'])
+        names_by_owner = {}
+        for owner_id in snapshot.owners():
+            if len(snapshot.roster(owner_id)) < len(team_names):
+                self.stderr.write(f'Skipping owner {owner_id}: fewer players than teams')
+                names_by_owner[owner_id] = []
+            else:
+                names_by_owner[owner_id] = team_names
+
+        engine_options = {}
+        if options['engine'] == 'positions':
+            engine_options['quotas'] = position_quotas(
+                self.parse_limits(options['min']), self.parse_limits(options['max'])
+            )
+        errors = {}
+        drafts = draft_rosters(snapshot, names_by_owner, options['engine'], errors=errors, **engine_options)
+        for owner_id, error in errors.items():
+            self.stderr.write(f'Skipping owner {owner_id}: {error}')
+        teams = save_drafts(snapshot, drafts)
+        players = sum(len(snapshot.roster(owner_id)) for owner_id in drafts)
+        self.stdout.write(self.style.SUCCESS(
+            f'Drafted {len(teams)} teams for {len(drafts)} owners ({players} players)'
+        ))
+
+    def parse_limits(self, values):
+        limits = {}
+        for value in values:
+            code, _, count = value.partition('=')
+            if code not in Player.Position.names or not count.isdigit():
+                raise CommandError(f'Invalid position limit "{value}", expected e.g. GK=1')
+            limits[code] = int(count)
+        return limits
@@ -0,0 +1,45 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from fair_play.imports import FORMATS, IMPORT_BATCH_SIZE, detect_format, import_roster, read_rows
+
+
+class Command(BaseCommand):
+    help = "Add players to a roster from a CSV or JSON file of (username, position, rating) rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('owner', help='Username of the roster owner')
+        parser.add_argument('path', help='File to import, or - for standard input')
+        parser.add_argument('--format', choices=FORMATS, help='File format (default: from the file extension)')
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help=f'Rows validated and inserted together (default {IMPORT_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f'Unknown user "{options["owner"]}"')
+        path = options['path']
+        fmt = options['format'] or detect_format(path)
+        if fmt is None:
+            raise CommandError('Cannot tell the format from the file name, pass --format.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        if path == '-':
+            result = import_roster(owner, read_rows(sys.stdin.buffer, fmt), options['batch_size'])
+        else:
+            try:
+                with open(path, 'rb') as file:
+                    result = import_roster(owner, read_rows(file, fmt), options['batch_size'])
+            except OSError as error:
+                raise CommandError(f'Cannot read {path}: {error.strerror}')
+
+        for error in result.errors:
+            self.stderr.write(f'Row {error.row} ({error.username or "-"}): {error.message}')
+        summary = f'Imported {result.created} players for {owner.username}, {len(result.errors)} rows rejected'
+        self.stdout.write(self.style.SUCCESS(summary) if not result.errors else summary)
@@ -0,0 +1,123 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from fair_play.benchmarks import BenchmarkSetupError, benchmark_cases
+from fair_play.loadtest import READ_CASES, SERVERS, WRITE_CASES, run_load
+from fair_play.management.commands.benchmark import Command as BenchmarkCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the read views, and optionally writes, with concurrent users through the WSGI and ASGI "
+        "handlers and compare throughput, latency and errors"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--server', choices=SERVERS,
+            help='Only load this handler, with the views the settings select (default: compare both, '
+                 'sync views under WSGI and async views under ASGI, each in its own process)'
+        )
+        parser.add_argument('--owner', help='Roster owner to browse as (default: owner of the latest match)')
+        parser.add_argument('--clients', type=int, default=32, help='Concurrent simulated users (default 32)')
+        parser.add_argument('--requests', type=int, default=400, help='Requests in total (default 400)')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads (default 8)')
+        parser.add_argument(
+            '--query-latency', type=float, default=0, metavar='MS',
+            help='Milliseconds added to every query, to model a database across the network (default 0)'
+        )
+        parser.add_argument('--only', nargs='+', metavar='LABEL', help=f'Cases to request (default: {" ".join(READ_CASES)})')
+        parser.add_argument(
+            '--writers', type=int, default=0,
+            help='Concurrent simulated users sending writes, on top of --clients readers (default 0)'
+        )
+        parser.add_argument(
+            '--write-cases', nargs='+', metavar='LABEL', default=list(WRITE_CASES),
+            help=f'Write cases the writers send; these commit (default: {" ".join(WRITE_CASES)})'
+        )
+        parser.add_argument('--json', action='store_true', help='Print the result as one JSON object')
+
+    def handle(self, *args, **options):
+        if options['server'] is None:
+            return self.compare(options)
+
+        owner = BenchmarkCommand().get_owner(options['owner'])
+        try:
+            cases = benchmark_cases(owner)
+        except BenchmarkSetupError as error:
+            raise CommandError(str(error))
+        labels = options['only'] or READ_CASES
+        reads = [case for case in cases if case.label in labels]
+        if not reads:
+            raise CommandError(f'No cases named {", ".join(labels)}')
+        writes = [case for case in cases if case.label in options['write_cases']] if options['writers'] else []
+        if options['writers'] and not writes:
+            raise CommandError(f'No cases named {", ".join(options["write_cases"])}')
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            result = run_load(
+                owner, reads, options['server'], clients=options['clients'], total=options['requests'],
+                threads=options['threads'], latency_ms=options['query_latency'], write_cases=writes,
+                writers=options['writers']
+            )
+        if options['json']:
+            self.stdout.write(json.dumps(result))
+        else:
+            self.write_header()
+            self.write_result(result)
+
+    def compare(self, options):
+        """Run each server in a child process, so the URLs can route to its views"""
+        results = []
+        for server in SERVERS:
+            argv = [
+                sys.executable, str(settings.BASE_DIR / 'manage.py'), 'loadtest', '--server', server, '--json',
+                '--clients', str(options['clients']), '--requests', str(options['requests']),
+                '--threads', str(options['threads']), '--query-latency', str(options['query_latency']),
+            ]
+            if options['owner']:
+                argv += ['--owner', options['owner']]
+            if options['only']:
+                argv += ['--only', *options['only']]
+            if options['writers']:
+                argv += ['--writers', str(options['writers']), '--write-cases', *options['write_cases']]
+            env = {**os.environ, 'FAIRPLAY_ASYNC_VIEWS': '1' if server == 'asgi' else '0'}
+            if server == 'asgi':
+                # As asgi.py does
+                env.setdefault('FAIRPLAY_CONN_MAX_AGE', '0')
+            child = subprocess.run(argv, env=env, capture_output=True, text=True)
+            if child.returncode:
+                raise CommandError(f'The {server} run failed:\n{child.stderr}')
+            results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+        self.write_header()
+        for result in results:
+            self.write_result(result)
+        wsgi, asgi = results
+        self.stdout.write(
+            f"ASGI/WSGI read throughput: {asgi['reads']['rps'] / wsgi['reads']['rps']:.2f}x, "
+            f"p95: {asgi['reads']['p95_ms']:.1f} ms vs {wsgi['reads']['p95_ms']:.1f} ms"
+        )
+
+    def write_header(self):
+        self.stdout.write(
+            f"{'server':<8}{'views':<7}{'kind':<8}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'errors':>8}  statuses"
+        )
+
+    def write_result(self, result):
+        for kind in ('reads', 'writes'):
+            stats = result[kind]
+            if stats is None:
+                continue
+            self.stdout.write(
+                f"{result['server']:<8}{'async' if result['async_views'] else 'sync':<7}{kind:<8}"
+                f"{stats['requests']:>9}{stats['rps']:>9.1f}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+                f"{stats['errors']:>8}  {' '.join(map(str, stats['statuses']))}"
+            )
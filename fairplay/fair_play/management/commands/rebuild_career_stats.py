@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from fair_play.models import PlayerCareerStats
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's career stats from their match participations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only rebuild these users (default: everyone)')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = list(User.objects.filter(username__in=options['usernames']).values_list('id', flat=True))
+            if len(user_ids) != len(set(options['usernames'])):
+                raise CommandError('Some of the given users do not exist.')
+        rebuilt = PlayerCareerStats.objects.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt career stats for {rebuilt} users'))
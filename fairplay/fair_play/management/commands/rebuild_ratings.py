@@ -0,0 +1,38 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from fair_play.ratings import compute_ratings, load_results, np, save_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute every learned rating and the rating history by replaying all match results"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Only replay these owners' rosters (default: everyone)")
+        parser.add_argument(
+            '--no-numpy', action='store_true',
+            help='Replay one match at a time in pure Python, even when NumPy is installed'
+        )
+
+    def handle(self, *args, **options):
+        owner_ids = None
+        if options['usernames']:
+            owner_ids = list(User.objects.filter(username__in=options['usernames']).values_list('id', flat=True))
+            if len(owner_ids) != len(set(options['usernames'])):
+                raise CommandError('Some of the given users do not exist.')
+        vectorized = np is not None and not options['no_numpy']
+
+        started = time.perf_counter()
+        matches, participations, seeds = load_results(owner_ids)
+        loaded = time.perf_counter()
+        history, ratings = compute_ratings(matches, participations, seeds, vectorized)
+        computed = time.perf_counter()
+        save_ratings(history, ratings, owner_ids)
+        saved = time.perf_counter()
+        self.stdout.write(self.style.SUCCESS(
+            f'Replayed {len(matches)} matches ({len(history)} participations) and rated {len(ratings)} players '
+            f'in {saved - started:.2f}s: load {loaded - started:.2f}s, '
+            f'{"NumPy" if vectorized else "Python"} replay {computed - loaded:.2f}s, save {saved - computed:.2f}s'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from fair_play.models import Team
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored player count, total and average rating of every team"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', help='Only rebuild the teams of this username')
+
+    def handle(self, *args, **options):
+        teams = Team.objects.all()
+        if options['owner']:
+            teams = teams.filter(owner__username=options['owner'])
+        updated = teams.refresh_aggregates()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt aggregates for {updated} teams'))
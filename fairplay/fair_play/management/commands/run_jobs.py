@@ -0,0 +1,59 @@
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fair_play.jobs import run_workers
+
+
+class Command(BaseCommand):
+    help = 'Run the queued background jobs (team generation, roster resets) on a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Worker threads per process (default 2)')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Worker processes, this one included, each with --threads threads (default 1). On SQLite, '
+                 'which runs one write at a time, threads are enough; more processes pay off on other databases'
+        )
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between looks at an empty queue (default 1)')
+        parser.add_argument('--burst', action='store_true', help='Stop once the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['processes'] < 1:
+            raise CommandError('--threads and --processes must be at least 1.')
+        stop = threading.Event()
+
+        def shut_down(signum, frame):
+            # The running jobs finish; nothing new is claimed
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shut_down)
+        signal.signal(signal.SIGINT, shut_down)
+
+        children = [self.spawn(options) for _ in range(options['processes'] - 1)]
+        started = time.perf_counter()
+        try:
+            done = run_workers(options['threads'], poll=options['poll'], burst=options['burst'], stop=stop)
+        finally:
+            for child in children:
+                if child.poll() is None:
+                    child.send_signal(signal.SIGTERM)
+            for child in children:
+                child.wait()
+        elapsed = time.perf_counter() - started
+        where = ' in this process' if children else ''
+        self.stdout.write(self.style.SUCCESS(f'Ran {done} jobs{where} in {elapsed:.2f}s'))
+
+    def spawn(self, options):
+        argv = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'run_jobs',
+            '--threads', str(options['threads']), '--poll', str(options['poll']),
+        ]
+        if options['burst']:
+            argv.append('--burst')
+        return subprocess.Popen(argv)
@@ -0,0 +1,188 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from fair_play.models import (
+    Match, MatchParticipation, Player, PlayerCareerStats, UserProfile, deferred_career_stats,
+    deferred_owner_signals, deferred_team_aggregates, notify_owners, roster_changed, standings_changed
+)
+from fair_play.roster import RosterSnapshot, draft_rosters, save_drafts
+
+FIRST_NAMES = (
+    'amara', 'ben', 'chidi', 'diego', 'emeka', 'fatuma', 'grace', 'hassan', 'ivy', 'jamal',
+    'kofi', 'lina', 'moses', 'nia', 'omar', 'pablo', 'queen', 'rashid', 'sara', 'tariq',
+    'umar', 'vera', 'wanjiru', 'xavier', 'yusuf', 'zawadi',
+)
+LAST_NAMES = (
+    'achieng', 'banda', 'chege', 'diallo', 'eze', 'fofana', 'gitau', 'hamisi', 'idowu', 'juma',
+    'kamau', 'lungu', 'mensah', 'njoroge', 'otieno', 'phiri', 'quaye', 'rotich', 'sow', 'tembo',
+)
+LOCATIONS = ('Central Park', 'Riverside Pitch', 'School Ground', 'Community Arena', 'Astro Turf')
+POSITIONS = Player.Position.values
+# Share of players who take their preferred position, the rest are moved around
+PREFERRED_POSITION_SHARE = 0.8
+PASSWORD = 'fairplay-seed'
+
+
+class Command(BaseCommand):
+    help = "Seed a large synthetic dataset (users, rosters, teams, matches) for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to create (default 1000)')
+        parser.add_argument('--owners', type=int, default=50, help='Users who own a roster (default 50)')
+        parser.add_argument('--roster', type=int, default=20, help='Players per owner (default 20)')
+        parser.add_argument('--teams', type=int, default=2, help='Teams per owner (default 2)')
+        parser.add_argument('--matches', type=int, default=10, help='Matches per owner (default 10)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data')
+        parser.add_argument('--prefix', default='seed', help='Username prefix of the seeded users')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT batch')
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded users first')
+
+    def handle(self, *args, **options):
+        users, owners, roster = options['users'], options['owners'], options['roster']
+        if owners > users or roster > users:
+            raise CommandError('--owners and --roster cannot exceed --users.')
+        if options['teams'] < 2 or roster < options['teams']:
+            raise CommandError('Each roster needs at least two teams and one player per team.')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        prefix = f"{options['prefix']}_"
+        if options['clear']:
+            self.clear(prefix)
+        elif User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users starting with "{prefix}" already exist, use --clear to replace them.')
+
+        user_ids, preferred = self.create_users(prefix, users)
+        owner_ids = user_ids[:owners]
+        self.create_players(owner_ids, user_ids, preferred, roster)
+
+        team_names = [f'Team {i}' for i in range(1, options['teams'] + 1)]
+        matches = participations = 0
+        for start in range(0, len(owner_ids), 500):
+            chunk = owner_ids[start:start + 500]
+            created = self.create_matches(chunk, team_names, options['matches'])
+            matches += created[0]
+            participations += created[1]
+
+        PlayerCareerStats.objects.rebuild()
+        notify_owners(roster_changed, standings_changed, owner_ids=owner_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {users} users, {owners * roster} players, {owners * len(team_names)} teams, '
+            f'{matches} matches and {participations} participations'
+        ))
+
+    def clear(self, prefix):
+        with deferred_team_aggregates(), deferred_career_stats(), deferred_owner_signals():
+            deleted, _ = User.objects.filter(username__startswith=prefix).delete()
+        self.stdout.write(f'Deleted {deleted} previously seeded rows')
+
+    def create_users(self, prefix, count):
+        # Hashing is the slow part of creating users; every seeded user shares one hash
+        password = make_password(PASSWORD)
+        user_ids = []
+        preferred = []
+        for start in range(0, count, self.batch_size):
+            batch = []
+            for i in range(start, min(start + self.batch_size, count)):
+                first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                username = f'{prefix}{first}.{last}{i}'
+                batch.append(User(
+                    username=username,
+                    email=f'{username}@example.com',
+                    first_name=first.title(),
+                    last_name=last.title(),
+                    password=password
+                ))
+            # bulk_create skips the post_save hook that creates profiles
+            created = User.objects.bulk_create(batch)
+            profiles = [
+                UserProfile(user=user, preferred_position=self.rng.choice(POSITIONS)) for user in created
+            ]
+            UserProfile.objects.bulk_create(profiles)
+            user_ids.extend(user.pk for user in created)
+            preferred.extend(profile.preferred_position for profile in profiles)
+        return user_ids, dict(zip(user_ids, preferred))
+
+    def create_players(self, owner_ids, user_ids, preferred, roster):
+        players = []
+        for owner_id in owner_ids:
+            members = {owner_id}
+            while len(members) < roster:
+                members.add(self.rng.choice(user_ids))
+            for user_id in members:
+                position = preferred[user_id]
+                if self.rng.random() > PREFERRED_POSITION_SHARE:
+                    position = self.rng.choice(POSITIONS)
+                rating = min(100, max(50, round(self.rng.gauss(72, 10))))
+                players.append(Player(user_id=user_id, owner_id=owner_id, position=position, rating=rating))
+            if len(players) >= self.batch_size:
+                Player.objects.bulk_create(players)
+                players = []
+        Player.objects.bulk_create(players)
+
+    def create_matches(self, owner_ids, team_names, per_owner):
+        """Draft teams for some owners, then give them matches with participations"""
+        snapshot = RosterSnapshot.for_owners(owner_ids)
+        drafts = draft_rosters(snapshot, team_names)
+        teams = save_drafts(snapshot, drafts)
+        team_ids = {(team.owner_id, team.name): team.pk for team in teams}
+
+        now = timezone.now()
+        fixtures = []
+        for owner_id, owner_teams in drafts.items():
+            for _ in range(per_owner):
+                name_a, name_b = self.rng.sample(list(owner_teams), 2)
+                played = self.rng.random() < 0.9
+                match = Match(
+                    team_A_id=team_ids[owner_id, name_a],
+                    team_B_id=team_ids[owner_id, name_b],
+                    played_at=now - timedelta(days=self.rng.randint(1, 720), minutes=self.rng.randint(0, 1440)),
+                    location=self.rng.choice(LOCATIONS),
+                    status=Match.Status.PLAYED if played else Match.Status.SCHEDULED,
+                    score_a=self.rng.choice((0, 0, 1, 1, 1, 2, 2, 3, 4)) if played else None,
+                    score_b=self.rng.choice((0, 0, 1, 1, 1, 2, 2, 3, 4)) if played else None,
+                )
+                fixtures.append((match, owner_teams[name_a], owner_teams[name_b]))
+
+        with transaction.atomic():
+            Match.objects.bulk_create([match for match, _, _ in fixtures], batch_size=self.batch_size)
+            batch = []
+            created = 0
+            for match, rows_a, rows_b in fixtures:
+                sides = ((match.team_A_id, rows_a, match.score_a), (match.team_B_id, rows_b, match.score_b))
+                for team_id, rows, score in sides:
+                    batch.extend(self.participations(snapshot, match, team_id, rows, score))
+                if len(batch) >= self.batch_size:
+                    MatchParticipation.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            MatchParticipation.objects.bulk_create(batch)
+        return len(fixtures), created + len(batch)
+
+    def participations(self, snapshot, match, team_id, rows, score):
+        player_ids = [snapshot.player_ids[row] for row in rows]
+        goals = dict.fromkeys(player_ids, 0)
+        assists = dict.fromkeys(player_ids, 0)
+        for _ in range(score or 0):
+            goals[self.rng.choice(player_ids)] += 1
+            if self.rng.random() < 0.7:
+                assists[self.rng.choice(player_ids)] += 1
+        played = match.status == Match.Status.PLAYED
+        return [
+            MatchParticipation(
+                match_id=match.pk,
+                team_id=team_id,
+                player_id=player_id,
+                minutes_played=self.rng.choice((45, 60, 75, 90, 90, 90)) if played else None,
+                goals=goals[player_id],
+                assists=assists[player_id],
+                match_rating=self.rng.randint(4, 10) if played else None
+            )
+            for player_id in player_ids
+        ]
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fair_play.querylog import log_files, summarize
+
+SORT_KEYS = {'total': 'total_ms', 'max': 'max_ms', 'count': 'count'}
+
+
+class Command(BaseCommand):
+    help = 'Report the SQL statements in the query log (FAIRPLAY_QUERY_LOG) that cost the most'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Statements to show (default 10)')
+        parser.add_argument(
+            '--sort', choices=SORT_KEYS, default='total',
+            help='Rank by total time, slowest single run or number of runs (default total)'
+        )
+        parser.add_argument('--source', help='Only statements of this view (URL name) or job (job:<kind>)')
+        parser.add_argument('--log', help='Log file to read, with its rotated copies (default FAIRPLAY_QUERY_LOG)')
+        parser.add_argument('--origins', type=int, default=3, help='Origins listed per statement (default 3)')
+        parser.add_argument('--full', action='store_true', help='Print whole statements rather than their start')
+
+    def handle(self, *args, **options):
+        path = options['log'] or settings.FAIRPLAY_QUERY_LOG
+        if not path:
+            raise CommandError('No query log; set FAIRPLAY_QUERY_LOG (or pass --log) and serve some requests.')
+        paths = log_files(path)
+        if not paths:
+            raise CommandError(f'{path} does not exist yet.')
+
+        key = SORT_KEYS[options['sort']]
+        summaries = sorted(summarize(paths, options['source']), key=lambda summary: -summary[key])
+        if not summaries:
+            self.stdout.write('No statements logged.')
+            return
+        self.stdout.write(
+            f"{'total ms':>10}{'runs':>8}{'requests':>9}{'avg ms':>9}{'max ms':>9}  fingerprint   statement"
+        )
+        for summary in summaries[:options['top']]:
+            sql = summary['sql']
+            if not options['full'] and len(sql) > 100:
+                sql = sql[:97] + '...'
+            self.stdout.write(
+                f"{summary['total_ms']:>10.1f}{summary['count']:>8}{summary['requests']:>9}"
+                f"{summary['total_ms'] / summary['count']:>9.2f}{summary['max_ms']:>9.1f}  "
+                f"{summary['fingerprint']}  {sql}"
+            )
+            for (location, source), total in summary['origins'][:options['origins']]:
+                self.stdout.write(f"{'':>47}{total:>9.1f} ms  {source}: {location}")
+        self.stdout.write(f"{len(summaries)} statements in {', '.join(paths)}")
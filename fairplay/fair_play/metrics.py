@@ -0,0 +1,294 @@
+"""Per-request timings: a Server-Timing header and Prometheus histograms.
+
+``performance_middleware`` times every request. It records the view's URL
+name, the total time, the SQL queries and their time, and the time spent
+rendering templates. Each response gets these as a ``Server-Timing``
+header, which browser dev tools show next to the request. They are also
+added to in-process histograms that ``/metrics`` serves in the Prometheus
+text format.
+
+Queries are counted by an execute wrapper that every new database
+connection gets (``connection.execute_wrapper`` does the same for a single
+block). It reports to the request in the current context, so queries the
+async views run on worker threads count too. Template time is measured by
+``TimedDjangoTemplates``, the template backend in settings. It includes
+the queries a template runs lazily.
+
+With ``FAIRPLAY_QUERY_LOG`` set, each request also keeps a log of its
+costly and repeated statements (see fair_play.querylog). In DEBUG and in
+the tests, lazy related-object loads are checked for N+1 patterns (see
+fair_play.nplusone).
+
+The histograms live in the process. Each server process serves its own
+counts, which Prometheus adds up across scrape targets. A streaming
+response (the exports) is timed until its headers are ready, not until
+its body is sent.
+"""
+import bisect
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.decorators import sync_and_async_middleware
+
+from . import nplusone, querylog
+
+# Upper bounds of the histogram buckets; +Inf is implied
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class RequestTimings:
+    """What one request spent; shared by the threads serving it"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        # Templates rendered while another renders are part of its time
+        self.rendering = 0
+        self.log = querylog.QueryLog() if querylog.enabled() else None
+        self.detection = nplusone.mode()
+        self.lazy_loads = nplusone.LazyLoads() if self.detection != 'off' else None
+
+    @property
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+
+_timings = ContextVar('fair_play_timings', default=None)
+
+
+def current_timings():
+    """Timings of the request being served, or None outside a request"""
+    return _timings.get()
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        timings.queries += 1
+        timings.sql_seconds += elapsed
+        if timings.log is not None:
+            timings.log.record(sql, elapsed)
+        if timings.lazy_loads is not None:
+            timings.lazy_loads.record(sql, sys._getframe())
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Count the queries of every connection, whichever thread opens it"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _timings.get()
+        if timings is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        timings.rendering += 1
+        try:
+            return super().render(context, request)
+        finally:
+            timings.rendering -= 1
+            if not timings.rendering:
+                timings.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with render times added to the request's timings"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class Histogram:
+    """A Prometheus histogram per label set"""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # {labels: [per-bucket counts..., +Inf count, sum]}
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                cumulative += count
+                yield f'{self.name}_bucket', (*labels, ('le', bound)), cumulative
+            yield f'{self.name}_sum', labels, series[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.series = {}
+
+    def inc(self, labels):
+        self.series[labels] = self.series.get(labels, 0) + 1
+
+    def samples(self):
+        for labels, value in sorted(self.series.items()):
+            yield f'{self.name}_total', labels, value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter('fairplay_requests', 'Requests served, by view, method and status')
+        self.duration = Histogram(
+            'fairplay_request_duration_seconds', 'Time to produce a response, by view and method', SECONDS_BUCKETS
+        )
+        self.sql = Histogram('fairplay_request_sql_seconds', 'Time in SQL queries per request, by view', SECONDS_BUCKETS)
+        self.queries = Histogram('fairplay_request_queries', 'SQL queries per request, by view', QUERY_BUCKETS)
+        self.templates = Histogram(
+            'fairplay_request_template_seconds', 'Time rendering templates per request, by view', SECONDS_BUCKETS
+        )
+
+    @property
+    def metrics(self):
+        return (self.requests, self.duration, self.sql, self.queries, self.templates)
+
+    def observe(self, view, method, status, timings, total):
+        view_label = (('view', view),)
+        with self.lock:
+            self.requests.inc((*view_label, ('method', method), ('status', str(status))))
+            self.duration.observe((*view_label, ('method', method)), total)
+            self.sql.observe(view_label, timings.sql_seconds)
+            self.queries.observe(view_label, timings.queries)
+            self.templates.observe(view_label, timings.template_seconds)
+
+    def clear(self):
+        with self.lock:
+            for metric in self.metrics:
+                metric.series.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                kind = 'counter' if isinstance(metric, Counter) else 'histogram'
+                lines.append(f'# HELP {metric.name} {metric.documentation}')
+                lines.append(f'# TYPE {metric.name} {kind}')
+                for name, labels, value in metric.samples():
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(_number(value))}"' for key, value in labels)
+    return f'{{{pairs}}}'
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.url_name or match.view_name or '<unnamed>'
+
+
+def server_timing(timings, total):
+    """The Server-Timing header value; durations in milliseconds"""
+    return (
+        f'total;dur={total * 1000:.1f}, '
+        f'sql;dur={timings.sql_seconds * 1000:.1f};desc="{timings.queries} queries", '
+        f'template;dur={timings.template_seconds * 1000:.1f}'
+    )
+
+
+@contextmanager
+def track(source):
+    """Time the queries of work done outside a request (e.g. a background job) for the query log"""
+    timings = RequestTimings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        if timings.log is not None:
+            timings.log.write(source)
+    if timings.lazy_loads is not None:
+        timings.lazy_loads.check(source, timings.detection)
+
+
+def _finish(request, response, timings):
+    total = timings.total_seconds
+    view = view_name(request)
+    REGISTRY.observe(view, request.method, response.status_code, timings, total)
+    if timings.log is not None:
+        timings.log.write(view)
+    if timings.lazy_loads is not None:
+        timings.lazy_loads.check(view, timings.detection)
+    if getattr(settings, 'FAIRPLAY_SERVER_TIMING', False):
+        response['Server-Timing'] = server_timing(timings, total)
+    return response
+
+
+@sync_and_async_middleware
+def performance_middleware(get_response):
+    """Time each request; add a Server-Timing header and feed the /metrics histograms"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings = RequestTimings()
+            token = _timings.set(timings)
+            try:
+                response = await get_response(request)
+            finally:
+                _timings.reset(token)
+            return _finish(request, response, timings)
+    else:
+        def middleware(request):
+            timings = RequestTimings()
+            token = _timings.set(timings)
+            try:
+                response = get_response(request)
+            finally:
+                _timings.reset(token)
+            return _finish(request, response, timings)
+    return middleware
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:40
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_team_aggregates(apps, schema_editor):
+    Player = apps.get_model('fair_play', 'Player')
+    Team = apps.get_model('fair_play', 'Team')
+    players = Player.objects.filter(team=OuterRef('pk')).order_by().values('team')
+    Team.objects.update(
+        player_count=Coalesce(Subquery(players.annotate(count=Count('pk')).values('count')), 0),
+        total_rating=Coalesce(Subquery(players.annotate(total=Sum('rating')).values('total')), 0),
+        avg_rating=Coalesce(Subquery(players.annotate(avg=Avg('rating')).values('avg')), 0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fair_play', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='avg_rating',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='player_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='total_rating',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_team_aggregates, migrations.RunPython.noop),
+    ]
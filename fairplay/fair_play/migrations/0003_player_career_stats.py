@@ -0,0 +1,68 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_career_stats(apps, schema_editor):
+    MatchParticipation = apps.get_model('fair_play', 'MatchParticipation')
+    PlayerCareerStats = apps.get_model('fair_play', 'PlayerCareerStats')
+    decided = Q(match__status='Played', match__score_a__isnull=False, match__score_b__isnull=False)
+    won = decided & (
+        Q(team=F('match__team_A'), match__score_a__gt=F('match__score_b')) |
+        Q(team=F('match__team_B'), match__score_b__gt=F('match__score_a'))
+    )
+    rows = MatchParticipation.objects.order_by().values('player__user_id').annotate(
+        matches=Count('pk'),
+        wins=Count('pk', filter=won),
+        draws=Count('pk', filter=decided & Q(match__score_a=F('match__score_b'))),
+        decided=Count('pk', filter=decided),
+        goals=Coalesce(Sum('goals'), 0),
+        assists=Coalesce(Sum('assists'), 0),
+        minutes=Coalesce(Sum('minutes_played'), 0),
+    )
+    PlayerCareerStats.objects.bulk_create([
+        PlayerCareerStats(
+            user_id=row['player__user_id'],
+            matches=row['matches'],
+            wins=row['wins'],
+            draws=row['draws'],
+            losses=row['decided'] - row['wins'] - row['draws'],
+            goals=row['goals'],
+            assists=row['assists'],
+            minutes=row['minutes'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fair_play', '0002_team_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerCareerStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('matches', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('draws', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('goals', models.IntegerField(default=0)),
+                ('assists', models.IntegerField(default=0)),
+                ('minutes', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='career_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Player career stats',
+            },
+        ),
+        migrations.RunPython(backfill_career_stats, migrations.RunPython.noop),
+    ]
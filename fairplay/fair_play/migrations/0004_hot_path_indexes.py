@@ -0,0 +1,32 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('fair_play', '0003_player_career_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['status', '-played_at', '-date_created'], name='match_status_played_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['owner', 'user'], name='player_owner_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teammembership',
+            index=models.Index(condition=models.Q(('left_at__isnull', True)), fields=['player'], name='membership_open_idx'),
+        ),
+        # auth_user belongs to django.contrib.auth, so its email index (used by
+        # the registration form's uniqueness check) is created here by hand
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS fair_play_user_email_idx ON auth_user (email)',
+            reverse_sql='DROP INDEX IF EXISTS fair_play_user_email_idx',
+        ),
+    ]
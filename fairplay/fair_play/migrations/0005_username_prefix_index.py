@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fair_play', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        # Serves the case-insensitive username autocomplete as an index range
+        # scan, already in the order the suggestions are listed in
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS fair_play_user_username_lower_idx ON auth_user (LOWER(username))',
+            reverse_sql='DROP INDEX IF EXISTS fair_play_user_username_lower_idx',
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.11 on 2026-10-18 05:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fair_play', '0005_username_prefix_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='learned_rating',
+            field=models.FloatField(blank=True, editable=False, help_text="Rating learned from match results (empty until the player's first rated match)", null=True),
+        ),
+        migrations.CreateModel(
+            name='RatingHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating_before', models.FloatField()),
+                ('rating_after', models.FloatField()),
+                ('expected', models.FloatField()),
+                ('recorded_at', models.DateTimeField(auto_now_add=True)),
+                ('match', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rating_changes', to='fair_play.match')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_history', to='fair_play.player')),
+            ],
+            options={
+                'verbose_name_plural': 'Rating history',
+                'ordering': ['-id'],
+                'unique_together': {('match', 'player')},
+            },
+        ),
+    ]
@@ -1,10 +1,132 @@
-from django.db import models
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from django.contrib.auth.models import User
-from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.dispatch import Signal, receiver
+from django.db.models import Avg, Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
 # Create your models here.
 
+# Team ids collected by deferred_team_aggregates(), None outside such a block
+_pending_team_refresh = ContextVar('pending_team_refresh', default=None)
+
+
+def refresh_team_aggregates(*team_ids):
+    """Recompute the stored player count and ratings of the given teams"""
+    pending = _pending_team_refresh.get()
+    if pending is not None:
+        pending.update(team_ids)
+        return
+    team_ids = {team_id for team_id in team_ids if team_id is not None}
+    if team_ids:
+        Team.objects.filter(pk__in=team_ids).refresh_aggregates()
+
+
+@contextmanager
+def deferred_team_aggregates():
+    """Refresh every team touched inside the block once, when the block ends"""
+    if _pending_team_refresh.get() is not None:
+        yield
+        return
+    team_ids = set()
+    token = _pending_team_refresh.set(team_ids)
+    try:
+        yield
+    finally:
+        _pending_team_refresh.reset(token)
+    refresh_team_aggregates(*team_ids)
+
+
+# Sent with ``owner_ids`` when the results or teams of those owners change
+standings_changed = Signal()
+# Sent with ``owner_ids`` when anything on those owners' roster pages changes:
+# players, teams and their members, memberships, matches or match stats
+roster_changed = Signal()
+
+# signal -> (owner ids, team ids) collected by deferred_owner_signals(), None outside such a block
+_pending_owner_signals = ContextVar('pending_owner_signals', default=None)
+
+
+def notify_owners(*signals, owner_ids=(), team_ids=()):
+    """Send each of ``signals`` for the given owners and the owners of the given teams"""
+    pending = _pending_owner_signals.get()
+    if pending is not None:
+        for signal in signals:
+            owners, teams = pending.setdefault(signal, (set(), set()))
+            owners.update(owner_ids)
+            teams.update(team_ids)
+        return
+    _send_owner_signals({signal: (set(owner_ids), set(team_ids)) for signal in signals})
+
+
+def _send_owner_signals(pending):
+    team_ids = set().union(*(teams for _, teams in pending.values()))
+    team_ids.discard(None)
+    team_owners = {}
+    if team_ids:
+        team_owners = dict(Team.objects.filter(pk__in=team_ids).values_list('pk', 'owner_id'))
+    for signal, (owner_ids, teams) in pending.items():
+        owner_ids = owner_ids | {team_owners[team] for team in teams if team in team_owners}
+        owner_ids.discard(None)
+        if owner_ids:
+            signal.send(sender=Team, owner_ids=owner_ids)
+
+
+@contextmanager
+def deferred_owner_signals():
+    """Send each owner signal once for everything touched inside the block.
+
+    Teams deleted inside the block can no longer be mapped to their owner at
+    the end, so deleting code reports the owners themselves (see Team's
+    post_delete hook).
+    """
+    if _pending_owner_signals.get() is not None:
+        yield
+        return
+    pending = {}
+    token = _pending_owner_signals.set(pending)
+    try:
+        yield
+    finally:
+        _pending_owner_signals.reset(token)
+    _send_owner_signals(pending)
+
+
+class PlayerQuerySet(models.QuerySet):
+    def editable_by(self, user):
+        """Players on ``user``'s roster or in one of ``user``'s teams"""
+        return self.filter(Q(owner=user) | Q(team__owner=user))
+
+    def update(self, **kwargs):
+        """Keep team aggregates and roster versions in step with bulk changes (bulk_update included)"""
+        before = set(self.order_by().values_list('owner_id', 'team_id').distinct())
+        rows = super().update(**kwargs)
+        notify_owners(roster_changed, owner_ids={owner_id for owner_id, _ in before})
+        if not {'team', 'team_id', 'rating'} & kwargs.keys():
+            return rows
+
+        team_ids = {team_id for _, team_id in before}
+        new_team = kwargs.get('team', kwargs.get('team_id'))
+        if hasattr(new_team, 'resolve_expression'):
+            # e.g. the CASE expression built by bulk_update()
+            team_ids.update(self.order_by().values_list('team_id', flat=True).distinct())
+        else:
+            team_ids.add(getattr(new_team, 'pk', new_team))
+        refresh_team_aggregates(*team_ids)
+        return rows
+
+    def delete(self):
+        # Refresh each affected team and career once instead of once per row
+        user_ids = set(self.order_by().values_list('user_id', flat=True).distinct())
+        with deferred_team_aggregates(), deferred_career_stats(user_ids), deferred_owner_signals():
+            return super().delete()
+
+
 class Player(models.Model):
     class Position(models.TextChoices):
         ST = 'Striker'
@@ -24,6 +146,13 @@ class Player(models.Model):
         help_text="Player skill rating (50-100)"
     )
     team = models.ForeignKey('Team', on_delete=models.SET_NULL, null= True, blank=True, related_name='players')
+    # Learned from match results by fair_play.ratings, starting from ``rating``
+    learned_rating = models.FloatField(
+        null=True, blank=True, editable=False,
+        help_text="Rating learned from match results (empty until the player's first rated match)"
+    )
+
+    objects = PlayerQuerySet.as_manager()
 
     @property
     def name(self):
@@ -31,8 +160,22 @@ class Player(models.Model):
     
     def __str__(self):
         return f"{self.user.username}"
+
+    @property
+    def current_rating(self):
+        """The learned rating once there is one, the hand-set rating before"""
+        return self.rating if self.learned_rating is None else self.learned_rating
+
+    def delete(self, *args, **kwargs):
+        with deferred_career_stats([self.user_id]):
+            return super().delete(*args, **kwargs)
+
     class Meta:
         ordering = ['user__username']
+        indexes = [
+            # "is this user already in the owner's roster?"
+            models.Index(fields=['owner', 'user'], name='player_owner_user_idx'),
+        ]
     
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -52,11 +195,117 @@ def create_user_profile(sender,instance,created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 
+@receiver(post_init, sender=Player)
+def remember_player_team(sender, instance, **kwargs):
+    if instance.pk is None:
+        # Not in the database yet: any team it is created on gains a player
+        # (_state.adding is still True here for loaded rows too)
+        instance._loaded_team = (None, None)
+        return
+    # __dict__ so deferred fields are not loaded just to remember them
+    instance._loaded_team = (instance.__dict__.get('team_id'), instance.__dict__.get('rating'))
+
+
+@receiver(post_save, sender=Player)
+def update_team_aggregates_on_save(sender, instance, **kwargs):
+    old_team_id, old_rating = instance._loaded_team
+    if (instance.team_id, instance.rating) != (old_team_id, old_rating):
+        refresh_team_aggregates(old_team_id, instance.team_id)
+    instance._loaded_team = (instance.team_id, instance.rating)
+    notify_owners(roster_changed, owner_ids=[instance.owner_id])
+
+
+@receiver(post_delete, sender=Player)
+def update_team_aggregates_on_delete(sender, instance, **kwargs):
+    refresh_team_aggregates(instance.team_id)
+    notify_owners(roster_changed, owner_ids=[instance.owner_id])
+
+
+class TeamQuerySet(models.QuerySet):
+    def viewable_by(self, user):
+        """Teams ``user`` owns or is a member of"""
+        memberships = Team.members.through.objects.filter(user=user).values('team_id')
+        return self.filter(Q(owner=user) | Q(pk__in=memberships))
+
+    def editable_by(self, user):
+        """Teams ``user`` owns"""
+        return self.filter(owner=user)
+
+    def delete(self):
+        # Deleting teams cascades to their matches and participations
+        with deferred_career_stats(), deferred_owner_signals():
+            return super().delete()
+
+    def standings(self):
+        """League table of these teams as a list of dicts, computed in one query.
+
+        Every decided match is counted once from each side (a UNION ALL of the
+        team_A and team_B rows, each grouped by team), and teams without a
+        result are listed with zeros. Rows are ordered by points, goal
+        difference, goals scored and name.
+        """
+        empty = self.order_by().values(team=F('pk'), team_name=F('name')).annotate(
+            **{field: Value(0) for field in STANDINGS_FIELDS}
+        )
+        decided = Match.objects.decided().order_by()
+        sides = [
+            decided.filter(team_A__in=self.values('pk')).values(
+                team=F('team_A'), team_name=F('team_A__name')
+            ).annotate(
+                played=Count('pk'),
+                wins=Count('pk', filter=Q(score_a__gt=F('score_b'))),
+                draws=Count('pk', filter=Q(score_a=F('score_b'))),
+                losses=Count('pk', filter=Q(score_a__lt=F('score_b'))),
+                goals_for=Sum('score_a'),
+                goals_against=Sum('score_b'),
+            ),
+            decided.filter(team_B__in=self.values('pk')).values(
+                team=F('team_B'), team_name=F('team_B__name')
+            ).annotate(
+                played=Count('pk'),
+                wins=Count('pk', filter=Q(score_b__gt=F('score_a'))),
+                draws=Count('pk', filter=Q(score_a=F('score_b'))),
+                losses=Count('pk', filter=Q(score_b__lt=F('score_a'))),
+                goals_for=Sum('score_b'),
+                goals_against=Sum('score_a'),
+            ),
+        ]
+
+        table = {}
+        for row in empty.union(*sides, all=True):
+            line = table.setdefault(row['team'], dict(
+                {field: 0 for field in STANDINGS_FIELDS}, team_id=row['team'], name=row['team_name']
+            ))
+            for field in STANDINGS_FIELDS:
+                line[field] += row[field]
+        for line in table.values():
+            line['goal_difference'] = line['goals_for'] - line['goals_against']
+            line['points'] = 3 * line['wins'] + line['draws']
+        return sorted(table.values(), key=lambda line: (
+            -line['points'], -line['goal_difference'], -line['goals_for'], line['name']
+        ))
+
+    def refresh_aggregates(self):
+        """Recompute player_count, total_rating and avg_rating in one UPDATE"""
+        players = Player.objects.filter(team=OuterRef('pk')).order_by().values('team')
+        return self.update(
+            player_count=Coalesce(Subquery(players.annotate(count=Count('pk')).values('count')), 0),
+            total_rating=Coalesce(Subquery(players.annotate(total=Sum('rating')).values('total')), 0),
+            avg_rating=Coalesce(Subquery(players.annotate(avg=Avg('rating')).values('avg')), 0.0),
+        )
+
+
 class Team(models.Model):
     name = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='teams')
     members = models.ManyToManyField(User, blank=False)
+    # Denormalized from the team's players, kept current by the Player hooks above
+    player_count = models.IntegerField(default=0, editable=False)
+    total_rating = models.IntegerField(default=0, editable=False)
+    avg_rating = models.FloatField(default=0, editable=False)
+
+    objects = TeamQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -64,6 +313,46 @@ class Team(models.Model):
     class Meta:
         ordering = ['name']
 
+STANDINGS_FIELDS = ('played', 'wins', 'draws', 'losses', 'goals_for', 'goals_against')
+
+
+class MatchQuerySet(models.QuerySet):
+    def involving(self, team_ids):
+        """Matches in which any of ``team_ids`` plays.
+
+        The ids are passed as a list rather than a subquery, which lets
+        SQLite use the team_A and team_B indexes instead of a full scan.
+        """
+        team_ids = list(team_ids)
+        return self.filter(Q(team_A__in=team_ids) | Q(team_B__in=team_ids))
+
+    def viewable_by(self, user):
+        """Matches of the teams ``user`` can view"""
+        return self.involving(Team.objects.viewable_by(user).values_list('pk', flat=True))
+
+    def editable_by(self, user):
+        """Matches of the teams ``user`` owns"""
+        return self.filter(Q(team_A__owner=user) | Q(team_B__owner=user))
+
+    def decided(self):
+        """Played matches with both scores recorded"""
+        return self.filter(status=Match.Status.PLAYED, score_a__isnull=False, score_b__isnull=False)
+
+    def record(self, team):
+        """Wins, draws, losses and goals of ``team`` in one aggregate query"""
+        home = Q(team_A=team)
+        away = Q(team_B=team)
+        stats = self.decided().filter(home | away).aggregate(
+            wins=Count('pk', filter=home & Q(score_a__gt=F('score_b')) | away & Q(score_b__gt=F('score_a'))),
+            draws=Count('pk', filter=Q(score_a=F('score_b'))),
+            losses=Count('pk', filter=home & Q(score_a__lt=F('score_b')) | away & Q(score_b__lt=F('score_a'))),
+            goals_for=Coalesce(Sum(Case(When(home, then='score_a'), default='score_b')), 0),
+            goals_against=Coalesce(Sum(Case(When(home, then='score_b'), default='score_a')), 0),
+        )
+        stats['total_matches'] = stats['wins'] + stats['draws'] + stats['losses']
+        return stats
+
+
 class Match(models.Model):
     class Status(models.TextChoices):
         SCHEDULED = 'Scheduled', 'Scheduled'
@@ -83,6 +372,8 @@ class Match(models.Model):
     score_a = models.IntegerField(null=True, blank=True, help_text="Team A goals")
     score_b = models.IntegerField(null=True, blank=True, help_text="Team B goals")
 
+    objects = MatchQuerySet.as_manager()
+
     def __str__(self):
         if self.score_a is not None and self.score_b is not None:
             return f"{self.team_A} {self.score_a} - {self.score_b} {self.team_B}"
@@ -102,6 +393,9 @@ class Match(models.Model):
     class Meta:
         ordering = ['-date_created']
         verbose_name_plural = 'Matches'
+        indexes = [
+            models.Index(fields=['status', '-played_at', '-date_created'], name='match_status_played_idx'),
+        ]
 
 
 class TeamMembership(models.Model):
@@ -118,6 +412,69 @@ class TeamMembership(models.Model):
     class Meta:
         ordering = ['-joined_at']
         verbose_name_plural = 'Team Memberships'
+        indexes = [
+            # Only current memberships, the ones closed when teams are regenerated
+            models.Index(fields=['player'], condition=Q(left_at__isnull=True), name='membership_open_idx'),
+        ]
+
+
+class ParticipationQuerySet(models.QuerySet):
+    def create_for_match(self, match):
+        """Enter every current player of the match's two teams, with one INSERT.
+
+        Careers get the new matches as if each participation had been saved
+        on its own, in a couple of queries.
+        """
+        players = Player.objects.filter(
+            team_id__in=[match.team_A_id, match.team_B_id]
+        ).order_by('team_id', 'pk').values_list('pk', 'team_id', 'user_id')
+        participations = []
+        deltas = defaultdict(lambda: (0,) * len(CAREER_FIELDS))
+        for player_id, team_id, user_id in players:
+            participation = self.model(match=match, team_id=team_id, player_id=player_id)
+            participations.append(participation)
+            deltas[user_id] = _add(deltas[user_id], _career_line(
+                match, team_id, participation.goals, participation.assists, participation.minutes_played
+            ))
+        with transaction.atomic():
+            self.bulk_create(participations)
+            PlayerCareerStats.objects.apply_deltas(deltas)
+        return participations
+
+    def update_stats(self, participations, fields=('minutes_played', 'goals', 'assists', 'match_rating')):
+        """Save ``fields`` of already loaded participations with one bulk_update.
+
+        Careers change by the difference between the loaded and the new
+        stats, as they would on save().
+        """
+        participations = list(participations)
+        if not participations:
+            return 0
+        users = dict(Player.objects.filter(
+            pk__in={participation.player_id for participation in participations}
+        ).values_list('pk', 'user_id'))
+        deltas = defaultdict(lambda: (0,) * len(CAREER_FIELDS))
+        unknown = []
+        for participation in participations:
+            old_stats = participation._loaded_stats
+            new_stats = tuple(getattr(participation, field) for field in PARTICIPATION_STAT_FIELDS)
+            participation._loaded_stats = new_stats
+            if old_stats is _UNKNOWN or old_stats is None or old_stats[:2] != new_stats[:2]:
+                # Only stats may change here; anything else is rebuilt from scratch
+                unknown.append(participation.player_id)
+                continue
+            user_id = users[participation.player_id]
+            deltas[user_id] = _add(deltas[user_id], _add(
+                _career_line(participation.match, *new_stats[1:]),
+                _career_line(participation.match, *old_stats[1:], sign=-1)
+            ))
+        with transaction.atomic():
+            updated = self.bulk_update(participations, fields)
+            PlayerCareerStats.objects.apply_deltas(deltas)
+            if unknown:
+                _rebuild_careers_of_players(*unknown)
+        notify_owners(roster_changed, team_ids={participation.team_id for participation in participations})
+        return updated
 
 
 class MatchParticipation(models.Model):
@@ -134,6 +491,8 @@ class MatchParticipation(models.Model):
         validators=[MinValueValidator(1), MaxValueValidator(10)],
         help_text="Match performance rating (1-10)"
     )
+
+    objects = ParticipationQuerySet.as_manager()
     
     def __str__(self):
         return f"{self.player.user.username} in {self.match}"
@@ -141,3 +500,371 @@ class MatchParticipation(models.Model):
     class Meta:
         ordering = ['-match__date_created']
         unique_together = ['match', 'player']  # Player can only participate once per match
+
+
+CAREER_FIELDS = ('matches', 'wins', 'draws', 'losses', 'goals', 'assists', 'minutes')
+
+# Users and players collected by deferred_career_stats(), None outside such a block
+_pending_career_rebuild = ContextVar('pending_career_rebuild', default=None)
+
+
+def _outcome(result, is_team_a):
+    """(win, draw, loss) of one side given a (status, score_a, score_b) result"""
+    status, score_a, score_b = result
+    if status != Match.Status.PLAYED or score_a is None or score_b is None:
+        return (0, 0, 0)
+    mine, theirs = (score_a, score_b) if is_team_a else (score_b, score_a)
+    return (int(mine > theirs), int(mine == theirs), int(mine < theirs))
+
+
+def _career_line(match, team_id, goals, assists, minutes, sign=1):
+    """Contribution of one participation to its player's career, in CAREER_FIELDS order"""
+    result = (match.status, match.score_a, match.score_b)
+    wins, draws, losses = _outcome(result, team_id == match.team_A_id)
+    return tuple(sign * value for value in (1, wins, draws, losses, goals, assists, minutes or 0))
+
+
+def _add(first, second):
+    return tuple(a + b for a, b in zip(first, second))
+
+
+@contextmanager
+def deferred_career_stats(user_ids=()):
+    """Rebuild the careers touched inside the block once, when the block ends.
+
+    Used around bulk deletes, where undoing every deleted participation one
+    by one would cost a few queries each.
+    """
+    pending = _pending_career_rebuild.get()
+    if pending is not None:
+        pending['users'].update(user_ids)
+        yield
+        return
+    pending = {'users': set(user_ids), 'players': set()}
+    token = _pending_career_rebuild.set(pending)
+    try:
+        yield
+    finally:
+        _pending_career_rebuild.reset(token)
+    if pending['players']:
+        pending['users'].update(
+            Player.objects.filter(pk__in=pending['players']).values_list('user_id', flat=True)
+        )
+    if pending['users']:
+        PlayerCareerStats.objects.rebuild(pending['users'])
+
+
+class CareerStatsQuerySet(models.QuerySet):
+    def apply_deltas(self, deltas):
+        """Add {user id: tuple in CAREER_FIELDS order} to the stored careers.
+
+        Users sharing the same delta (e.g. everyone on the winning side) are
+        updated together, so recording a result costs a couple of UPDATEs.
+        """
+        deltas = {user_id: delta for user_id, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        self.bulk_create([self.model(user_id=user_id) for user_id in deltas], ignore_conflicts=True)
+        users_by_delta = defaultdict(list)
+        for user_id, delta in deltas.items():
+            users_by_delta[delta].append(user_id)
+        for delta, user_ids in users_by_delta.items():
+            self.filter(user_id__in=user_ids).update(**{
+                field: F(field) + value for field, value in zip(CAREER_FIELDS, delta) if value
+            })
+
+    def rebuild(self, user_ids=None):
+        """Recompute careers from all participations, for every user when None"""
+        participations = MatchParticipation.objects.order_by()
+        if user_ids is not None:
+            user_ids = set(user_ids)
+            participations = participations.filter(player__user_id__in=user_ids)
+
+        decided = Q(
+            match__status=Match.Status.PLAYED,
+            match__score_a__isnull=False,
+            match__score_b__isnull=False
+        )
+        won = decided & (
+            Q(team=F('match__team_A'), match__score_a__gt=F('match__score_b')) |
+            Q(team=F('match__team_B'), match__score_b__gt=F('match__score_a'))
+        )
+        rows = participations.values('player__user_id').annotate(
+            matches=Count('pk'),
+            wins=Count('pk', filter=won),
+            draws=Count('pk', filter=decided & Q(match__score_a=F('match__score_b'))),
+            decided=Count('pk', filter=decided),
+            goals=Coalesce(Sum('goals'), 0),
+            assists=Coalesce(Sum('assists'), 0),
+            minutes=Coalesce(Sum('minutes_played'), 0),
+        )
+
+        careers = {}
+        for row in rows.iterator():
+            row['losses'] = row['decided'] - row['wins'] - row['draws']
+            careers[row['player__user_id']] = self.model(
+                user_id=row['player__user_id'],
+                **{field: row[field] for field in CAREER_FIELDS}
+            )
+        if user_ids is None:
+            self.all().delete()
+            self.bulk_create(careers.values(), batch_size=1000)
+        else:
+            existing = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+            for user_id in existing - careers.keys():
+                careers[user_id] = self.model(user_id=user_id)
+            self.bulk_create(
+                careers.values(),
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=CAREER_FIELDS
+            )
+        return len(careers)
+
+
+class PlayerCareerStats(models.Model):
+    """Career totals of a user across every roster they play in.
+
+    Maintained incrementally when match results or participation stats
+    change; ``rebuild_career_stats`` recomputes them from scratch.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='career_stats')
+    matches = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    goals = models.IntegerField(default=0)
+    assists = models.IntegerField(default=0)
+    minutes = models.IntegerField(default=0)
+
+    objects = CareerStatsQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.user.username}'s career"
+
+    class Meta:
+        verbose_name_plural = 'Player career stats'
+
+
+class RatingHistory(models.Model):
+    """One participant's rating change in one rated match.
+
+    Written by fair_play.ratings when a result is recorded, and rewritten by
+    ``rebuild_ratings``. Rows outlive their match (regenerating teams deletes
+    the old matches), so a player's rating trail stays complete.
+    """
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='rating_history')
+    # Looked up through the (match, player) unique index
+    match = models.ForeignKey(
+        Match, on_delete=models.SET_NULL, null=True, blank=True, related_name='rating_changes', db_index=False
+    )
+    rating_before = models.FloatField()
+    rating_after = models.FloatField()
+    # Win probability of the player's side before the match, draws counting half
+    expected = models.FloatField()
+    recorded_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.player} {self.rating_before:.1f} -> {self.rating_after:.1f}"
+
+    @property
+    def change(self):
+        return self.rating_after - self.rating_before
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name_plural = 'Rating history'
+        unique_together = ['match', 'player']
+
+
+class Job(models.Model):
+    """A piece of work queued for the ``run_jobs`` worker (see fair_play.jobs)"""
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        SUCCEEDED = 'succeeded', 'Succeeded'
+        FAILED = 'failed', 'Failed'
+
+    kind = models.CharField(max_length=50)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    arguments = models.JSONField(default=dict, blank=True)
+    # Repeating a request with the same key returns its job instead of queueing another
+    idempotency_key = models.CharField(max_length=100, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Not started before this time")
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # A running job still running past its lease is presumed lost with its worker
+    worker = models.CharField(max_length=100, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def finished(self):
+        return self.status in (self.Status.SUCCEEDED, self.Status.FAILED)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'idempotency_key'], condition=Q(idempotency_key__isnull=False),
+                name='job_owner_idempotency_key_uniq'
+            ),
+        ]
+        indexes = [
+            # The queue: due jobs, oldest first
+            models.Index(fields=['run_after', 'id'], condition=Q(status='queued'), name='job_queued_idx'),
+        ]
+
+
+# Stands for "loaded with deferred fields": the previous values are unknown
+_UNKNOWN = object()
+
+
+def _loaded_values(instance, fields):
+    values = instance.__dict__
+    if instance.pk is None:
+        return None
+    if not all(field in values for field in fields):
+        return _UNKNOWN
+    return tuple(values[field] for field in fields)
+
+
+def _rebuild_careers_of_players(*player_ids):
+    PlayerCareerStats.objects.rebuild(
+        Player.objects.filter(pk__in=player_ids).values_list('user_id', flat=True)
+    )
+
+
+def _counts(result):
+    """Whether a stashed match result counts towards the standings"""
+    return result is _UNKNOWN or (result is not None and any(_outcome(result, True)))
+
+
+def _notify_match_owner(match, *signals):
+    # Both teams of a match belong to the same owner
+    if Match.team_A.is_cached(match):
+        notify_owners(*signals, owner_ids=[match.team_A.owner_id])
+    else:
+        notify_owners(*signals, team_ids=[match.team_A_id])
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def update_standings_on_team_change(sender, instance, **kwargs):
+    notify_owners(roster_changed, standings_changed, owner_ids=[instance.owner_id])
+
+
+@receiver(m2m_changed, sender=Team.members.through)
+def update_roster_on_members_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            notify_owners(roster_changed, owner_ids=[instance.owner_id])
+    elif action in ('post_add', 'post_remove'):
+        notify_owners(roster_changed, team_ids=pk_set)
+    elif action == 'pre_clear':
+        notify_owners(roster_changed, team_ids=instance.team_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=TeamMembership)
+@receiver(post_delete, sender=TeamMembership)
+def update_roster_on_membership_change(sender, instance, **kwargs):
+    notify_owners(roster_changed, team_ids=[instance.team_id])
+
+
+@receiver(post_init, sender=Match)
+def remember_match_result(sender, instance, **kwargs):
+    instance._loaded_result = _loaded_values(instance, ('status', 'score_a', 'score_b'))
+
+
+@receiver(post_save, sender=Match)
+def update_careers_on_result(sender, instance, created, **kwargs):
+    old_result = instance._loaded_result
+    new_result = (instance.status, instance.score_a, instance.score_b)
+    instance._loaded_result = new_result
+    if old_result != new_result and (_counts(old_result) or _counts(new_result)):
+        _notify_match_owner(instance, roster_changed, standings_changed)
+    else:
+        _notify_match_owner(instance, roster_changed)
+    if created or old_result == new_result:
+        return
+    if old_result is _UNKNOWN:
+        _rebuild_careers_of_players(
+            *MatchParticipation.objects.filter(match_id=instance.pk).values_list('player_id', flat=True)
+        )
+        return
+
+    side_deltas = {}
+    for team_id, is_team_a in ((instance.team_A_id, True), (instance.team_B_id, False)):
+        new = _outcome(new_result, is_team_a)
+        old = _outcome(old_result, is_team_a)
+        side_deltas[team_id] = (0,) + tuple(n - o for n, o in zip(new, old)) + (0, 0, 0)
+
+    deltas = defaultdict(lambda: (0,) * len(CAREER_FIELDS))
+    # Not through instance.participations: a save retried on a locked
+    # database runs this again, which is not a lazy load per object
+    participations = MatchParticipation.objects.filter(match_id=instance.pk).order_by()
+    for team_id, user_id in participations.values_list('team_id', 'player__user_id'):
+        if team_id in side_deltas:
+            deltas[user_id] = _add(deltas[user_id], side_deltas[team_id])
+    PlayerCareerStats.objects.apply_deltas(deltas)
+
+
+@receiver(post_delete, sender=Match)
+def update_standings_on_match_delete(sender, instance, **kwargs):
+    if _counts(instance._loaded_result):
+        _notify_match_owner(instance, roster_changed, standings_changed)
+    else:
+        _notify_match_owner(instance, roster_changed)
+
+
+PARTICIPATION_STAT_FIELDS = ('player_id', 'team_id', 'goals', 'assists', 'minutes_played')
+
+
+@receiver(post_init, sender=MatchParticipation)
+def remember_participation_stats(sender, instance, **kwargs):
+    instance._loaded_stats = _loaded_values(instance, PARTICIPATION_STAT_FIELDS)
+
+
+@receiver(post_save, sender=MatchParticipation)
+def update_career_on_participation_save(sender, instance, **kwargs):
+    # Deletes come with the player, match or team, which notify the owner
+    notify_owners(roster_changed, team_ids=[instance.team_id])
+    old_stats = instance._loaded_stats
+    new_stats = tuple(getattr(instance, field) for field in PARTICIPATION_STAT_FIELDS)
+    instance._loaded_stats = new_stats
+    if old_stats == new_stats:
+        return
+    if old_stats is _UNKNOWN:
+        _rebuild_careers_of_players(instance.player_id)
+        return
+
+    player_ids = {new_stats[0]} | ({old_stats[0]} if old_stats else set())
+    users = dict(Player.objects.filter(pk__in=player_ids).values_list('pk', 'user_id'))
+    deltas = defaultdict(lambda: (0,) * len(CAREER_FIELDS))
+    if old_stats is not None:
+        deltas[users[old_stats[0]]] = _career_line(instance.match, *old_stats[1:], sign=-1)
+    user_id = users[new_stats[0]]
+    deltas[user_id] = _add(deltas[user_id], _career_line(instance.match, *new_stats[1:]))
+    PlayerCareerStats.objects.apply_deltas(deltas)
+
+
+@receiver(post_delete, sender=MatchParticipation)
+def update_career_on_participation_delete(sender, instance, **kwargs):
+    pending = _pending_career_rebuild.get()
+    if pending is not None:
+        pending['players'].add(instance.player_id)
+        return
+    user_id = Player.objects.filter(pk=instance.player_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        PlayerCareerStats.objects.apply_deltas({user_id: _career_line(
+            instance.match, instance.team_id, instance.goals, instance.assists,
+            instance.minutes_played, sign=-1
+        )})
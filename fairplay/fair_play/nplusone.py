@@ -0,0 +1,149 @@
+"""Detection of N+1 queries: one lazy related-object load repeated per row.
+
+A template that shows ``{{ team.owner }}`` for each team, or code that
+reads ``player.user`` in a loop, runs one query per object unless the view
+used ``select_related``/``prefetch_related``. While a request runs, each
+query made by a related descriptor or manager (``team.owner``,
+``team.players.count``, ``user.profile``...) is counted per relation,
+statement fingerprint and origin (see querylog.query_location). When
+``FAIRPLAY_NPLUSONE_THRESHOLD`` or more are made from one place, the
+request has an N+1 pattern.
+
+``FAIRPLAY_NPLUSONE`` picks what happens then: 'warn' logs a warning on
+the ``fair_play.nplusone`` logger (the default with ``DEBUG``), 'raise'
+fails the request with NPlusOneError (the default in the test runner,
+see fair_play.testing), and 'off' skips the detection (the default
+otherwise). Prefetch queries and writes through related managers are not
+counted.
+"""
+import logging
+
+from django.conf import settings
+from django.db.models import query
+from django.db.models.fields import related_descriptors
+
+from .querylog import fingerprint, query_location
+
+logger = logging.getLogger(__name__)
+
+MODES = ('off', 'warn', 'raise')
+
+_DESCRIPTORS_FILE = related_descriptors.__file__
+_QUERY_FILE = query.__file__
+# Functions that fetch what prefetch_related asked for
+_PREFETCH_FUNCTIONS = {
+    'prefetch_related_objects', 'prefetch_one_level', 'get_prefetch_queryset', 'get_prefetch_querysets'
+}
+
+
+class NPlusOneError(Exception):
+    """A request loaded the same relation lazily, once per object"""
+
+
+def mode():
+    """'off', 'warn' or 'raise', from FAIRPLAY_NPLUSONE"""
+    configured = getattr(settings, 'FAIRPLAY_NPLUSONE', None)
+    if configured is None:
+        return 'warn' if settings.DEBUG else 'off'
+    if configured not in MODES:
+        raise ValueError(f'FAIRPLAY_NPLUSONE must be one of {", ".join(MODES)}, not "{configured}"')
+    return configured
+
+
+def _relation_name(owner):
+    """'Model.field' of the descriptor or related manager ``owner``"""
+    if hasattr(owner, 'prefetch_cache_name'):
+        # Many-to-many manager
+        return f'{type(owner.instance).__name__}.{owner.prefetch_cache_name}'
+    if hasattr(owner, 'instance') and hasattr(owner, 'field'):
+        # Reverse foreign key manager
+        return f'{type(owner.instance).__name__}.{owner.field.remote_field.get_accessor_name()}'
+    if hasattr(owner, 'field'):
+        # Forward foreign key or one-to-one
+        return f'{owner.field.model.__name__}.{owner.field.name}'
+    if hasattr(owner, 'related'):
+        # Reverse one-to-one
+        return f'{owner.related.model.__name__}.{owner.related.get_accessor_name()}'
+    return None
+
+
+def _queryset_relation(queryset):
+    """'Model.field' of a queryset made by a related manager or descriptor, else None"""
+    instance = queryset._hints.get('instance')
+    if instance is None:
+        return None
+    model = type(instance)
+    for field in queryset._known_related_objects:
+        # Reverse foreign key manager
+        return f'{model.__name__}.{field.remote_field.get_accessor_name()}'
+    if queryset.model is model:
+        return f'{model.__name__} (deferred field or refresh)'
+    # Many-to-many manager (foreign keys have their descriptor on the stack)
+    fields = [
+        field for field in model._meta.get_fields()
+        if field.many_to_many and field.related_model is queryset.model
+    ]
+    if len(fields) == 1:
+        field = fields[0]
+        return f'{model.__name__}.{field.get_accessor_name() if field.auto_created else field.name}'
+    return f'{model.__name__} -> {queryset.model.__name__}'
+
+
+def lazy_relation(frame):
+    """The relation whose lazy load is running the query at ``frame``, or None.
+
+    The query may run in a related descriptor or manager (``player.user``,
+    ``team.players.count()``) or later, from a queryset a related manager
+    made (``{% for player in team.players.all %}``). Such querysets carry
+    the object they belong to as their 'instance' hint.
+    """
+    described = from_queryset = None
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name in _PREFETCH_FUNCTIONS:
+            return None
+        if described is None and code.co_filename == _DESCRIPTORS_FILE:
+            described = _relation_name(frame.f_locals.get('self'))
+        elif from_queryset is None and code.co_filename == _QUERY_FILE:
+            owner = frame.f_locals.get('self')
+            if isinstance(owner, query.QuerySet):
+                from_queryset = _queryset_relation(owner)
+        frame = frame.f_back
+    return described or from_queryset
+
+
+class LazyLoads:
+    """The lazy related-object loads of one request"""
+
+    def __init__(self):
+        # {(relation, fingerprint, origin): loads}
+        self.loads = {}
+
+    def record(self, sql, frame):
+        if sql.lstrip()[:6].upper() != 'SELECT':
+            return
+        relation = lazy_relation(frame)
+        if relation is None:
+            return
+        key = (relation, fingerprint(sql)[0], query_location())
+        self.loads[key] = self.loads.get(key, 0) + 1
+
+    def problems(self):
+        threshold = getattr(settings, 'FAIRPLAY_NPLUSONE_THRESHOLD', 2)
+        return [
+            f'{relation} loaded lazily {count} times at {origin}'
+            for (relation, _, origin), count in sorted(self.loads.items())
+            if count >= threshold
+        ]
+
+    def check(self, source, detection):
+        """Warn about, or raise for, the N+1 patterns found in ``source``"""
+        problems = self.problems()
+        if not problems:
+            return
+        message = (
+            f'N+1 queries in {source} (add select_related/prefetch_related):\n  ' + '\n  '.join(problems)
+        )
+        if detection == 'raise':
+            raise NPlusOneError(message)
+        logger.warning(message)
@@ -0,0 +1,184 @@
+"""Keyset (cursor) pagination.
+
+Instead of ``OFFSET n`` a page starts right after the sort key of the last
+row of the previous page, so page 100 costs the same as page one and rows
+inserted meanwhile do not shift pages. The ordering always ends with the
+primary key, which makes the sort key unique and page boundaries stable.
+
+NULLs sort first in ascending and last in descending orderings (SQLite's
+own behaviour), and the ORDER BY spells that out so every backend agrees
+with the cursor filters.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from functools import cached_property
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+AFTER = 'a'
+BEFORE = 'b'
+
+
+def encode_cursor(values):
+    encoded = [{'dt': value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(encoded, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """The values encoded by encode_cursor(); ValueError if the token is not one"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    decoded = []
+    for value in values:
+        if isinstance(value, dict):
+            value = parse_datetime(value.get('dt') or '')
+            if value is None:
+                raise ValueError('Invalid cursor')
+        decoded.append(value)
+    return decoded
+
+
+class KeysetPaginator:
+    """Paginate ``queryset`` on ``ordering`` (field paths, '-' for descending)"""
+
+    def __init__(self, queryset, ordering, per_page):
+        ordering = list(ordering)
+        if ordering[-1].lstrip('-') not in ('pk', 'id'):
+            # Tie-break on the primary key, in the direction of the last field
+            ordering.append('-pk' if ordering[-1].startswith('-') else 'pk')
+        self.keys = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def order_by(self, reverse=False):
+        expressions = []
+        for path, descending in self.keys:
+            if descending != reverse:
+                expressions.append(F(path).desc(nulls_last=True))
+            else:
+                expressions.append(F(path).asc(nulls_first=True))
+        return expressions
+
+    def _beyond(self, path, descending, value):
+        """Rows strictly past ``value`` on one key, in the direction of the ordering"""
+        if descending:
+            if value is None:
+                return None  # NULLs come last
+            return Q(**{f'{path}__lt': value}) | Q(**{f'{path}__isnull': True})
+        if value is None:
+            return Q(**{f'{path}__isnull': False})
+        return Q(**{f'{path}__gt': value})
+
+    def _before(self, path, descending, value):
+        return self._beyond(path, not descending, value)
+
+    def seek(self, values, direction):
+        """Filter for the rows after (or before) the row whose sort key is ``values``"""
+        if len(values) != len(self.keys):
+            raise ValueError('Invalid cursor')
+        beyond = self._beyond if direction == AFTER else self._before
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (path, descending), value in zip(self.keys, values):
+            step = beyond(path, descending, value)
+            if step is not None:
+                condition |= equal & step
+            equal &= Q(**{f'{path}__isnull': True}) if value is None else Q(**{path: value})
+        return condition
+
+    def page(self, params, param='page'):
+        """The page selected by the ``param`` cursor in ``params`` (e.g. request.GET).
+
+        Missing or invalid cursors give the first page.
+        """
+        direction, token = None, None
+        raw = params.get(param, '')
+        if raw[:2] in (f'{AFTER}.', f'{BEFORE}.'):
+            direction, token = raw[0], raw[2:]
+        queryset = self.queryset
+        if direction:
+            try:
+                queryset = queryset.filter(self.seek(decode_cursor(token), direction))
+            except ValueError:
+                direction, queryset = None, self.queryset
+        return KeysetPage(self, queryset, direction, params, param)
+
+
+class KeysetPage:
+    """One page of rows; evaluated lazily, on first use"""
+
+    def __init__(self, paginator, queryset, direction, params, param):
+        self.paginator = paginator
+        self.queryset = queryset
+        self.direction = direction
+        self.params = params
+        self.param = param
+
+    @cached_property
+    def _rows(self):
+        paginator = self.paginator
+        aliases = [f'_keyset_{i}' for i in range(len(paginator.keys))]
+        queryset = self.queryset.annotate(**{
+            alias: F(path) for alias, (path, _) in zip(aliases, paginator.keys)
+        }).order_by(*paginator.order_by(reverse=self.direction == BEFORE))
+        rows = list(queryset[:paginator.per_page + 1])
+        more = len(rows) > paginator.per_page
+        rows = rows[:paginator.per_page]
+        if self.direction == BEFORE:
+            rows.reverse()
+        if rows and isinstance(rows[0], dict):
+            # Rows of a .values() queryset carry the sort keys as extra columns
+            keys = [[row.pop(alias) for alias in aliases] for row in rows]
+        else:
+            keys = [[getattr(row, alias) for alias in aliases] for row in rows]
+        return rows, keys, more
+
+    @property
+    def object_list(self):
+        return self._rows[0]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_next(self):
+        _, keys, more = self._rows
+        return bool(keys) and (more or self.direction == BEFORE)
+
+    @property
+    def has_previous(self):
+        _, keys, more = self._rows
+        return bool(keys) and (self.direction == AFTER or (self.direction == BEFORE and more))
+
+    def _query(self, direction, values):
+        params = self.params.copy()
+        params[self.param] = f'{direction}.{encode_cursor(values)}'
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        """Query string of the next page, keeping the other parameters"""
+        return self._query(AFTER, self._rows[1][-1]) if self.has_next else ''
+
+    @property
+    def previous_query(self):
+        return self._query(BEFORE, self._rows[1][0]) if self.has_previous else ''
+
+    @property
+    def cursor(self):
+        """The cursor this page was requested with, for cache keys"""
+        return self.params.get(self.param, '') if self.direction else ''
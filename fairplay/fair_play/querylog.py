@@ -0,0 +1,217 @@
+"""A log of the SQL statements that cost the most, grouped by their shape.
+
+Queries are reduced to a fingerprint: the SQL with literals and
+placeholders replaced by ``?``, ``IN``/``VALUES`` lists collapsed and
+whitespace squeezed. ``WHERE id = 3`` and ``WHERE id = 7`` are one
+statement, and so are ``IN (1, 2)`` and ``IN (1, 2, 3)``.
+
+While a request (or a background job) runs, its queries are added up per
+fingerprint and place of origin: the template line, or failing that the
+line of fair_play code, that ran them. When it ends, a fingerprint is
+written to ``FAIRPLAY_QUERY_LOG`` if one of its runs took
+``FAIRPLAY_SLOW_QUERY_MS`` or more, if all of its runs together did, or
+if it ran ``FAIRPLAY_REPEATED_QUERY_COUNT`` times or more, as a query in
+a loop does. The log is JSON lines, rotated at
+``FAIRPLAY_QUERY_LOG_BYTES`` with ``FAIRPLAY_QUERY_LOG_BACKUPS`` old
+files kept. ``manage.py slowqueries`` reports the worst offenders.
+
+The log is off unless ``FAIRPLAY_QUERY_LOG`` names a file. Rotation is
+not coordinated between processes; give each server process its own
+file if they rotate often.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import base as template_base
+from django.utils import timezone
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Code that runs queries on someone else's behalf; the caller is the origin
+_INTERMEDIARIES = {
+    os.path.join(APP_DIR, name) for name in ('querylog.py', 'metrics.py', 'nplusone.py', 'db.py')
+}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+# (?, ?, ?) and IN lists of any length
+_GROUP = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_GROUPS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+# Django's savepoint names, e.g. "s140247_x2"
+_SAVEPOINT = re.compile(r'"s\d+_x\d+"')
+_SPACE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize(sql):
+    """``sql`` with its literals, placeholders and lists reduced to one shape"""
+    sql = _STRING.sub('?', sql)
+    sql = _SAVEPOINT.sub('"s?"', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _GROUP.sub('(...)', sql)
+    sql = _GROUPS.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """(short id, normalized SQL) of a statement"""
+    shape = normalize(sql)
+    return hashlib.md5(shape.encode()).hexdigest()[:12], shape
+
+
+@functools.lru_cache(maxsize=None)
+def _app_path(filename):
+    return f'fair_play/{os.path.relpath(filename, APP_DIR)}'
+
+
+def query_location():
+    """Where the running query comes from: 'template.html:12 (fair_play/views.py:40 in view)'.
+
+    The template line is the innermost one being rendered; the code line is
+    the innermost fair_play frame outside the query plumbing.
+    """
+    frame = sys._getframe(1)
+    template = None
+    while frame is not None:
+        code = frame.f_code
+        filename = code.co_filename
+        if template is None and code is template_base.Node.render_annotated.__code__:
+            node = frame.f_locals.get('self')
+            origin, token = getattr(node, 'origin', None), getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template = f'{origin.template_name}:{token.lineno}'
+        elif filename.startswith(APP_DIR) and filename not in _INTERMEDIARIES:
+            line = f'{_app_path(filename)}:{frame.f_lineno} in {code.co_name}'
+            return f'{template} ({line})' if template else line
+        frame = frame.f_back
+    return template or '<unknown>'
+
+
+def enabled():
+    return bool(getattr(settings, 'FAIRPLAY_QUERY_LOG', None))
+
+
+def log_files(path=None):
+    """The log file and its rotated copies, newest first"""
+    path = path or settings.FAIRPLAY_QUERY_LOG
+    backups = getattr(settings, 'FAIRPLAY_QUERY_LOG_BACKUPS', 5)
+    return [name for name in (path, *(f'{path}.{i}' for i in range(1, backups + 1))) if os.path.exists(name)]
+
+
+class QueryLog:
+    """The queries of one request (or job), by fingerprint and origin"""
+
+    def __init__(self):
+        # {(sql, location): [count, total seconds, max seconds]}
+        self.statements = {}
+
+    def record(self, sql, seconds):
+        key = (sql, query_location())
+        stats = self.statements.get(key)
+        if stats is None:
+            self.statements[key] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def entries(self, source):
+        """The costly or repeated statements, as log entries"""
+        slow = getattr(settings, 'FAIRPLAY_SLOW_QUERY_MS', 100) / 1000
+        repeated = getattr(settings, 'FAIRPLAY_REPEATED_QUERY_COUNT', 10)
+        # One fingerprint may be split across origins; it counts as a whole
+        totals = {}
+        for (sql, _), (count, total, _) in self.statements.items():
+            shape = fingerprint(sql)
+            previous = totals.get(shape, (0, 0.0))
+            totals[shape] = (previous[0] + count, previous[1] + total)
+        at = timezone.now().isoformat()
+        for (sql, location), (count, total, longest) in self.statements.items():
+            shape = fingerprint(sql)
+            all_count, all_total = totals[shape]
+            if longest >= slow or all_total >= slow or all_count >= repeated:
+                yield {
+                    'at': at, 'source': source, 'fingerprint': shape[0], 'sql': shape[1], 'location': location,
+                    'count': count, 'total_ms': round(total * 1000, 3), 'max_ms': round(longest * 1000, 3),
+                }
+
+    def write(self, source):
+        lines = [json.dumps(entry) for entry in self.entries(source)]
+        if lines:
+            _file_logger().info('\n'.join(lines))
+
+
+_handler_lock = threading.Lock()
+_logger = None
+
+
+def _file_logger():
+    global _logger
+    with _handler_lock:
+        if _logger is None:
+            path = settings.FAIRPLAY_QUERY_LOG
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            handler = RotatingFileHandler(
+                path, maxBytes=getattr(settings, 'FAIRPLAY_QUERY_LOG_BYTES', 10 * 1024 * 1024),
+                backupCount=getattr(settings, 'FAIRPLAY_QUERY_LOG_BACKUPS', 5), encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            # Not the 'fair_play' logger: entries only go to the file
+            _logger = logging.Logger(f'{__name__}.file', logging.INFO)
+            _logger.addHandler(handler)
+        return _logger
+
+
+@receiver(setting_changed)
+def reset_file_logger(setting, **kwargs):
+    global _logger
+    if setting.startswith('FAIRPLAY_QUERY_LOG'):
+        with _handler_lock:
+            if _logger is not None:
+                for handler in _logger.handlers:
+                    handler.close()
+            _logger = None
+
+
+def summarize(paths, source=None):
+    """Log entries in ``paths`` added up per fingerprint, optionally for one source.
+
+    Each summary lists the fingerprint's origins (location, source) by
+    their total time.
+    """
+    summaries = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash or a concurrent rotation
+                    continue
+                if source is not None and entry['source'] != source:
+                    continue
+                summary = summaries.setdefault(entry['fingerprint'], {
+                    'fingerprint': entry['fingerprint'], 'sql': entry['sql'], 'count': 0, 'total_ms': 0.0,
+                    'max_ms': 0.0, 'requests': 0, 'origins': {},
+                })
+                summary['count'] += entry['count']
+                summary['total_ms'] += entry['total_ms']
+                summary['max_ms'] = max(summary['max_ms'], entry['max_ms'])
+                summary['requests'] += 1
+                origin = (entry['location'], entry['source'])
+                summary['origins'][origin] = summary['origins'].get(origin, 0.0) + entry['total_ms']
+    for summary in summaries.values():
+        summary['origins'] = sorted(summary['origins'].items(), key=lambda item: -item[1])
+    return list(summaries.values())
@@ -0,0 +1,340 @@
+"""Player ratings learned from match results (team Elo).
+
+A side's strength is the mean rating of the players who took part, and
+both sides expect ``1 / (1 + 10 ** (gap / SCALE))`` of a win (a draw
+counts half). After the match every player on a side moves by
+``K_FACTOR * (result - expected)``. Players start from their hand-set
+``Player.rating`` and the learned value is kept in
+``Player.learned_rating``, with one RatingHistory row per participant and
+rated match.
+
+Ratings follow results as they are recorded: saving a played result rates
+the match, correcting it re-rates the match from the same starting
+ratings, and un-playing it takes the change back. ``replay_ratings`` (the
+``rebuild_ratings`` command) recomputes everything from the stored
+matches, oldest first. Both give the same ratings when results are
+recorded in the order the matches were played. Replays also drop the
+effect of matches that have since been deleted.
+"""
+from collections import defaultdict
+from itertools import chain
+
+from django.db import connections, router, transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Match, MatchParticipation, Player, RatingHistory, notify_owners, roster_changed
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, replays fall back to pure Python
+    np = None
+
+# Rating points a player gains for a win their side was given no chance of
+K_FACTOR = 4.0
+# A side this many points stronger on average is expected to win 10 to 1
+SCALE = 40.0
+
+
+def expected_score(rating, opponent_rating):
+    """Expected result (1 win, 0.5 draw, 0 loss) of a side against another"""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / SCALE))
+
+
+def result_of(score_a, score_b):
+    """Result of team A"""
+    return 1.0 if score_a > score_b else 0.5 if score_a == score_b else 0.0
+
+
+def is_decided(match):
+    return match.status == Match.Status.PLAYED and match.score_a is not None and match.score_b is not None
+
+
+def match_changes(ratings_a, ratings_b, result_a):
+    """((expected, change) of side A, (expected, change) of side B), or None if a side is empty"""
+    if not ratings_a or not ratings_b:
+        return None
+    mean_a = sum(ratings_a) / len(ratings_a)
+    mean_b = sum(ratings_b) / len(ratings_b)
+    expected_a = expected_score(mean_a, mean_b)
+    expected_b = expected_score(mean_b, mean_a)
+    return (
+        (expected_a, K_FACTOR * (result_a - expected_a)),
+        (expected_b, K_FACTOR * ((1 - result_a) - expected_b)),
+    )
+
+
+def _current_rating():
+    return Coalesce(F('learned_rating'), F('rating'), output_field=FloatField())
+
+
+def update_match_ratings(match):
+    """Bring the participants' ratings in line with the match's current result.
+
+    A match rated before is re-rated from the ratings its players had
+    going in, so correcting a score does not count the match twice.
+    Costs a handful of queries whatever the number of players.
+    """
+    history = {row.player_id: row for row in RatingHistory.objects.filter(match=match)}
+    changes = None
+    if is_decided(match):
+        participants = list(match.participations.order_by().values_list(
+            'player_id', 'team_id', 'player__rating', 'player__learned_rating'
+        ))
+        before = {}
+        sides = ([], [])
+        for player_id, team_id, rating, learned_rating in participants:
+            row = history.get(player_id)
+            before[player_id] = row.rating_before if row else (rating if learned_rating is None else learned_rating)
+            sides[team_id != match.team_A_id].append(player_id)
+        changes = match_changes(
+            [before[player_id] for player_id in sides[0]],
+            [before[player_id] for player_id in sides[1]],
+            result_of(match.score_a, match.score_b)
+        )
+    if changes is None:
+        sides = ((), ())
+
+    # Each player's rating moves by the difference between the new and the old change
+    shifts = {}
+    created, updated = [], []
+    for side, (expected, change) in zip(sides, changes or ()):
+        for player_id in side:
+            row = history.pop(player_id, None)
+            rating_after = before[player_id] + change
+            if row is None:
+                shifts[player_id] = change
+                created.append(RatingHistory(
+                    player_id=player_id, match=match, rating_before=before[player_id],
+                    rating_after=rating_after, expected=expected
+                ))
+            elif (row.rating_after, row.expected) != (rating_after, expected):
+                shifts[player_id] = rating_after - row.rating_after
+                row.rating_after, row.expected = rating_after, expected
+                updated.append(row)
+    # Left over: players no longer in a rated side, or the match is no longer played
+    for player_id, row in history.items():
+        shifts[player_id] = row.rating_before - row.rating_after
+
+    if not shifts:
+        return
+    with transaction.atomic():
+        Player.objects.filter(pk__in=shifts).update(learned_rating=_current_rating() + Case(
+            *[When(pk=player_id, then=Value(shift)) for player_id, shift in shifts.items()],
+            output_field=FloatField()
+        ))
+        if history:
+            RatingHistory.objects.filter(pk__in=[row.pk for row in history.values()]).delete()
+        if updated:
+            RatingHistory.objects.bulk_update(updated, ['rating_after', 'expected'])
+        if created:
+            RatingHistory.objects.bulk_create(created)
+
+
+@receiver(post_save, sender=Match)
+def update_ratings_on_result(sender, instance, created, **kwargs):
+    # A new match has no participants yet, see match_create_view
+    if not created:
+        update_match_ratings(instance)
+
+
+def _replay_python(matches, participations, seeds):
+    """History rows (player, match, before, after, expected) and final ratings, one match at a time"""
+    by_match = defaultdict(list)
+    for match_id, player_id, team_id in participations:
+        by_match[match_id].append((player_id, team_id))
+    ratings = dict(seeds)
+    history = []
+    for match_id, team_a_id, result_a in matches:
+        sides = ([], [])
+        for player_id, team_id in by_match.get(match_id, ()):
+            sides[team_id != team_a_id].append(player_id)
+        changes = match_changes(
+            [ratings[player_id] for player_id in sides[0]],
+            [ratings[player_id] for player_id in sides[1]],
+            result_a
+        )
+        if changes is None:
+            continue
+        for side, (expected, change) in zip(sides, changes):
+            for player_id in side:
+                before = ratings[player_id]
+                ratings[player_id] = before + change
+                history.append((player_id, match_id, before, before + change, expected))
+    rated = {row[0] for row in history}
+    return history, {player_id: ratings[player_id] for player_id in rated}
+
+
+def _replay_numpy(matches, participations, seeds):
+    """Same as _replay_python, with NumPy.
+
+    Matches are sorted into waves: a match goes one wave after the latest
+    wave any of its players appeared in. No player appears twice in a
+    wave, so a whole wave of matches is rated at once: the rating steps
+    number the most matches any one player has played, not the matches.
+    """
+    if not matches or not participations:
+        return [], {}
+    match_ids = np.array([row[0] for row in matches], dtype=np.int64)
+    team_a_ids = np.array([row[1] for row in matches], dtype=np.int64)
+    results_a = np.array([row[2] for row in matches], dtype=float)
+    rows = np.fromiter(
+        chain.from_iterable(participations), dtype=np.int64, count=3 * len(participations)
+    ).reshape(-1, 3)
+
+    # Position of each participation's match in playing order
+    by_id = np.argsort(match_ids)
+    found = by_id[np.clip(np.searchsorted(match_ids, rows[:, 0], sorter=by_id), 0, len(match_ids) - 1)]
+    known = match_ids[found] == rows[:, 0]
+    rows, position = rows[known], found[known]
+    side = (rows[:, 2] != team_a_ids[position]).astype(np.int64)
+    # Playing order, side A before side B, participations in loading order
+    order = np.lexsort((side, position))
+    position, side, player_ids = position[order], side[order], rows[order, 1]
+    players, player_index = np.unique(player_ids, return_inverse=True)
+    ratings = np.array([seeds[player_id] for player_id in players.tolist()], dtype=float)
+
+    # One pass in playing order: a match comes one wave after the latest
+    # wave any of its players has been in
+    bounds = np.flatnonzero(np.r_[True, position[1:] != position[:-1], True])
+    latest = np.zeros(len(players), dtype=np.int64)
+    waves = np.empty(len(bounds) - 1, dtype=np.int64)
+    for match, (start, stop) in enumerate(zip(bounds.tolist(), bounds[1:].tolist())):
+        indexes = player_index[start:stop]
+        waves[match] = latest[indexes].max() + 1
+        latest[indexes] = waves[match]
+    row_wave = np.repeat(waves, np.diff(bounds))
+
+    before = np.empty(len(position))
+    after = np.empty(len(position))
+    expected = np.full(len(position), np.nan)
+    # Stable, so every wave keeps the (match, side) order of the rows
+    by_wave = np.argsort(row_wave, kind='stable')
+    edges = np.searchsorted(row_wave[by_wave], np.arange(1, waves.max() + 2))
+    for start, stop in zip(edges[:-1], edges[1:]):
+        wave_rows = by_wave[start:stop]
+        indexes = player_index[wave_rows]
+        current = ratings[indexes]
+        groups = position[wave_rows] * 2 + side[wave_rows]
+        group_starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        sizes = np.diff(np.r_[group_starts, len(groups)])
+        means = np.add.reduceat(current, group_starts) / sizes
+        keys = groups[group_starts]
+        # Side A of a match is directly followed by its side B
+        first = np.flatnonzero(keys[1:] // 2 == keys[:-1] // 2)
+        paired = np.zeros(len(keys), dtype=bool)
+        paired[first] = paired[first + 1] = True
+        opponents = means.copy()
+        opponents[first], opponents[first + 1] = means[first + 1], means[first]
+        group_expected = 1 / (1 + 10 ** ((opponents - means) / SCALE))
+        results = np.where(keys % 2, 1 - results_a[keys // 2], results_a[keys // 2])
+        changes = np.where(paired, K_FACTOR * (results - group_expected), 0.0)
+
+        row_group = np.repeat(np.arange(len(keys)), sizes)
+        before[wave_rows] = current
+        after[wave_rows] = current + changes[row_group]
+        expected[wave_rows] = np.where(paired, group_expected, np.nan)[row_group]
+        ratings[indexes] = after[wave_rows]
+
+    rated = ~np.isnan(expected)
+    history = list(zip(
+        player_ids[rated].tolist(), match_ids[position[rated]].tolist(),
+        before[rated].tolist(), after[rated].tolist(), expected[rated].tolist()
+    ))
+    rated_players = np.unique(player_index[rated])
+    return history, dict(zip(players[rated_players].tolist(), ratings[rated_players].tolist()))
+
+
+def load_results(owner_ids=None):
+    """What a replay needs, for the rosters of ``owner_ids`` or everyone when None.
+
+    Returns the decided matches in playing order as (id, team A id, result
+    of team A), their participations as (match id, player id, team id) and
+    {player id: hand-set rating}.
+    """
+    matches = Match.objects.decided()
+    participations = MatchParticipation.objects.filter(
+        match__status=Match.Status.PLAYED, match__score_a__isnull=False, match__score_b__isnull=False
+    )
+    players = Player.objects.all()
+    if owner_ids is not None:
+        owner_ids = list(owner_ids)
+        matches = matches.filter(team_A__owner_id__in=owner_ids)
+        participations = participations.filter(player__owner_id__in=owner_ids)
+        players = players.filter(owner_id__in=owner_ids)
+    # One read transaction, so the three queries see the same results
+    with transaction.atomic():
+        matches = [
+            (match_id, team_a_id, result_of(score_a, score_b))
+            for match_id, team_a_id, score_a, score_b in matches.order_by(
+                Coalesce('played_at', 'date_created'), 'pk'
+            ).values_list('pk', 'team_A_id', 'score_a', 'score_b').iterator(chunk_size=5000)
+        ]
+        participations = list(
+            participations.order_by().values_list('match_id', 'player_id', 'team_id').iterator(chunk_size=5000)
+        )
+        seeds = dict(players.order_by().values_list('pk', 'rating').iterator(chunk_size=5000))
+    return matches, participations, seeds
+
+
+def compute_ratings(matches, participations, seeds, vectorized=None):
+    """Replay ``matches`` in order; returns (history rows, {player id: learned rating}).
+
+    History rows are (player id, match id, rating before, rating after,
+    expected result). Uses NumPy when it is installed, unless
+    ``vectorized`` is False.
+    """
+    if vectorized is None:
+        vectorized = np is not None
+    if vectorized:
+        return _replay_numpy(matches, participations, seeds)
+    return _replay_python(matches, participations, seeds)
+
+
+def save_ratings(history, ratings, owner_ids=None):
+    """Replace the learned ratings and rating history of ``owner_ids``' players (everyone when None).
+
+    The rows are written with executemany: a replay has one history row
+    per participation, and bulk_create (a model instance each, and at most
+    166 rows per INSERT on SQLite) took thirty times longer than the
+    replay itself.
+    """
+    players = Player.objects.all()
+    old_history = RatingHistory.objects.all()
+    if owner_ids is not None:
+        owner_ids = list(owner_ids)
+        players = players.filter(owner_id__in=owner_ids)
+        old_history = old_history.filter(player__owner_id__in=owner_ids)
+    connection = connections[router.db_for_write(RatingHistory)]
+    quote = connection.ops.quote_name
+    recorded_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    history_columns = ', '.join(quote(RatingHistory._meta.get_field(name).column) for name in (
+        'player', 'match', 'rating_before', 'rating_after', 'expected', 'recorded_at'
+    ))
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        old_history.delete()
+        players.filter(learned_rating__isnull=False).update(learned_rating=None)
+        cursor.executemany(
+            f'UPDATE {quote(Player._meta.db_table)} SET {quote(Player._meta.get_field("learned_rating").column)} = %s '
+            f'WHERE {quote(Player._meta.pk.column)} = %s',
+            [(rating, player_id) for player_id, rating in ratings.items()]
+        )
+        cursor.executemany(
+            f'INSERT INTO {quote(RatingHistory._meta.db_table)} ({history_columns}) VALUES (%s, %s, %s, %s, %s, %s)',
+            [row + (recorded_at,) for row in history]
+        )
+        notify_owners(roster_changed, owner_ids=set(players.order_by().values_list('owner_id', flat=True).distinct()))
+
+
+def replay_ratings(owner_ids=None, vectorized=None):
+    """Recompute learned ratings and their history from every decided match.
+
+    Returns the number of matches, rated participations and rated players.
+    """
+    matches, participations, seeds = load_results(owner_ids)
+    history, ratings = compute_ratings(matches, participations, seeds, vectorized)
+    save_ratings(history, ratings, owner_ids)
+    return len(matches), len(history), len(ratings)
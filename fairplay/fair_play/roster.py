@@ -0,0 +1,226 @@
+"""Roster snapshots and batch team drafting for one or many owners."""
+from array import array
+
+from django.db import transaction
+from django.db.models import FloatField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .balancing import DEFAULT_BALANCER, get_balancer
+from .db import retry_on_locked
+from .models import (
+    Player, Team, TeamMembership, deferred_owner_signals, deferred_team_aggregates, notify_owners,
+    roster_changed, standings_changed
+)
+
+# Fewest teams a roster is drafted into, on every path (form, API, command)
+MIN_TEAMS = 2
+
+
+class RosterSnapshot:
+    """Players of one or more owners held as parallel arrays.
+
+    Rows are grouped by owner and, within an owner, sorted by rating (high to
+    low) then position, the order the balancing engines expect. Loading a
+    snapshot is a single ``values_list`` query; no model instances are built.
+    Ratings are the hand-set ones (integers), or with ``learned=True`` the
+    ratings learned from results where players have one (floats).
+    """
+    __slots__ = ('player_ids', 'user_ids', 'ratings', 'positions', 'ranges')
+
+    def __init__(self, rows=(), learned=False):
+        self.player_ids = array('q')
+        self.user_ids = array('q')
+        self.ratings = array('d' if learned else 'q')
+        self.positions = []
+        # owner id -> (start, stop) slice of the arrays
+        self.ranges = {}
+
+        start = 0
+        current_owner = None
+        for owner_id, player_id, user_id, rating, position in rows:
+            if owner_id != current_owner:
+                if current_owner is not None:
+                    self.ranges[current_owner] = (start, len(self.player_ids))
+                current_owner, start = owner_id, len(self.player_ids)
+            self.player_ids.append(player_id)
+            self.user_ids.append(user_id)
+            self.ratings.append(rating)
+            self.positions.append(position)
+        if current_owner is not None:
+            self.ranges[current_owner] = (start, len(self.player_ids))
+
+    @classmethod
+    def for_owners(cls, owner_ids=None, learned=False):
+        """Snapshot the rosters of ``owner_ids``, or of every owner when None"""
+        players = Player.objects.all()
+        if owner_ids is not None:
+            players = players.filter(owner_id__in=list(owner_ids))
+        rating = 'rating'
+        if learned:
+            players = players.annotate(current_rating=Coalesce('learned_rating', 'rating', output_field=FloatField()))
+            rating = 'current_rating'
+        return cls(
+            players.order_by('owner_id', f'-{rating}', 'position')
+            .values_list('owner_id', 'id', 'user_id', rating, 'position')
+            .iterator(chunk_size=5000),
+            learned=learned
+        )
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def owners(self):
+        return list(self.ranges)
+
+    def roster(self, owner_id):
+        """Row indexes of the owner's players (empty if they have none)"""
+        return range(*self.ranges.get(owner_id, (0, 0)))
+
+
+def position_quotas(minimums=None, maximums=None):
+    """Build quotas for the position balancer from {position code: count} dicts.
+
+    Codes are the ``Player.Position`` names (GK, DF, MD, ST).
+    """
+    quotas = {}
+    for index, bounds in enumerate((minimums or {}, maximums or {})):
+        for code, count in bounds.items():
+            position = Player.Position[code].value
+            quota = list(quotas.get(position, (None, None)))
+            quota[index] = count
+            quotas[position] = tuple(quota)
+    return quotas
+
+
+def draft_rosters(snapshot, team_names, engine=DEFAULT_BALANCER, errors=None, **options):
+    """Balance every owner's roster in the snapshot into teams.
+
+    ``team_names`` is either one list of names used for every owner or a dict
+    of owner id -> list of names. ``options`` are passed to the engine, e.g.
+    ``quotas`` for the position balancer. Returns owner id ->
+    {team name: [row indexes]}.
+
+    Engines raise ValueError when a roster cannot satisfy their constraints.
+    If an ``errors`` dict is given, such owners are skipped and their error
+    message is stored in it instead.
+    """
+    balancer = get_balancer(engine, **options)
+    drafts = {}
+    for owner_id in snapshot.owners():
+        names = team_names[owner_id] if isinstance(team_names, dict) else team_names
+        names = list(dict.fromkeys(names))
+        if not names:
+            continue
+        rows = snapshot.roster(owner_id)
+        try:
+            assignment = balancer.assign(
+                [snapshot.ratings[row] for row in rows],
+                len(names),
+                [snapshot.positions[row] for row in rows]
+            )
+        except ValueError as error:
+            if errors is None:
+                raise
+            errors[owner_id] = str(error)
+            continue
+
+        teams = {name: [] for name in names}
+        for row, team_index in zip(rows, assignment):
+            teams[names[team_index]].append(row)
+        drafts[owner_id] = teams
+    return drafts
+
+
+def save_drafts(snapshot, drafts):
+    """Replace the teams of every drafted owner in a single transaction.
+
+    The number of queries does not depend on the number of owners or players:
+    teams, player assignments, member rows and membership records are all
+    written in bulk, and the team aggregates are refreshed once at the end.
+    Returns the created teams.
+    """
+    owner_ids = list(drafts)
+    if not owner_ids:
+        return []
+
+    with transaction.atomic(), deferred_team_aggregates(), deferred_owner_signals():
+        # Close all current memberships before resetting teams
+        TeamMembership.objects.filter(
+            player__owner_id__in=owner_ids,
+            left_at__isnull=True
+        ).update(left_at=timezone.now())
+
+        #Clear old teams owned by the drafted owners
+        Team.objects.filter(owner_id__in=owner_ids).delete()
+        Player.objects.filter(owner_id__in=owner_ids).update(team=None)
+
+        new_teams = [
+            (Team(name=team_name, owner_id=owner_id), rows)
+            for owner_id, teams in drafts.items()
+            for team_name, rows in teams.items()
+        ]
+        created = Team.objects.bulk_create([team for team, _ in new_teams])
+        notify_owners(roster_changed, standings_changed, owner_ids=owner_ids)
+
+        players = []
+        member_rows = []
+        memberships = []
+        for team, rows in new_teams:
+            member_ids = set()
+            for row in rows:
+                player_id = snapshot.player_ids[row]
+                user_id = snapshot.user_ids[row]
+                players.append(Player(pk=player_id, team_id=team.pk))
+                memberships.append(TeamMembership(player_id=player_id, team_id=team.pk))
+
+                # Only add the player's user to THIS team's members
+                if user_id not in member_ids:
+                    member_ids.add(user_id)
+                    member_rows.append(Team.members.through(team_id=team.pk, user_id=user_id))
+
+        Player.objects.bulk_update(players, ['team'])
+        Team.members.through.objects.bulk_create(member_rows)
+        TeamMembership.objects.bulk_create(memberships)
+    return created
+
+
+def regenerate_teams(owner_id, team_names, engine=DEFAULT_BALANCER, minimums=None, maximums=None, learned=False):
+    """Draft the owner's roster into ``team_names`` and replace their teams.
+
+    ``minimums`` and ``maximums`` are the position quotas of the
+    'positions' engine, as {position code: count}. Raises ValueError when
+    the roster cannot be drafted. Returns the created teams.
+    """
+    if len(set(team_names)) < MIN_TEAMS:
+        raise ValueError(f'Please provide at least {MIN_TEAMS} different team names.')
+    snapshot = RosterSnapshot.for_owners([owner_id], learned=learned)
+    if not len(snapshot):
+        raise ValueError('No players available. Please add players first.')
+    options = {}
+    if engine == 'positions':
+        options['quotas'] = position_quotas(minimums, maximums)
+    drafts = draft_rosters(snapshot, team_names, engine, **options)
+    # Team generation rewrites the whole roster; retried if another
+    # request holds the write lock
+    return retry_on_locked(save_drafts)(snapshot, drafts)
+
+
+def add_owner_as_player(user):
+    """``user``'s player on their own roster, added at their preferred position if missing.
+
+    Returns (player, created).
+    """
+    player = Player.objects.filter(owner=user, user=user).first()
+    if player is not None:
+        return player, False
+    player = Player.objects.create(user=user, owner=user, position=user.profile.preferred_position, rating=70)
+    return player, True
+
+
+def reset_roster(owner_id):
+    """Close the owner's memberships and delete all their players; returns the players deleted"""
+    with transaction.atomic():
+        TeamMembership.objects.filter(player__owner_id=owner_id, left_at__isnull=True).update(left_at=timezone.now())
+        _, deleted = Player.objects.filter(owner_id=owner_id).delete()
+    return deleted.get(Player._meta.label, 0)
@@ -0,0 +1,147 @@
+"""Read/write splitting: analytics reads on a secondary database, the rest on the primary.
+
+Querysets behind the history pages, exports and standings are wrapped in
+``for_analytics()``. AnalyticsRouter sends them to the alias named by
+``settings.FAIRPLAY_ANALYTICS_DB`` (e.g. a 'replica' kept up to date by
+``manage.py snapshot_replica``), when one is set. Every other read, and
+every write, goes to 'default'.
+
+Read-your-writes: once a request writes, ``for_analytics()`` leaves its
+querysets on the primary for the rest of the request. ``primary_pin_middleware``
+then sets a cookie that does the same for the user's next requests. This
+covers the page a POST redirects to, until the replica has had time to
+catch up (``FAIRPLAY_PRIMARY_PIN_SECONDS``).
+
+A replica may lag behind the primary. Values computed from it are cached
+under ``analytics_generation()``, which changes with every snapshot, so a
+table computed from an old snapshot is not served once a newer one exists.
+"""
+import os
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+
+# QuerySet hint read by AnalyticsRouter
+ANALYTICS_HINT = 'fair_play_analytics'
+PIN_COOKIE = 'fairplay_primary'
+
+
+class _Route:
+    """Routing state of one request; shared by the threads serving it"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_route = ContextVar('fair_play_route', default=None)
+
+
+def analytics_db():
+    """The alias analytics reads go to, or None to keep them on the primary"""
+    alias = getattr(settings, 'FAIRPLAY_ANALYTICS_DB', None)
+    if alias and alias != DEFAULT_DB_ALIAS and alias in settings.DATABASES:
+        return alias
+    return None
+
+
+def pinned_to_primary():
+    """Whether this request wrote, or follows a recent write by the same user"""
+    route = _route.get()
+    return route is not None and route.pinned
+
+
+def for_analytics(queryset):
+    """``queryset``, sent to the analytics database unless it must see this user's writes"""
+    if analytics_db() is None or pinned_to_primary():
+        return queryset
+    queryset = queryset.all()
+    # Clones share the hints dict, so give this one (and its clones) its own
+    queryset._hints = {**queryset._hints, ANALYTICS_HINT: True}
+    return queryset
+
+
+def analytics_generation():
+    """Token of the snapshot analytics reads currently see; '' on the primary.
+
+    For a SQLite replica this is the file's modification time, which
+    snapshot_replica bumps. Other backends replicate continuously and
+    return the alias itself.
+    """
+    alias = analytics_db()
+    if alias is None or pinned_to_primary():
+        return ''
+    settings_dict = connections[alias].settings_dict
+    if settings_dict['ENGINE'] == 'django.db.backends.sqlite3':
+        try:
+            return f':{alias}.{os.stat(settings_dict["NAME"]).st_mtime_ns}'
+        except (OSError, TypeError, ValueError):
+            pass
+    return f':{alias}'
+
+
+class AnalyticsRouter:
+    def db_for_read(self, model, **hints):
+        if hints.get(ANALYTICS_HINT):
+            return analytics_db()
+        return None
+
+    def db_for_write(self, model, **hints):
+        route = _route.get()
+        if route is not None:
+            route.pinned = route.wrote = True
+        # Even for objects that were read from the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, analytics_db()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary, schema included
+        if db == analytics_db():
+            return False
+        return None
+
+
+def _start(request):
+    return _Route(pinned=PIN_COOKIE in request.COOKIES)
+
+
+def _finish(route, response):
+    if route.wrote:
+        response.set_cookie(
+            PIN_COOKIE, '1', max_age=getattr(settings, 'FAIRPLAY_PRIMARY_PIN_SECONDS', 60), httponly=True,
+            samesite='Lax'
+        )
+    return response
+
+
+@sync_and_async_middleware
+def primary_pin_middleware(get_response):
+    """Track writes per request and pin the user's next requests to the primary"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            route = _start(request)
+            token = _route.set(route)
+            try:
+                response = await get_response(request)
+            finally:
+                _route.reset(token)
+            return _finish(route, response)
+    else:
+        def middleware(request):
+            route = _start(request)
+            token = _route.set(route)
+            try:
+                response = get_response(request)
+            finally:
+                _route.reset(token)
+            return _finish(route, response)
+    return middleware
@@ -0,0 +1,39 @@
+"""League standings per owner, cached until a result or team changes."""
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import Team, standings_changed
+from .routers import analytics_generation, for_analytics
+
+# Results normally invalidate the table long before this runs out
+STANDINGS_TIMEOUT = 60 * 60
+
+
+def _cache_key(owner_id):
+    return f'fair_play:standings:{owner_id}'
+
+
+def owner_standings(owner_id):
+    """The owner's league table, computed at most once between result changes.
+
+    The table is read from the analytics database when there is one, and
+    stored with the snapshot it came from, so a newer snapshot (or a read
+    from the primary) recomputes it.
+    """
+    key = _cache_key(owner_id)
+    generation = analytics_generation()
+    cached = cache.get(key)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    table = for_analytics(Team.objects.filter(owner_id=owner_id)).standings()
+    cache.set(key, (generation, table), STANDINGS_TIMEOUT)
+    return table
+
+
+@receiver(standings_changed)
+def invalidate_standings(sender, owner_ids, **kwargs):
+    keys = [_cache_key(owner_id) for owner_id in owner_ids]
+    cache.delete_many(keys)
+    # A reader may cache the old table before the change commits; drop it again after
+    transaction.on_commit(lambda: cache.delete_many(keys))
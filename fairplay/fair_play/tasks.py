@@ -0,0 +1,20 @@
+"""The slow roster operations, as background jobs (see fair_play.jobs)."""
+from .db import retry_on_locked
+from .jobs import task
+from .roster import regenerate_teams, reset_roster
+
+
+@task('generate_teams', 'Generating teams', next_url='teams_display')
+def generate_teams(job):
+    arguments = job.arguments
+    teams = regenerate_teams(
+        job.owner_id, arguments['team_names'], arguments['engine'], arguments.get('minimums'),
+        arguments.get('maximums'), arguments.get('learned', False)
+    )
+    return {'teams': len(teams), 'message': f'Created {len(teams)} teams!'}
+
+
+@task('reset_players', 'Removing all your players', next_url='index')
+def reset_players(job):
+    deleted = retry_on_locked(reset_roster)(job.owner_id)
+    return {'players': deleted, 'message': 'All your players have been removed. Starting fresh!'}
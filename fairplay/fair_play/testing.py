@@ -0,0 +1,21 @@
+"""The test runner: Django's, with N+1 queries failing the tests."""
+import os
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Fails any request or job that loads a relation lazily per object (see fair_play.nplusone).
+
+    FAIRPLAY_NPLUSONE=warn (or off) in the environment relaxes it.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.nplusone = override_settings(FAIRPLAY_NPLUSONE=os.environ.get('FAIRPLAY_NPLUSONE') or 'raise')
+        self.nplusone.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.nplusone.disable()
+        super().teardown_test_environment(**kwargs)
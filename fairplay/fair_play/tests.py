@@ -0,0 +1,1904 @@
+import csv
+import importlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, router, transaction
+from django.http import HttpResponse, QueryDict
+from django.template import Context, Template
+from django.test import Client, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+
+from fairplay import urls as project_urls
+
+from . import async_views, urls as app_urls
+from .access import Access
+from .balancing import BALANCERS, DEFAULT_BALANCER, get_balancer, rating_spread
+from .benchmarks import benchmark_cases, compare, url_names
+from .caching import roster_version
+from .db import retry_on_locked
+from .pagination import KeysetPaginator
+from .querylog import log_files, normalize, summarize
+from .ratings import np, replay_ratings
+from .forms import CustomUserCreationForm
+from .imports import JSON_CHUNK_SIZE, ImportFormatError, import_roster, read_rows
+from .jobs import MAX_ATTEMPTS, claim, enqueue, run_job, work
+from .metrics import REGISTRY, track
+from .nplusone import NPlusOneError, mode as nplusone_mode
+from .models import (
+    CAREER_FIELDS, CareerStatsQuerySet, Job, Match, MatchParticipation, Player, PlayerCareerStats, RatingHistory,
+    Team, TeamMembership, refresh_team_aggregates, roster_changed
+)
+from .roster import RosterSnapshot, draft_rosters, regenerate_teams, save_drafts
+from .routers import PIN_COOKIE, for_analytics
+from .standings import owner_standings
+
+
+def generate_teams(owner, names=('Red', 'Blue')):
+    snapshot = RosterSnapshot.for_owners([owner.pk])
+    save_drafts(snapshot, draft_rosters(snapshot, list(names)))
+    return [Team.objects.get(owner=owner, name=name) for name in names]
+
+
+def make_roster(owner, size):
+    """Create ``size`` players (including the owner) in the owner's roster"""
+    Player.objects.create(user=owner, owner=owner, position=Player.Position.ST, rating=70)
+    for i in range(size - 1):
+        user = User.objects.create(username=f'{owner.username}_p{i}')
+        Player.objects.create(
+            user=user,
+            owner=owner,
+            position=Player.Position.choices[i % 4][0],
+            rating=50 + (i * 7) % 51
+        )
+
+
+class GenerateTeamsQueryTests(TestCase):
+    def generate(self, roster_size):
+        owner = User.objects.create_user(username=f'owner{roster_size}', password='pass12345')
+        make_roster(owner, roster_size)
+        self.client.force_login(owner)
+        data = {'num_teams': 3, 'team_1_name': 'Red', 'team_2_name': 'Blue', 'team_3_name': 'Green'}
+
+        # Generate twice so the measured run also replaces existing teams
+        self.client.post(reverse('generate_teams'), data)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('generate_teams'), data)
+        self.assertRedirects(response, reverse('teams_display'), fetch_redirect_response=False)
+        return owner, len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_roster_size(self):
+        _, small = self.generate(6)
+        _, large = self.generate(60)
+        self.assertEqual(small, large)
+
+    def test_generated_teams_are_persisted(self):
+        owner, _ = self.generate(12)
+        teams = Team.objects.filter(owner=owner)
+        self.assertEqual(teams.count(), 3)
+        self.assertFalse(Player.objects.filter(owner=owner, team__isnull=True).exists())
+        for team in teams:
+            self.assertEqual(team.players.count(), 4)
+            self.assertEqual(team.members.count(), 4)
+            self.assertEqual(team.memberships.filter(left_at__isnull=True).count(), 4)
+        self.assertEqual(TeamMembership.objects.filter(player__owner=owner).count(), 12)
+
+    def test_repeated_team_names_are_counted_once(self):
+        owner = User.objects.create_user(username='repeats', password='pass12345')
+        make_roster(owner, 6)
+        self.client.force_login(owner)
+        data = {'num_teams': 3, 'team_1_name': 'Red', 'team_2_name': 'Blue', 'team_3_name': 'Red'}
+        response = self.client.post(reverse('generate_teams'), data)
+        self.assertEqual(Team.objects.filter(owner=owner).count(), 2)
+        self.assertIn('Created 2 teams!', [str(message) for message in get_messages(response.wsgi_request)])
+
+    def test_every_path_needs_two_different_team_names(self):
+        owner = User.objects.create_user(username='solo', password='pass12345')
+        make_roster(owner, 6)
+        self.client.force_login(owner)
+        data = {'num_teams': 2, 'team_1_name': 'Red', 'team_2_name': 'Red'}
+        response = self.client.post(reverse('generate_teams'), data)
+        self.assertRedirects(response, reverse('team_form'), fetch_redirect_response=False)
+        with self.assertRaises(ValueError):
+            regenerate_teams(owner.pk, ['Red'])
+        with self.assertRaises(CommandError):
+            call_command('draft_teams', 'solo', '--teams', '1', stdout=StringIO())
+        self.assertEqual(self.client.post(
+            reverse('api_teams'), {'team_names': ['Red']}, content_type='application/json'
+        ).status_code, 400)
+        self.assertFalse(Team.objects.filter(owner=owner).exists())
+
+
+class BalancingEngineTests(TestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        self.ratings = [rng.randint(50, 100) for _ in range(200)]
+
+    def test_engines_keep_team_sizes_even(self):
+        for name in BALANCERS:
+            for num_teams in (2, 3, 7, 10):
+                assignment = get_balancer(name).assign(self.ratings[:53], num_teams)
+                sizes = [assignment.count(team) for team in range(num_teams)]
+                self.assertLessEqual(max(sizes) - min(sizes), 1, name)
+
+    def test_refinement_beats_snake_draft(self):
+        snake = get_balancer('snake').assign(self.ratings, 10)
+        refined = get_balancer('local_search').assign(self.ratings, 10)
+        self.assertLessEqual(rating_spread(self.ratings, refined, 10), rating_spread(self.ratings, snake, 10))
+        self.assertLessEqual(rating_spread(self.ratings, refined, 10), 2)
+
+    def test_local_search_is_the_default(self):
+        self.assertEqual(DEFAULT_BALANCER, 'local_search')
+
+    def test_local_search_stops_at_its_deadline(self):
+        # Seeded from the snake draft, which leaves plenty of swaps to make
+        snake = get_balancer('snake').assign(self.ratings, 10)
+        ticks = iter([0.0])
+        expired = get_balancer('local_search', start='snake', clock=lambda: next(ticks, 1.0))
+        self.assertEqual(expired.assign(self.ratings, 10), snake)
+
+        # The deadline reading and three checks before the budget runs out: three swaps
+        readings = []
+
+        def clock():
+            readings.append(None)
+            return 0.0 if len(readings) <= 4 else 1.0
+        limited = get_balancer('local_search', start='snake', clock=clock).assign(self.ratings, 10)
+        self.assertEqual(len(readings), 5)
+        self.assertLessEqual(sum(a != b for a, b in zip(limited, snake)), 6)
+        self.assertEqual([limited.count(team) for team in range(10)], [20] * 10)
+        self.assertLess(rating_spread(self.ratings, limited, 10), rating_spread(self.ratings, snake, 10))
+
+    def test_position_quotas_are_enforced(self):
+        rng = random.Random(11)
+        positions = ['GoalKeeper'] * 4 + ['Defender'] * 14 + ['MidFielder'] * 12 + ['Striker'] * 10
+        ratings = [rng.randint(50, 100) for _ in positions]
+        quotas = {'GoalKeeper': (None, 1), 'Defender': (3, None)}
+        assignment = get_balancer('positions', quotas=quotas).assign(ratings, 4, positions)
+        for team in range(4):
+            team_positions = [p for p, t in zip(positions, assignment) if t == team]
+            self.assertEqual(len(team_positions), 10)
+            self.assertEqual(team_positions.count('GoalKeeper'), 1)
+            self.assertGreaterEqual(team_positions.count('Defender'), 3)
+        self.assertLessEqual(rating_spread(ratings, assignment, 4), 3)
+
+    def test_infeasible_position_quotas_raise(self):
+        balancer = get_balancer('positions', quotas={'GoalKeeper': (1, None)})
+        with self.assertRaises(ValueError):
+            balancer.assign([60, 70, 80, 90], 2, ['GoalKeeper', 'Striker', 'Striker', 'Defender'])
+
+    def test_unknown_engine_is_rejected(self):
+        owner = User.objects.create_user(username='picky', password='pass12345')
+        make_roster(owner, 4)
+        self.client.force_login(owner)
+        self.assertContains(self.client.get(reverse('team_form')), 'value="positions"')
+        response = self.client.post(reverse('generate_teams'), {'num_teams': 2, 'engine': 'coin_flip'})
+        self.assertRedirects(response, reverse('team_form'))
+        self.assertFalse(Team.objects.filter(owner=owner).exists())
+
+
+class BatchDraftTests(TestCase):
+    def setUp(self):
+        self.owners = []
+        for i in range(4):
+            owner = User.objects.create(username=f'league{i}')
+            make_roster(owner, 8 + i)
+            self.owners.append(owner)
+
+    def test_snapshot_groups_rows_by_owner(self):
+        with self.assertNumQueries(1):
+            snapshot = RosterSnapshot.for_owners([owner.pk for owner in self.owners[:2]])
+        self.assertEqual(len(snapshot), 17)
+        rows = snapshot.roster(self.owners[1].pk)
+        self.assertEqual(len(rows), 9)
+        ratings = [snapshot.ratings[row] for row in rows]
+        self.assertEqual(ratings, sorted(ratings, reverse=True))
+        self.assertEqual(len(snapshot.roster(self.owners[3].pk)), 0)
+
+    def test_save_drafts_query_count_is_independent_of_owner_count(self):
+        def run(owners):
+            snapshot = RosterSnapshot.for_owners([owner.pk for owner in owners])
+            drafts = draft_rosters(snapshot, ['Red', 'Blue'])
+            with CaptureQueriesContext(connection) as ctx:
+                save_drafts(snapshot, drafts)
+            return len(ctx.captured_queries)
+
+        run(self.owners)  # first run has no previous teams to replace
+        self.assertEqual(run(self.owners[:1]), run(self.owners))
+        self.assertEqual(Team.objects.count(), 8)
+        self.assertFalse(Player.objects.filter(team__isnull=True).exists())
+
+    def test_command_drafts_requested_owners(self):
+        call_command('draft_teams', 'league0', 'league2', '--teams', '3', stdout=StringIO())
+        self.assertEqual(Team.objects.filter(owner=self.owners[0]).count(), 3)
+        self.assertEqual(Team.objects.filter(owner=self.owners[2]).count(), 3)
+        self.assertFalse(Team.objects.filter(owner=self.owners[1]).exists())
+
+
+class TeamAggregateTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='coach')
+        make_roster(self.owner, 6)
+        snapshot = RosterSnapshot.for_owners([self.owner.pk])
+        save_drafts(snapshot, draft_rosters(snapshot, ['Red', 'Blue']))
+        self.red = Team.objects.get(owner=self.owner, name='Red')
+
+    def assertAggregatesCurrent(self):
+        for team in Team.objects.filter(owner=self.owner):
+            ratings = list(team.players.values_list('rating', flat=True))
+            self.assertEqual(team.player_count, len(ratings))
+            self.assertEqual(team.total_rating, sum(ratings))
+            self.assertAlmostEqual(team.avg_rating, sum(ratings) / len(ratings) if ratings else 0)
+
+    def test_generated_teams_have_aggregates(self):
+        self.assertEqual(self.red.player_count, 3)
+        self.assertAggregatesCurrent()
+
+    def test_instance_changes_update_aggregates(self):
+        player = self.red.players.first()
+        player.rating = 99
+        player.save()
+        self.assertAggregatesCurrent()
+        player.team = Team.objects.get(owner=self.owner, name='Blue')
+        player.save()
+        self.assertAggregatesCurrent()
+        player.delete()
+        self.assertAggregatesCurrent()
+
+    def test_players_created_on_a_team_update_aggregates(self):
+        user = User.objects.create(username='latecomer')
+        Player.objects.create(user=user, owner=self.owner, team=self.red, position=Player.Position.GK, rating=88)
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.player_count, 4)
+        self.assertAggregatesCurrent()
+
+    def test_bulk_changes_update_aggregates(self):
+        players = list(Player.objects.filter(owner=self.owner))
+        for player in players:
+            player.rating = 55
+        Player.objects.bulk_update(players, ['rating'])
+        self.assertAggregatesCurrent()
+        Player.objects.filter(team=self.red).update(team=None)
+        self.assertAggregatesCurrent()
+        Player.objects.filter(owner=self.owner).exclude(user=self.owner).delete()
+        self.assertAggregatesCurrent()
+
+    def test_rebuild_command(self):
+        Team.objects.update(player_count=0, total_rating=0, avg_rating=0)
+        call_command('rebuild_team_aggregates', stdout=StringIO())
+        self.assertAggregatesCurrent()
+
+
+class CareerStatsTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='boss', password='pass12345')
+        make_roster(self.owner, 8)
+        self.red, self.blue = generate_teams(self.owner)
+        self.client.force_login(self.owner)
+        self.client.post(reverse('match_create'), {'team_A': self.red.pk, 'team_B': self.blue.pk, 'location': 'Park'})
+        self.match = Match.objects.get()
+
+    def careers(self):
+        return {
+            career.user_id: tuple(getattr(career, field) for field in CAREER_FIELDS)
+            for career in PlayerCareerStats.objects.all()
+        }
+
+    def assertCareersMatchRebuild(self):
+        incremental = {user_id: line for user_id, line in self.careers().items() if any(line)}
+        PlayerCareerStats.objects.rebuild()
+        self.assertEqual(incremental, self.careers())
+
+    def record(self, score_a, score_b, status=Match.Status.PLAYED):
+        self.client.post(
+            reverse('match_record_result', args=[self.match.pk]),
+            {'score_a': score_a, 'score_b': score_b, 'status': status}
+        )
+
+    def test_result_updates_careers(self):
+        self.record(3, 1)
+        owner_career = PlayerCareerStats.objects.get(user=self.owner)
+        self.assertEqual(owner_career.matches, 1)
+        self.assertEqual(owner_career.wins + owner_career.losses, 1)
+        self.assertCareersMatchRebuild()
+        # Correcting a result moves the win to the other side
+        self.record(0, 2)
+        self.assertCareersMatchRebuild()
+        self.record(2, 2)
+        self.assertEqual(PlayerCareerStats.objects.filter(draws=1).count(), 8)
+        self.assertCareersMatchRebuild()
+
+    def test_participation_changes_update_careers(self):
+        self.record(1, 0)
+        participation = MatchParticipation.objects.filter(player__user=self.owner).get()
+        participation.goals = 2
+        participation.minutes_played = 90
+        participation.save()
+        self.assertEqual(PlayerCareerStats.objects.get(user=self.owner).goals, 2)
+        self.assertCareersMatchRebuild()
+        MatchParticipation.objects.exclude(pk=participation.pk).first().delete()
+        self.assertCareersMatchRebuild()
+
+    def test_deletes_update_careers(self):
+        self.record(1, 0)
+        Player.objects.exclude(user=self.owner).first().delete()
+        self.assertCareersMatchRebuild()
+        # Regenerating teams deletes the old teams along with their matches
+        generate_teams(self.owner)
+        self.assertEqual(PlayerCareerStats.objects.get(user=self.owner).matches, 0)
+        self.assertCareersMatchRebuild()
+
+    def test_history_page_reads_stored_career(self):
+        self.record(4, 0)
+        response = self.client.get(reverse('my_history'))
+        self.assertEqual(response.context['stats']['total_matches'], 1)
+        self.assertEqual(response.context['stats']['goals'], 0)
+
+
+class RatingTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='boss', password='pass12345')
+        make_roster(self.owner, 8)
+        self.red, self.blue = generate_teams(self.owner)
+        self.client.force_login(self.owner)
+        self.seeds = dict(Player.objects.values_list('pk', 'rating'))
+
+    def create_match(self, days_ago=0):
+        self.client.post(reverse('match_create'), {
+            'team_A': self.red.pk, 'team_B': self.blue.pk, 'location': 'Park',
+            'played_at': (timezone.now() - timedelta(days=days_ago)).strftime('%Y-%m-%d %H:%M')
+        })
+        return Match.objects.latest('pk')
+
+    def record(self, match, score_a, score_b, status=Match.Status.PLAYED):
+        self.client.post(
+            reverse('match_record_result', args=[match.pk]),
+            {'score_a': score_a, 'score_b': score_b, 'status': status}
+        )
+
+    def learned(self):
+        return dict(Player.objects.values_list('pk', 'learned_rating'))
+
+    def assertRatingsEqual(self, first, second):
+        self.assertEqual(first.keys(), second.keys())
+        for player_id, rating in first.items():
+            self.assertAlmostEqual(rating, second[player_id], places=9)
+
+    def test_result_moves_both_sides_and_corrections_rerate(self):
+        match = self.create_match()
+        self.record(match, 3, 1)
+        red = set(self.red.players.values_list('pk', flat=True))
+        changes = {
+            row.player_id: row.change for row in RatingHistory.objects.filter(match=match)
+        }
+        self.assertEqual(len(changes), 8)
+        self.assertTrue(all(changes[player_id] > 0 for player_id in red))
+        self.assertTrue(all(change < 0 for player_id, change in changes.items() if player_id not in red))
+        # Equal sides: what one side wins, the other loses
+        self.assertAlmostEqual(sum(changes.values()), 0, places=9)
+        for player_id, rating in self.learned().items():
+            self.assertAlmostEqual(rating, self.seeds[player_id] + changes[player_id], places=9)
+
+        # The corrected result counts instead of the first, not on top of it
+        self.record(match, 1, 3)
+        self.assertEqual(RatingHistory.objects.count(), 8)
+        for row in RatingHistory.objects.all():
+            self.assertEqual(row.rating_before, self.seeds[row.player_id])
+            self.assertEqual(row.change < 0, row.player_id in red)
+        self.record(match, '', '', Match.Status.CANCELLED)
+        self.assertFalse(RatingHistory.objects.exists())
+        self.assertRatingsEqual(self.learned(), self.seeds)
+
+    def test_replay_gives_the_recorded_ratings(self):
+        results = [(2, 0), (1, 1), (0, 4), (3, 2)]
+        matches = [self.create_match(days_ago=len(results) - i) for i in range(len(results))]
+        for match, (score_a, score_b) in zip(matches, results):
+            self.record(match, score_a, score_b)
+        recorded = self.learned()
+        history = list(RatingHistory.objects.order_by('pk').values_list(
+            'player_id', 'match_id', 'rating_before', 'rating_after'
+        ))
+        self.assertEqual(len(history), 32)
+
+        for vectorized in (False, True):
+            with self.subTest(vectorized=vectorized):
+                if vectorized and np is None:
+                    self.skipTest('NumPy is not installed')
+                self.assertEqual(replay_ratings(vectorized=vectorized), (4, 32, 8))
+                self.assertRatingsEqual(self.learned(), recorded)
+                replayed = RatingHistory.objects.order_by('pk').values_list(
+                    'player_id', 'match_id', 'rating_before', 'rating_after'
+                )
+                for row, expected in zip(replayed, history):
+                    self.assertEqual(row[:2], expected[:2])
+                    self.assertAlmostEqual(row[3] - row[2], expected[3] - expected[2], places=9)
+
+    def test_ratings_survive_team_regeneration(self):
+        self.record(self.create_match(), 2, 0)
+        learned = self.learned()
+        generate_teams(self.owner)
+        self.assertFalse(Match.objects.exists())
+        self.assertEqual(RatingHistory.objects.filter(match=None).count(), 8)
+        self.assertEqual(self.learned(), learned)
+        # A replay only has the remaining matches to go on
+        out = StringIO()
+        call_command('rebuild_ratings', 'boss', stdout=out)
+        self.assertIn('Replayed 0 matches', out.getvalue())
+        self.assertEqual(set(self.learned().values()), {None})
+
+    def test_balancing_on_learned_ratings(self):
+        Player.objects.filter(user=self.owner).update(learned_rating=99.5)
+        snapshot = RosterSnapshot.for_owners([self.owner.pk], learned=True)
+        self.assertEqual(snapshot.ratings[0], 99.5)
+        self.assertEqual(sorted(snapshot.ratings[1:]), sorted(
+            Player.objects.exclude(user=self.owner).values_list('rating', flat=True)
+        ))
+        self.client.post(reverse('generate_teams'), {
+            'num_teams': 2, 'team_1_name': 'Red', 'team_2_name': 'Blue', 'learned_ratings': '1'
+        })
+        self.assertEqual(Team.objects.filter(owner=self.owner).count(), 2)
+
+
+class StandingsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='league', password='pass12345')
+        make_roster(self.owner, 9)
+        self.red, self.blue, self.green = generate_teams(self.owner, ('Red', 'Blue', 'Green'))
+        self.client.force_login(self.owner)
+
+    def play(self, team_a, team_b, score_a, score_b):
+        match = Match.objects.create(team_A=team_a, team_B=team_b)
+        self.client.post(
+            reverse('match_record_result', args=[match.pk]),
+            {'score_a': score_a, 'score_b': score_b, 'status': Match.Status.PLAYED}
+        )
+        return match
+
+    def test_team_record_is_one_query(self):
+        self.play(self.red, self.blue, 3, 1)
+        self.play(self.green, self.red, 2, 2)
+        self.play(self.blue, self.red, 1, 0)
+        Match.objects.create(team_A=self.red, team_B=self.green)  # scheduled only
+        with self.assertNumQueries(1):
+            record = Match.objects.record(self.red)
+        self.assertEqual(record, {
+            'wins': 1, 'draws': 1, 'losses': 1, 'goals_for': 5, 'goals_against': 4, 'total_matches': 3
+        })
+        response = self.client.get(reverse('team_history', args=[self.red.pk]))
+        self.assertEqual(response.context['stats'], record)
+
+    def test_standings_table(self):
+        self.play(self.red, self.blue, 3, 1)
+        self.play(self.green, self.red, 0, 1)
+        with self.assertNumQueries(1):
+            table = Team.objects.filter(owner=self.owner).standings()
+        # Blue and Green are level on points; Green lost by less
+        self.assertEqual([line['name'] for line in table], ['Red', 'Green', 'Blue'])
+        self.assertEqual(table[0]['points'], 6)
+        self.assertEqual(table[0]['goal_difference'], 3)
+        self.assertEqual((table[2]['played'], table[2]['goal_difference']), (1, -2))
+
+    def test_standings_are_cached_until_a_result_is_recorded(self):
+        match = self.play(self.red, self.blue, 0, 1)
+        self.assertEqual(owner_standings(self.owner.pk)[0]['name'], 'Blue')
+        with self.assertNumQueries(0):
+            owner_standings(self.owner.pk)
+        Match.objects.create(team_A=self.red, team_B=self.green)
+        with self.assertNumQueries(0):
+            owner_standings(self.owner.pk)
+
+        self.client.post(
+            reverse('match_record_result', args=[match.pk]),
+            {'score_a': 2, 'score_b': 1, 'status': Match.Status.PLAYED}
+        )
+        self.assertEqual(owner_standings(self.owner.pk)[0]['name'], 'Red')
+        response = self.client.get(reverse('standings'))
+        self.assertContains(response, 'Red')
+
+    def test_regenerating_teams_invalidates_standings(self):
+        self.play(self.red, self.blue, 2, 0)
+        owner_standings(self.owner.pk)
+        generate_teams(self.owner, ('North', 'South'))
+        table = owner_standings(self.owner.pk)
+        self.assertEqual(sorted(line['name'] for line in table), ['North', 'South'])
+        self.assertFalse(any(line['played'] for line in table))
+
+
+class SeedAndBenchmarkTests(TestCase):
+    def setUp(self):
+        call_command(
+            'seed_data', '--users', '40', '--owners', '3', '--roster', '6', '--matches', '4',
+            stdout=StringIO()
+        )
+
+    def test_seed_data_builds_a_consistent_dataset(self):
+        self.assertEqual(User.objects.filter(username__startswith='seed_').count(), 40)
+        self.assertEqual(User.objects.filter(profile__isnull=False).count(), 40)
+        self.assertEqual(Player.objects.count(), 18)
+        self.assertEqual(Team.objects.count(), 6)
+        self.assertEqual(Match.objects.count(), 12)
+        self.assertEqual(MatchParticipation.objects.count(), 12 * 6)
+        self.assertEqual(TeamMembership.objects.count(), 18)
+        self.assertEqual(sum(Team.objects.values_list('player_count', flat=True)), 18)
+        stored = set(PlayerCareerStats.objects.values_list('user_id', 'matches', 'goals'))
+        PlayerCareerStats.objects.rebuild()
+        self.assertEqual(stored, set(PlayerCareerStats.objects.values_list('user_id', 'matches', 'goals')))
+
+        with self.assertRaises(CommandError):
+            call_command('seed_data', '--users', '5', '--owners', '1', '--roster', '4', stdout=StringIO())
+        call_command('seed_data', '--clear', '--users', '5', '--owners', '1', '--roster', '4', stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='seed_').count(), 5)
+
+    def test_every_url_has_a_benchmark_case(self):
+        owner = Match.objects.first().team_A.owner
+        covered = {case.url_name for case in benchmark_cases(owner)}
+        self.assertEqual(set(url_names()) - covered, set())
+
+    def test_benchmark_saves_and_compares_a_baseline(self):
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        options = ['--repeat', '2', '--warmup', '0', '--baseline', path, '--only', 'standings', 'match_list']
+        call_command('benchmark', *options, '--save-baseline', stdout=StringIO())
+        with open(path) as file:
+            baseline = json.load(file)
+        self.assertEqual(set(baseline['cases']), {'standings', 'match_list'})
+        self.assertEqual(baseline['dataset']['participations'], 72)
+
+        out = StringIO()
+        call_command('benchmark', *options, stdout=out, stderr=StringIO())
+        self.assertIn('match_list', out.getvalue())
+        # The data is rolled back after every request
+        self.assertEqual(MatchParticipation.objects.count(), 72)
+
+        baseline['cases']['standings']['queries'] = 0
+        regressions = compare({'standings': baseline['cases']['standings'] | {'queries': 2}}, baseline)
+        self.assertEqual(regressions, ['standings: 0 -> 2 queries'])
+
+
+def query_plan(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+@skipUnlessDBFeature('supports_explaining_query_execution')
+class QueryPlanTests(TestCase):
+    """Hot queries must be answered from indexes, never by scanning a whole table"""
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN output is SQLite specific')
+        self.owner = User.objects.create_user(username='planner', email='planner@example.com', password='pass12345')
+        make_roster(self.owner, 6)
+        self.red, self.blue = generate_teams(self.owner)
+        Match.objects.create(team_A=self.red, team_B=self.blue, status=Match.Status.PLAYED, score_a=1, score_b=0)
+        self.client.force_login(self.owner)
+
+    def plans(self, run):
+        """Query plans of every SELECT, UPDATE and DELETE that ``run`` executes"""
+        with CaptureQueriesContext(connection) as ctx:
+            run()
+        return {
+            query['sql']: query_plan(query['sql'])
+            for query in ctx.captured_queries
+            if query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE'))
+        }
+
+    def assertNoFullScans(self, plans):
+        self.assertTrue(plans)
+        for sql, plan in plans.items():
+            scans = [line for line in plan if re.fullmatch(r'SCAN \S+', line)]
+            self.assertEqual(scans, [], f'{sql}\n' + '\n'.join(plan))
+
+    def assertUsesIndex(self, plans, index):
+        self.assertTrue(any(index in line for plan in plans.values() for line in plan), index)
+
+    def test_generating_teams(self):
+        data = {'num_teams': 2, 'team_1_name': 'Red', 'team_2_name': 'Blue'}
+        plans = self.plans(lambda: self.client.post(reverse('generate_teams'), data))
+        self.assertNoFullScans(plans)
+        self.assertUsesIndex(plans, 'player_owner_user_idx')
+        self.assertUsesIndex(plans, 'membership_open_idx')
+
+    def test_match_list(self):
+        plans = self.plans(lambda: self.client.get(reverse('match_list')))
+        self.assertNoFullScans(plans)
+
+    def test_my_history(self):
+        self.assertNoFullScans(self.plans(lambda: self.client.get(reverse('my_history'))))
+
+    def test_username_autocomplete(self):
+        plans = self.plans(lambda: self.client.get(reverse('player_autocomplete'), {'q': 'Plan'}))
+        self.assertNoFullScans(plans)
+        self.assertUsesIndex(plans, 'fair_play_user_username_lower_idx')
+        # The index already yields the suggestions in order
+        self.assertFalse(any('TEMP B-TREE' in line for plan in plans.values() for line in plan))
+
+    def test_email_uniqueness_check(self):
+        form = CustomUserCreationForm({
+            'username': 'newcomer', 'email': 'planner@example.com',
+            'password1': 'a-long-pass-9', 'password2': 'a-long-pass-9', 'preferred_position': 'Striker'
+        })
+        plans = self.plans(form.is_valid)
+        self.assertIn('email', form.errors)
+        self.assertNoFullScans(plans)
+
+
+class RosterCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='cached', password='pass12345')
+        make_roster(self.owner, 6)
+        self.red, self.blue = generate_teams(self.owner)
+        self.other = User.objects.create(username='elsewhere')
+        self.client.force_login(self.owner)
+
+    def assertBumps(self, change, owner=None):
+        owner = owner or self.owner
+        before = roster_version(owner.pk), roster_version(self.other.pk)
+        change()
+        self.assertNotEqual(roster_version(owner.pk), before[0])
+        self.assertEqual(roster_version(self.other.pk), before[1])
+
+    def test_writes_bump_the_owner_version(self):
+        player = Player.objects.filter(owner=self.owner).exclude(user=self.owner).first()
+
+        def rate():
+            player.rating = 99
+            player.save()
+        self.assertBumps(rate)
+        self.assertBumps(lambda: Player.objects.filter(pk=player.pk).update(position=Player.Position.GK))
+        self.assertBumps(lambda: Match.objects.create(team_A=self.red, team_B=self.blue))
+        self.assertBumps(lambda: TeamMembership.objects.create(player=player, team=self.blue))
+        self.assertBumps(lambda: self.red.members.add(self.other))
+        self.assertBumps(lambda: self.other.team_set.clear())
+        self.assertBumps(lambda: Team.objects.create(name='Spare', owner=self.owner))
+        self.assertBumps(player.delete)
+
+    def test_bulk_writes_send_one_signal(self):
+        sent = []
+
+        def record(sender, owner_ids, **kwargs):
+            sent.append(owner_ids)
+        roster_changed.connect(record)
+        self.addCleanup(roster_changed.disconnect, record)
+        generate_teams(self.owner)
+        self.assertEqual(sent, [{self.owner.pk}])
+
+    def test_player_list_is_served_from_the_fragment(self):
+        with CaptureQueriesContext(connection) as cold:
+            self.client.get(reverse('playerslist'))
+        with CaptureQueriesContext(connection) as warm:
+            response = self.client.get(reverse('playerslist'))
+        self.assertContains(response, 'cached_p0')
+        self.assertLess(len(warm.captured_queries), len(cold.captured_queries))
+        self.assertFalse(any('fair_play_player' in query['sql'] for query in warm.captured_queries))
+
+        player = Player.objects.get(user__username='cached_p0')
+        self.client.post(reverse('playerupdate', args=[player.pk]), {'position': player.position, 'rating': 51})
+        self.assertContains(self.client.get(reverse('playerslist')), '⭐ 51')
+
+    def test_team_and_match_pages_follow_changes(self):
+        self.client.get(reverse('teams_display'))
+        self.client.get(reverse('match_list'))
+        generate_teams(self.owner, ('North', 'South'))
+        self.assertContains(self.client.get(reverse('teams_display')), 'North')
+        north, south = Team.objects.filter(owner=self.owner).order_by('name')
+        Match.objects.create(team_A=north, team_B=south, location='Fresh Ground')
+        self.assertContains(self.client.get(reverse('match_list')), 'Fresh Ground')
+
+        # A member sees the match too, and the owner's changes reach them
+        member = Player.objects.filter(owner=self.owner).exclude(user=self.owner).first().user
+        self.client.force_login(member)
+        self.assertContains(self.client.get(reverse('match_list')), 'Fresh Ground')
+        Match.objects.create(team_A=south, team_B=north, location='Second Ground')
+        self.assertContains(self.client.get(reverse('match_list')), 'Second Ground')
+
+    def test_team_record_is_cached_per_version(self):
+        url = reverse('team_history', args=[self.red.pk])
+        self.client.get(url)
+        match = Match.objects.create(team_A=self.red, team_B=self.blue)
+        response = self.client.get(url)
+        self.assertEqual(response.context['stats']['total_matches'], 0)
+        match.status, match.score_a, match.score_b = Match.Status.PLAYED, 2, 0
+        match.save()
+        self.assertEqual(self.client.get(url).context['stats']['wins'], 1)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='pager', password='pass12345')
+        make_roster(self.owner, 4)
+        self.red, self.blue = generate_teams(self.owner)
+        now = timezone.now()
+        # Ties and missing dates are where cursor pagination usually breaks
+        dates = [now - timedelta(days=day % 5) for day in range(17)] + [None] * 6
+        for played_at in dates:
+            Match.objects.create(team_A=self.red, team_B=self.blue, played_at=played_at)
+        self.paginator = KeysetPaginator(Match.objects.all(), ['-played_at', '-date_created'], 5)
+
+    def expected(self):
+        matches = list(Match.objects.all())
+        matches.sort(key=lambda match: -match.pk)
+        matches.sort(key=lambda match: match.date_created, reverse=True)
+        matches.sort(key=lambda match: (match.played_at is None, match.played_at and -match.played_at.timestamp()))
+        return [match.pk for match in matches]
+
+    def walk(self, query='', forward=True):
+        seen = []
+        while True:
+            page = self.paginator.page(QueryDict(query))
+            rows = [match.pk for match in page]
+            seen = seen + rows if forward else rows + seen
+            query = page.next_query if forward else page.previous_query
+            if not query:
+                return seen, page
+
+    def test_pages_cover_every_row_once_in_order(self):
+        forward, last = self.walk()
+        self.assertEqual(forward, self.expected())
+        backward, first = self.walk(last.previous_query, forward=False)
+        self.assertEqual(backward + [match.pk for match in last], self.expected())
+        self.assertFalse(first.has_previous)
+
+    def test_deep_pages_do_not_use_offset(self):
+        page = self.paginator.page(QueryDict())
+        for _ in range(3):
+            page = self.paginator.page(QueryDict(page.next_query))
+        with CaptureQueriesContext(connection) as ctx:
+            list(page)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('OFFSET', ctx.captured_queries[0]['sql'])
+
+    def test_invalid_cursor_gives_the_first_page(self):
+        first = [match.pk for match in self.paginator.page(QueryDict())]
+        for cursor in ('a.garbage', 'b.W10', 'a.!!', 'zzz'):
+            self.assertEqual([match.pk for match in self.paginator.page(QueryDict(f'page={cursor}'))], first)
+
+    def test_views_paginate(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('match_list'))
+        upcoming = response.context['upcoming_matches']
+        self.assertEqual(len(upcoming), 20)
+        second = self.client.get(f"{reverse('match_list')}?{upcoming.next_query}")
+        self.assertEqual(len(second.context['upcoming_matches']), 3)
+
+        for i in range(25):
+            match = Match.objects.create(team_A=self.red, team_B=self.blue)
+            MatchParticipation.objects.create(match=match, team=self.red, player=Player.objects.get(user=self.owner))
+        response = self.client.get(reverse('my_history'))
+        self.assertEqual(len(response.context['participations']), 20)
+        self.assertTrue(response.context['participations'].has_next)
+        # Headline stats cover the whole career, not just the page
+        self.assertEqual(response.context['stats']['total_matches'], 25)
+
+        response = self.client.get(reverse('playerslist'))
+        self.assertContains(response, 'Total Players: <strong class="text-white">4</strong>')
+
+
+class UsernameAutocompleteTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='coach', password='pass12345')
+        for username in ('Zara', 'zane', 'zack_keeper', 'zoe', 'yuri'):
+            User.objects.create_user(username=username, first_name=username.title(), password='pass12345')
+        keeper = User.objects.get(username='zack_keeper')
+        keeper.profile.preferred_position = Player.Position.GK
+        keeper.profile.save()
+        Player.objects.create(
+            user=User.objects.get(username='zoe'), owner=self.owner, position=Player.Position.DF, rating=70
+        )
+        self.client.force_login(self.owner)
+
+    def suggest(self, query):
+        response = self.client.get(reverse('player_autocomplete'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_prefix_matches_ignore_case_and_skip_the_roster(self):
+        results = self.suggest('ZA')
+        self.assertEqual([user['username'] for user in results], ['zack_keeper', 'zane', 'Zara'])
+        self.assertEqual(results[0]['preferred_position'], Player.Position.GK)
+        self.assertEqual(results[0]['name'], 'Zack_Keeper')
+        # zoe is already on the roster
+        self.assertEqual([user['username'] for user in self.suggest('zo')], [])
+        self.assertEqual(self.suggest('  '), [])
+
+    def test_results_are_capped_and_use_one_query(self):
+        User.objects.bulk_create([User(username=f'zed{i:02}') for i in range(15)])
+        with self.assertNumQueries(3):  # session, user, suggestions
+            results = self.suggest('ze')
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0], {'username': 'zed00', 'name': '', 'preferred_position': None})
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse('player_autocomplete'), {'q': 'za'})
+        self.assertEqual(response.status_code, 302)
+
+
+class RosterImportTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='club', password='pass12345')
+        self.keeper = User.objects.create_user(username='keeper', password='pass12345')
+        self.keeper.profile.preferred_position = Player.Position.GK
+        self.keeper.profile.save()
+        User.objects.create_user(username='winger', password='pass12345')
+        Player.objects.create(user=self.owner, owner=self.owner, position=Player.Position.ST, rating=80)
+        self.client.force_login(self.owner)
+
+    def test_csv_upload_imports_valid_rows_and_reports_the_rest(self):
+        upload = SimpleUploadedFile('club.csv', (
+            'Username,Position,Rating\n'
+            'keeper,,81\n'
+            'winger,md,\n'
+            'ghost,ST,70\n'
+            'club,ST,70\n'
+            'keeper,DF,60\n'
+            'winger,Libero,120\n'
+        ).encode())
+        version = roster_version(self.owner.pk)
+        response = self.client.post(reverse('playerimport'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+
+        players = {p.user.username: (p.position, p.rating) for p in Player.objects.filter(owner=self.owner)}
+        self.assertEqual(players['keeper'], (Player.Position.GK, 81))
+        self.assertEqual(players['winger'], (Player.Position.MD, 70))
+        errors = [(error.row, error.username) for error in response.context['result'].errors]
+        self.assertEqual(errors, [(3, 'ghost'), (4, 'club'), (5, 'keeper'), (6, 'winger')])
+        self.assertIn('rating', response.context['result'].errors[-1].message)
+        self.assertIn('position_override', response.context['result'].errors[-1].message)
+        self.assertNotEqual(roster_version(self.owner.pk), version)
+
+    def test_clean_upload_redirects_to_the_roster(self):
+        upload = SimpleUploadedFile('club.ndjson', b'{"username": "keeper"}\n{"username": "winger", "rating": 66}\n')
+        response = self.client.post(reverse('playerimport'), {'file': upload})
+        self.assertRedirects(response, reverse('playerslist'))
+        self.assertEqual(Player.objects.filter(owner=self.owner).count(), 3)
+
+        response = self.client.post(reverse('playerimport'), {'file': SimpleUploadedFile('club.txt', b'username')})
+        self.assertIn('format', response.context['form'].errors)
+
+    def test_queries_grow_per_chunk_not_per_row(self):
+        User.objects.bulk_create([User(username=f'recruit{i:03}') for i in range(250)])
+        rows = [{'username': f'recruit{i:03}', 'rating': 50 + i % 51} for i in range(250)]
+        with CaptureQueriesContext(connection) as ctx:
+            result = import_roster(self.owner, iter(rows), batch_size=100)
+        self.assertEqual((result.created, result.errors), (250, []))
+        statements = [q['sql'] for q in ctx.captured_queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        # Per chunk: the users, the ones already on the roster and the insert
+        self.assertEqual(len(statements), 3 * 3)
+        # Rows of users without a profile fall back to the model default
+        self.assertEqual(Player.objects.get(user__username='recruit007').position, Player.Position.ST)
+
+    def test_command_streams_a_json_array_and_keeps_rows_before_a_broken_one(self):
+        path = os.path.join(tempfile.mkdtemp(), 'club.json')
+        with open(path, 'w') as file:
+            file.write('[{"username": "keeper", "rating": 90},\n {"username": "winger"}, {"username": ')
+        err = StringIO()
+        call_command('import_roster', 'club', path, '--batch-size', '1', stdout=StringIO(), stderr=err)
+        self.assertEqual(Player.objects.filter(owner=self.owner).count(), 3)
+        self.assertIn('Row 3 (-): Invalid JSON', err.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('import_roster', 'nobody', path, stdout=StringIO())
+
+    def test_read_rows_decodes_json_objects_across_chunk_boundaries(self):
+        data = json.dumps([{'username': f'user{i}', 'position': 'GK'} for i in range(2000)]).encode()
+        self.assertEqual(len(list(read_rows(io.BytesIO(data), 'json'))), 2000)
+
+    def test_read_rows_stops_at_a_malformed_json_object(self):
+        lines = [json.dumps({'username': f'user{i}'}) for i in range(20000)]
+        lines[2] = '{"username": "user2" "rating": 70}'
+        file = io.StringIO('\n'.join(lines))
+        rows = read_rows(file, 'json')
+        self.assertEqual([row['username'] for row in (next(rows), next(rows))], ['user0', 'user1'])
+        with self.assertRaisesMessage(ImportFormatError, "Invalid JSON on line 3: Expecting ',' delimiter."):
+            next(rows)
+        # Only the first chunk was read
+        self.assertEqual(file.tell(), JSON_CHUNK_SIZE)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='organizer', password='pass12345')
+        make_roster(self.owner, 6)
+        self.red, self.blue = generate_teams(self.owner)
+        self.played = Match.objects.create(
+            team_A=self.red, team_B=self.blue, status=Match.Status.PLAYED, score_a=2, score_b=1,
+            played_at=timezone.now() - timedelta(days=1), location='North Pitch'
+        )
+        Match.objects.create(team_A=self.blue, team_B=self.red, played_at=timezone.now())
+        for team in (self.red, self.blue):
+            for player in team.players.all():
+                MatchParticipation.objects.create(
+                    match=self.played, team=team, player=player, minutes_played=90,
+                    goals=1 if (team, player.user) == (self.red, self.owner) else 0
+                )
+        self.client.force_login(self.owner)
+
+    def download(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_cells_are_never_formulas(self):
+        Team.objects.filter(pk=self.red.pk).update(name='=HYPERLINK("http://evil.example")')
+        Match.objects.filter(pk=self.played.pk).update(location='@SUM(A1)')
+        csv_rows = list(csv.reader(io.StringIO(self.download(reverse('match_export', args=['csv'])))))
+        header, row = csv_rows[0], csv_rows[1]
+        self.assertEqual(row[header.index('location')], "'@SUM(A1)")
+        self.assertIn("'=HYPERLINK(\"http://evil.example\")", row)
+        # NDJSON is not opened by spreadsheets and keeps the text as it is
+        line = json.loads(self.download(reverse('match_export', args=['ndjson'])).splitlines()[0])
+        self.assertEqual(line['location'], '@SUM(A1)')
+
+    def test_match_export_csv(self):
+        lines = self.download(reverse('match_export', args=['csv'])).splitlines()
+        self.assertEqual(lines[0].split(','), [
+            'match_id', 'played_at', 'status', 'location', 'team', 'opponent', 'goals_for', 'goals_against',
+            'result', 'username', 'position', 'minutes_played', 'goals', 'assists', 'match_rating'
+        ])
+        self.assertEqual(len(lines), 1 + 6)
+        red_lines = [line for line in map(lambda line: line.split(','), lines[1:]) if line[4] == 'Red']
+        self.assertEqual({tuple(line[4:9]) for line in red_lines}, {('Red', 'Blue', '2', '1', 'W')})
+        self.assertIn('organizer', [line[9] for line in red_lines])
+
+    def test_history_export_ndjson(self):
+        body = self.download(reverse('my_history_export', args=['ndjson']))
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['goals'], 1)
+        self.assertEqual(rows[0]['location'], 'North Pitch')
+        self.assertEqual(rows[0]['played_at'], self.played.played_at.isoformat())
+
+    def test_team_exports(self):
+        roster = self.download(reverse('team_roster_export', args=[self.red.pk, 'csv'])).splitlines()
+        self.assertEqual(len(roster), 1 + self.red.players.count())
+        self.assertTrue(all(line.endswith(',True') for line in roster[1:]))
+        matches = self.download(reverse('team_matches_export', args=[self.blue.pk, 'csv'])).splitlines()
+        # Newest first; the scheduled match has no result yet
+        self.assertEqual([line.split(',')[8] for line in matches[1:]], ['', 'L'])
+
+    @mock.patch('fair_play.exports.EXPORT_ASYNC_BATCH', 2)
+    def test_exports_stream_asynchronously_under_asgi(self):
+        url = reverse('match_export', args=['csv'])
+        expected = self.download(url)
+
+        async def download():
+            response = await self.async_client.get(url)
+            self.assertTrue(response.is_async)
+            return [chunk async for chunk in response.streaming_content]
+
+        self.async_client.force_login(self.owner)
+        with override_settings(FAIRPLAY_ASYNC_VIEWS=True):
+            chunks = async_to_sync(download)()
+        # A header and six rows, sent two lines at a time
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(b''.join(chunks).decode(), expected)
+
+    def test_queries_do_not_grow_with_rows(self):
+        url = reverse('match_export', args=['ndjson'])
+        with CaptureQueriesContext(connection) as ctx:
+            self.download(url)
+        before = len(ctx.captured_queries)
+        for i in range(5):
+            match = Match.objects.create(
+                team_A=self.red, team_B=self.blue, status=Match.Status.PLAYED, score_a=i, score_b=0
+            )
+            MatchParticipation.objects.bulk_create([
+                MatchParticipation(match=match, team=self.red, player=player) for player in self.red.players.all()
+            ])
+        with CaptureQueriesContext(connection) as ctx:
+            self.download(url)
+        self.assertEqual(len(ctx.captured_queries), before)
+
+    def test_access_and_formats(self):
+        self.assertEqual(self.client.get(reverse('match_export', args=['xlsx'])).status_code, 404)
+        self.client.force_login(User.objects.create_user(username='stranger', password='pass12345'))
+        response = self.client.get(reverse('team_roster_export', args=[self.red.pk, 'csv']))
+        self.assertRedirects(response, reverse('teams_display'))
+        self.assertEqual(self.download(reverse('match_export', args=['csv'])).count('\n'), 1)
+
+
+class StatSheetTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='statkeeper', password='pass12345')
+        make_roster(self.owner, 8)
+        self.red, self.blue = generate_teams(self.owner)
+        self.client.force_login(self.owner)
+
+    def create_match(self):
+        data = {'team_A': self.red.pk, 'team_B': self.blue.pk, 'location': 'Home'}
+        response = self.client.post(reverse('match_create'), data)
+        self.assertRedirects(response, reverse('match_list'), fetch_redirect_response=False)
+        return Match.objects.latest('pk')
+
+    def sheet(self, match, **overrides):
+        """POST data for the stat sheet: 90 minutes and rating 6 for everyone"""
+        data = {}
+        participations = list(match.participations.order_by('pk'))
+        for i, participation in enumerate(participations):
+            data.update({
+                f'form-{i}-id': participation.pk, f'form-{i}-minutes_played': 90,
+                f'form-{i}-goals': 0, f'form-{i}-assists': 0, f'form-{i}-match_rating': 6,
+            })
+        data.update({'form-TOTAL_FORMS': len(participations), 'form-INITIAL_FORMS': len(participations)})
+        data.update(overrides)
+        return data
+
+    def careers(self):
+        return set(PlayerCareerStats.objects.values_list('user_id', *CAREER_FIELDS))
+
+    def test_match_creation_inserts_participations_in_one_statement(self):
+        with CaptureQueriesContext(connection) as ctx:
+            match = self.create_match()
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "fair_play_matchparticipation"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(match.participations.count(), 8)
+        self.assertEqual(set(match.participations.values_list('team_id', flat=True)), {self.red.pk, self.blue.pk})
+        stored = self.careers()
+        PlayerCareerStats.objects.rebuild()
+        self.assertEqual(stored, self.careers())
+        self.assertEqual({line[1] for line in stored}, {1})
+
+    def test_stat_sheet_saves_every_row_with_one_update(self):
+        match = self.create_match()
+        self.client.post(reverse('match_record_result', args=[match.pk]), {
+            'score_a': 2, 'score_b': 1, 'status': Match.Status.PLAYED
+        })
+        red_ids = list(match.participations.filter(team=self.red).order_by('pk').values_list('pk', flat=True))
+        data = self.sheet(match)
+        index = {int(data[key]): key.split('-')[1] for key in data if key.endswith('-id')}
+        data[f'form-{index[red_ids[0]]}-goals'] = 2
+        data[f'form-{index[red_ids[1]]}-assists'] = 1
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('match_stats', args=[match.pk]), data)
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "fair_play_matchparticipation"')]
+        self.assertEqual(len(updates), 1)
+        # The rows are loaded once, not once per form
+        selects = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT "fair_play_matchparticipation"')]
+        self.assertEqual(len(selects), 1)
+        self.assertRedirects(response, reverse('match_detail', args=[match.pk]))
+        self.assertEqual(MatchParticipation.objects.get(pk=red_ids[0]).goals, 2)
+        self.assertEqual(set(match.participations.values_list('minutes_played', 'match_rating')), {(90, 6)})
+
+        stored = self.careers()
+        PlayerCareerStats.objects.rebuild()
+        self.assertEqual(stored, self.careers())
+        self.assertEqual(sum(line[5] for line in stored), 2)
+
+    def test_invalid_sheets_save_nothing(self):
+        match = self.create_match()
+        self.client.post(reverse('match_record_result', args=[match.pk]), {
+            'score_a': 1, 'score_b': 0, 'status': Match.Status.PLAYED
+        })
+        for overrides in ({'form-0-goals': 3}, {'form-0-match_rating': 11}, {'form-1-minutes_played': -5}):
+            response = self.client.post(reverse('match_stats', args=[match.pk]), self.sheet(match, **overrides))
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.context['formset'].is_valid())
+        self.assertEqual(set(match.participations.values_list('minutes_played', flat=True)), {None})
+
+    def test_only_owners_can_edit(self):
+        match = self.create_match()
+        self.client.force_login(User.objects.create_user(username='visitor', password='pass12345'))
+        response = self.client.post(reverse('match_stats', args=[match.pk]), self.sheet(match))
+        self.assertRedirects(response, reverse('match_detail', args=[match.pk]), fetch_redirect_response=False)
+        self.assertEqual(set(match.participations.values_list('minutes_played', flat=True)), {None})
+
+
+class AccessTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='boss', password='pass12345')
+        make_roster(self.owner, 6)
+        self.red, self.blue = generate_teams(self.owner)
+        self.member = self.red.members.exclude(pk=self.owner.pk).first()
+        self.stranger = User.objects.create_user(username='stranger', password='pass12345')
+        self.match = Match.objects.create(team_A=self.red, team_B=self.blue)
+        self.other_match = Match.objects.create(
+            team_A=Team.objects.create(name='Gold', owner=self.stranger),
+            team_B=Team.objects.create(name='Silver', owner=self.stranger)
+        )
+
+    def test_rules(self):
+        owner, member, stranger = Access(self.owner), Access(self.member), Access(self.stranger)
+        self.assertTrue(owner.can_edit_team(self.red) and owner.can_edit_match(self.match))
+        self.assertTrue(member.can_view_team(self.red) and member.can_view_match(self.match))
+        self.assertFalse(member.can_view_team(self.blue))
+        self.assertFalse(member.can_edit_team(self.red) or member.can_edit_match(self.match))
+        self.assertFalse(stranger.can_view_team(self.red) or stranger.can_view_match(self.match))
+        self.assertTrue(stranger.can_edit_match(self.other_match))
+
+        self.assertEqual(set(owner.teams()), {self.red, self.blue})
+        self.assertEqual(set(member.teams()), set(self.member.team_set.all()))
+        self.assertEqual(list(member.matches()), [self.match])
+        self.assertEqual(list(Match.objects.viewable_by(self.member)), [self.match])
+        self.assertEqual(list(Match.objects.editable_by(self.stranger)), [self.other_match])
+        self.assertFalse(stranger.players().exists())
+        self.assertEqual(owner.players().count(), 6)
+
+    def test_single_checks_cost_at_most_one_query(self):
+        match = Match.objects.get(pk=self.match.pk)
+        for user in (self.owner, self.member, self.stranger):
+            with self.assertNumQueries(1):
+                Access(user).can_view_match(match)
+            with self.assertNumQueries(1):
+                Access(user).can_edit_match(match)
+
+        match = Match.objects.select_related('team_A', 'team_B').get(pk=self.match.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(Access(self.owner).can_view_match(match))
+            self.assertTrue(Access(self.owner).can_edit_match(match))
+            self.assertFalse(Access(self.member).can_edit_match(match))
+        with self.assertNumQueries(1):
+            self.assertTrue(Access(self.member).can_view_match(match))
+
+    def test_team_set_is_loaded_once_per_request(self):
+        access = Access(self.member)
+        with self.assertNumQueries(1):
+            access.team_owners
+        with self.assertNumQueries(0):
+            self.assertTrue(access.can_view_match(self.match))
+            self.assertFalse(access.can_edit_match(self.match))
+            self.assertFalse(access.can_view_team(self.other_match.team_A))
+
+    def test_views_use_the_service(self):
+        self.client.force_login(self.member)
+        self.assertEqual(self.client.get(reverse('match_detail', args=[self.match.pk])).status_code, 200)
+        self.assertRedirects(
+            self.client.get(reverse('match_detail', args=[self.other_match.pk])), reverse('match_list')
+        )
+        response = self.client.get(reverse('match_record_result', args=[self.match.pk]))
+        self.assertRedirects(response, reverse('match_detail', args=[self.match.pk]))
+        self.assertEqual(self.client.get(reverse('team_history', args=[self.red.pk])).status_code, 200)
+        self.assertRedirects(
+            self.client.get(reverse('team_history', args=[self.other_match.team_A_id])), reverse('teams_display')
+        )
+        player = Player.objects.filter(owner=self.owner).first()
+        self.assertEqual(self.client.get(reverse('playerupdate', args=[player.pk])).status_code, 404)
+        with mock.patch.object(Access, 'member_teams', autospec=True, side_effect=Access.member_teams) as member_teams:
+            response = self.client.get(reverse('teams_display'))
+        member_teams.assert_called_once()
+        self.assertEqual(set(response.context['member_teams']), {self.red})
+
+
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='boss', password='pass12345')
+        make_roster(self.owner, 6)
+        self.red, self.blue = generate_teams(self.owner)
+        self.member = self.red.members.exclude(pk=self.owner.pk).first()
+        self.match = Match.objects.create(team_A=self.red, team_B=self.blue, location='Home')
+        MatchParticipation.objects.create_for_match(self.match)
+        stranger = User.objects.create_user(username='stranger', password='pass12345')
+        self.other_match = Match.objects.create(
+            team_A=Team.objects.create(name='Gold', owner=stranger),
+            team_B=Team.objects.create(name='Silver', owner=stranger)
+        )
+        # Route the read views to async_views, as asgi.py does
+        self.addCleanup(self.reload_urls)
+        override = override_settings(FAIRPLAY_ASYNC_VIEWS=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.reload_urls()
+
+    def reload_urls(self):
+        importlib.reload(app_urls)
+        importlib.reload(project_urls)
+        clear_url_caches()
+
+    def async_get(self, url):
+        """GET through the ASGI handler, from a sync test"""
+        async def get():
+            return await self.async_client.get(url)
+        return async_to_sync(get)()
+
+    def test_read_urls_route_to_the_async_views(self):
+        self.assertIs(resolve(reverse('teams_display')).func, async_views.teams_display_view)
+        self.assertIs(resolve(reverse('match_list')).func, async_views.match_list_view)
+        self.assertIs(resolve(reverse('match_detail', args=[self.match.pk])).func, async_views.match_detail_view)
+
+    def test_pages_match_the_sync_views(self):
+        urls = [reverse('teams_display'), reverse('match_list'), reverse('match_detail', args=[self.match.pk])]
+        for user in (self.owner, self.member):
+            self.client.force_login(user)
+            self.async_client.force_login(user)
+            for url in urls:
+                sync_response = self.client.get(url)
+                async_response = self.async_get(url)
+                self.assertEqual(async_response.status_code, 200)
+                self.assertEqual(async_response.content, sync_response.content, url)
+
+    @override_settings(FAIRPLAY_SERVER_TIMING=True)
+    def test_match_detail_reads_participations_in_one_query(self):
+        self.async_client.force_login(self.owner)
+        url = reverse('match_detail', args=[self.match.pk])
+        # Session, user, match with both teams, participations with players
+        with self.assertNumQueries(4):
+            response = self.async_get(url)
+        self.assertContains(response, self.member.username)
+        # Counted although the async ORM runs them on a worker thread
+        self.assertIn('desc="4 queries"', response['Server-Timing'])
+
+    async def test_access_checks(self):
+        await sync_to_async(self.async_client.force_login)(self.member)
+        response = await self.async_client.get(reverse('match_detail', args=[self.other_match.pk]))
+        self.assertRedirects(response, reverse('match_list'), fetch_redirect_response=False)
+        response = await self.async_client.get(reverse('match_detail', args=[self.other_match.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+
+        access = Access(self.member)
+        self.assertTrue(await access.acan_view_match(self.match))
+        self.assertFalse(await access.acan_edit_match(self.match))
+        self.assertFalse(await access.acan_view_team(self.other_match.team_A))
+        self.assertEqual(await access.ateam_owners(), {self.red.pk: self.owner.pk})
+
+    async def test_anonymous_users_are_sent_to_login(self):
+        url = reverse('match_list')
+        response = await self.async_client.get(url)
+        self.assertRedirects(response, f"{reverse('login')}?next={url}", fetch_redirect_response=False)
+
+
+class SQLiteTuningTests(TransactionTestCase):
+    """Outside TestCase's transaction, so retry_on_locked owns the outermost one"""
+
+    def test_new_connections_get_the_pragmas(self):
+        with connection.cursor() as cursor:
+            for name, expected in (('synchronous', 1), ('busy_timeout', 5000), ('cache_size', -64000)):
+                cursor.execute(f'PRAGMA {name}')
+                self.assertEqual(cursor.fetchone()[0], expected, name)
+
+    @mock.patch('fair_play.db.time.sleep')
+    def test_locked_writes_are_retried_with_backoff(self, sleep):
+        calls = []
+
+        @retry_on_locked
+        def write():
+            calls.append(connection.in_atomic_block)
+            User.objects.create(username=f'writer{len(calls)}')
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        self.assertEqual(write(), 'done')
+        self.assertEqual(calls, [True, True, True])
+        self.assertEqual(sleep.call_count, 2)
+        # The failed attempts were rolled back
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['writer3'])
+
+    @mock.patch('fair_play.db.time.sleep')
+    def test_gives_up_and_ignores_other_errors(self, sleep):
+        locked = mock.Mock(side_effect=OperationalError('database is locked'))
+        with self.assertRaises(OperationalError):
+            retry_on_locked(locked, attempts=3)()
+        self.assertEqual(locked.call_count, 3)
+
+        broken = mock.Mock(side_effect=OperationalError('no such table: nowhere'))
+        with self.assertRaises(OperationalError):
+            retry_on_locked(broken)()
+        self.assertEqual(broken.call_count, 1)
+
+        # An enclosing transaction can only be retried as a whole
+        with self.assertRaises(OperationalError), transaction.atomic():
+            retry_on_locked(locked)()
+        self.assertEqual(locked.call_count, 4)
+
+    @mock.patch('fair_play.db.time.sleep')
+    def test_retried_saves_still_run_the_hooks(self, sleep):
+        owner = User.objects.create_user(username='boss', password='pass12345')
+        make_roster(owner, 6)
+        red, blue = generate_teams(owner)
+        match = Match.objects.create(team_A=red, team_B=blue)
+        MatchParticipation.objects.bulk_create([
+            MatchParticipation(match=match, team=team, player=player)
+            for team in (red, blue) for player in team.players.all()
+        ])
+        self.client.force_login(owner)
+
+        def locked_once(original):
+            calls = []
+
+            def attempt(*args, **kwargs):
+                calls.append(args)
+                if len(calls) == 1:
+                    raise OperationalError('database is locked')
+                return original(*args, **kwargs)
+            return attempt
+
+        apply_deltas = CareerStatsQuerySet.apply_deltas
+        with mock.patch.object(CareerStatsQuerySet, 'apply_deltas', autospec=True,
+                               side_effect=locked_once(apply_deltas)):
+            self.client.post(
+                reverse('match_record_result', args=[match.pk]),
+                {'score_a': 2, 'score_b': 1, 'status': Match.Status.PLAYED}
+            )
+        self.assertEqual(sleep.call_count, 1)
+        careers = set(PlayerCareerStats.objects.values_list('user_id', 'wins', 'losses'))
+        PlayerCareerStats.objects.rebuild()
+        self.assertEqual(careers, set(PlayerCareerStats.objects.values_list('user_id', 'wins', 'losses')))
+        self.assertEqual(PlayerCareerStats.objects.filter(wins=1).count(), red.players.count())
+
+        player = red.players.order_by('rating').first()
+        with mock.patch('fair_play.models.refresh_team_aggregates',
+                        side_effect=locked_once(refresh_team_aggregates)):
+            self.client.post(
+                reverse('playerupdate', args=[player.pk]), {'position': player.position, 'rating': 100}
+            )
+        self.assertEqual(sleep.call_count, 2)
+        red.refresh_from_db()
+        self.assertEqual(red.total_rating, sum(red.players.values_list('rating', flat=True)))
+
+
+@override_settings(FAIRPLAY_ANALYTICS_DB='replica')
+class AnalyticsRoutingTests(TransactionTestCase):
+    """Two SQLite databases: the test database and a replica file refreshed by snapshot_replica"""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        replica = connections['replica']
+        original = replica.settings_dict['NAME']
+
+        def restore():
+            replica.close()
+            replica.settings_dict['NAME'] = original
+        self.addCleanup(restore)
+        replica.close()
+        if replica.connection is not None:
+            # close() keeps in-memory databases open, and the system checks
+            # (JSONField support) may have connected the test mirror already
+            replica.connection.close()
+            replica.connection = None
+        replica.settings_dict['NAME'] = os.path.join(directory.name, 'replica.sqlite3')
+
+        self.owner = User.objects.create_user(username='boss', password='pass12345')
+        make_roster(self.owner, 6)
+        self.red, self.blue = generate_teams(self.owner)
+        self.match = Match.objects.create(team_A=self.red, team_B=self.blue)
+        self.snapshot()
+        self.client.force_login(self.owner)
+
+    def snapshot(self):
+        call_command('snapshot_replica', stdout=StringIO())
+
+    def played(self, client=None):
+        response = (client or self.client).get(reverse('standings'))
+        return {row['name']: row['played'] for row in response.context['standings']}
+
+    def record_result(self):
+        self.match.score_a, self.match.score_b, self.match.status = 2, 1, Match.Status.PLAYED
+        self.match.save()
+
+    def test_routing_rules(self):
+        self.assertEqual(for_analytics(Match.objects.all()).db, 'replica')
+        self.assertEqual(for_analytics(Match.objects.filter(team_A=self.red)).values_list('pk').db, 'replica')
+        self.assertEqual(Match.objects.all().db, 'default')
+        self.assertEqual(router.db_for_write(Match, instance=for_analytics(Match.objects.all()).get()), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'fair_play'))
+        with override_settings(FAIRPLAY_ANALYTICS_DB=None):
+            self.assertEqual(for_analytics(Match.objects.all()).db, 'default')
+        with self.assertRaises(CommandError):
+            call_command('snapshot_replica', database='default', stdout=StringIO())
+
+    def test_analytics_read_the_replica_until_the_next_snapshot(self):
+        self.record_result()
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            self.assertEqual(self.played(), {'Red': 0, 'Blue': 0})
+            response = self.client.get(reverse('my_history_export', args=['csv']))
+            b''.join(response.streaming_content)
+        self.assertGreaterEqual(len(replica_queries), 2)
+
+        self.snapshot()
+        self.assertEqual(self.played(), {'Red': 1, 'Blue': 1})
+
+    def test_writers_read_their_own_writes(self):
+        response = self.client.post(
+            reverse('match_record_result', args=[self.match.pk]),
+            {'score_a': 2, 'score_b': 1, 'status': Match.Status.PLAYED}
+        )
+        self.assertIn(PIN_COOKIE, response.cookies)
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            self.assertEqual(self.played(), {'Red': 1, 'Blue': 1})
+        self.assertEqual(len(replica_queries), 0)
+
+        # Someone who has not written still reads the snapshot
+        other = Client()
+        other.force_login(self.owner)
+        self.assertEqual(self.played(other), {'Red': 0, 'Blue': 0})
+
+
+@override_settings(FAIRPLAY_BACKGROUND_JOBS=True)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='coach', password='pass12345')
+        make_roster(self.owner, 8)
+        self.client.force_login(self.owner)
+
+    def work(self):
+        return work('test-worker', threading.Event(), burst=True)
+
+    def generate(self, **extra):
+        data = {'num_teams': 2, 'team_1_name': 'Red', 'team_2_name': 'Blue', **extra}
+        return self.client.post(reverse('generate_teams'), data)
+
+    def test_generate_teams_is_queued_and_run_by_a_worker(self):
+        response = self.generate()
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job_detail', args=[job.pk]), fetch_redirect_response=False)
+        self.assertEqual(job.status, Job.Status.QUEUED)
+        self.assertFalse(Team.objects.filter(owner=self.owner).exists())
+        self.assertContains(self.client.get(reverse('job_detail', args=[job.pk])), 'Waiting for a worker')
+
+        self.assertEqual(self.work(), 1)
+        status = self.client.get(reverse('job_status', args=[job.pk])).json()
+        self.assertEqual(status['status'], Job.Status.SUCCEEDED)
+        self.assertEqual(status['result']['teams'], 2)
+        self.assertEqual(status['next_url'], reverse('teams_display'))
+        self.assertEqual(Team.objects.filter(owner=self.owner).count(), 2)
+        self.assertFalse(Player.objects.filter(owner=self.owner, team__isnull=True).exists())
+        self.assertRedirects(
+            self.client.get(reverse('job_detail', args=[job.pk]), {'follow': 1}), reverse('teams_display'),
+            fetch_redirect_response=False
+        )
+
+    def test_idempotency_key_queues_the_work_once(self):
+        self.generate(idempotency_key='form-1')
+        self.generate(idempotency_key='form-1')
+        self.client.post(reverse('reset'), HTTP_IDEMPOTENCY_KEY='form-1')
+        self.assertEqual(Job.objects.count(), 1)
+        self.generate(idempotency_key='form-2')
+        self.assertEqual(Job.objects.count(), 2)
+        self.assertEqual(self.work(), 2)
+
+        # Another owner's key is their own
+        other = User.objects.create_user(username='rival', password='pass12345')
+        first = enqueue('reset_players', owner=other, idempotency_key='form-1')
+        self.assertEqual(enqueue('reset_players', owner=other, idempotency_key='form-1'), first)
+        self.assertNotEqual(first.kind, Job.objects.get(owner=self.owner, idempotency_key='form-1').kind)
+
+    def test_reset_is_queued(self):
+        generate_teams(self.owner)
+        job_url = self.client.post(reverse('reset'))['Location']
+        self.assertEqual(Player.objects.filter(owner=self.owner).count(), 8)
+        self.work()
+        self.assertFalse(Player.objects.filter(owner=self.owner).exists())
+        self.assertFalse(TeamMembership.objects.filter(left_at__isnull=True).exists())
+        self.assertEqual(self.client.get(job_url + 'status/').json()['result']['players'], 8)
+
+    def test_failures_are_reported_to_the_owner_only(self):
+        # More goalkeepers than the roster has
+        self.generate(engine='positions', min_GK=20)
+        job = Job.objects.get()
+        # An expected failure is logged without a traceback
+        with self.assertLogs('fair_play.jobs', 'INFO') as logs:
+            self.work()
+        [record] = logs.records
+        self.assertEqual(record.levelname, 'INFO')
+        self.assertIn(f'Job {job.pk} (generate_teams) failed: ', record.getMessage())
+        self.assertIn('GoalKeeper', record.getMessage())
+        self.assertIsNone(record.exc_info)
+        status = self.client.get(reverse('job_status', args=[job.pk])).json()
+        self.assertEqual(status['status'], Job.Status.FAILED)
+        self.assertIn('GoalKeeper', status['error'])
+        self.assertNotIn('Traceback', status['error'])
+        self.assertIsNone(status['next_url'])
+
+        # Unexpected errors are logged, and the user gets no internals
+        with mock.patch('fair_play.tasks.reset_roster', side_effect=KeyError('secret_setting')):
+            crashed = enqueue('reset_players', owner=self.owner)
+            with self.assertLogs('fair_play.jobs', 'ERROR') as logs:
+                self.work()
+        self.assertIn('secret_setting', '\n'.join(logs.output))
+        error = self.client.get(reverse('job_status', args=[crashed.pk])).json()['error']
+        self.assertEqual(error, 'Removing all your players failed unexpectedly. Please try again later.')
+
+        other = User.objects.create_user(username='rival', password='pass12345')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('job_detail', args=[job.pk])).status_code, 404)
+
+    def test_lost_and_locked_jobs_are_retried(self):
+        job = enqueue('reset_players', owner=self.owner)
+        self.assertEqual(claim('dead-worker').pk, job.pk)
+        self.assertIsNone(claim('other-worker'))
+        # The first worker died holding the job
+        Job.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.work(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.SUCCEEDED, 2))
+
+        job = enqueue('reset_players', owner=self.owner)
+        claimed = claim('worker')
+        with mock.patch('fair_play.tasks.reset_roster', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('fair_play.jobs', 'WARNING') as logs:
+                run_job(claimed)
+        self.assertEqual(logs.output, [f'WARNING:fair_play.jobs:Job {job.pk} found the database locked, retrying'])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.QUEUED)
+        self.assertGreater(job.run_after, timezone.now())
+        # Not due yet
+        self.assertIsNone(claim('worker'))
+
+        Job.objects.filter(pk=job.pk).update(attempts=MAX_ATTEMPTS - 1, run_after=timezone.now())
+        claimed = claim('worker')
+        with mock.patch('fair_play.tasks.reset_roster', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('fair_play.jobs', 'ERROR') as logs:
+                run_job(claimed)
+        self.assertIn(f'Job {job.pk} (reset_players) failed', logs.output[0])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+
+    @override_settings(FAIRPLAY_BACKGROUND_JOBS=False)
+    def test_without_background_jobs_the_views_do_the_work(self):
+        response = self.generate()
+        self.assertRedirects(response, reverse('teams_display'), fetch_redirect_response=False)
+        self.assertEqual(Team.objects.filter(owner=self.owner).count(), 2)
+        self.client.post(reverse('reset'))
+        self.assertFalse(Player.objects.filter(owner=self.owner).exists())
+        self.assertFalse(Job.objects.exists())
+
+
+@override_settings(FAIRPLAY_SERVER_TIMING=True)
+class PerformanceMetricsTests(TestCase):
+    def setUp(self):
+        REGISTRY.clear()
+        self.addCleanup(REGISTRY.clear)
+        self.owner = User.objects.create_user(username='coach', password='pass12345')
+        make_roster(self.owner, 6)
+        generate_teams(self.owner)
+        self.client.force_login(self.owner)
+
+    def timing(self, response):
+        """{metric: (milliseconds, description)} of the Server-Timing header"""
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            params = dict(param.split('=', 1) for param in params)
+            entries[name] = (float(params['dur']), params.get('desc', '').strip('"'))
+        return entries
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('teams_display'))
+        timing = self.timing(response)
+        self.assertEqual(timing['sql'][1], f'{len(ctx.captured_queries)} queries')
+        self.assertGreater(timing['template'][0], 0)
+        self.assertGreaterEqual(timing['total'][0], timing['template'][0])
+
+        # No template behind a redirect
+        response = self.client.post(reverse('generate_teams'), {'num_teams': 2})
+        self.assertEqual(self.timing(response)['template'][0], 0)
+
+        with override_settings(FAIRPLAY_SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('teams_display')))
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('teams_display'))
+        self.client.get(reverse('teams_display'))
+        self.client.post(reverse('generate_teams'), {'num_teams': 2})
+        self.client.get('/no-such-page/')
+
+        with override_settings(FAIRPLAY_METRICS_IPS=['127.0.0.1']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('fairplay_requests_total{view="teams_display",method="GET",status="200"} 2', lines)
+        self.assertIn('fairplay_requests_total{view="generate_teams",method="POST",status="302"} 1', lines)
+        self.assertIn('fairplay_requests_total{view="<unresolved>",method="GET",status="404"} 1', lines)
+        self.assertIn('fairplay_request_duration_seconds_count{view="teams_display",method="GET"} 2', lines)
+        self.assertIn('fairplay_request_queries_bucket{view="teams_display",le="+Inf"} 2', lines)
+        self.assertIn('# TYPE fairplay_request_sql_seconds histogram', lines)
+        template_sum = next(line for line in lines if line.startswith('fairplay_request_template_seconds_sum{view="teams_display"'))
+        self.assertGreater(float(template_sum.split()[-1]), 0)
+
+    def test_metrics_are_private(self):
+        self.client.logout()
+        # No address is trusted by default, not even the local proxy's
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        with override_settings(FAIRPLAY_METRICS_IPS=['10.0.0.5']):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        staff = User.objects.create_user(username='ops', password='pass12345', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.9').status_code, 200)
+
+
+class QueryLogTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'queries.log')
+        # The loops below are N+1 patterns on purpose
+        override = override_settings(
+            FAIRPLAY_QUERY_LOG=self.path, FAIRPLAY_SLOW_QUERY_MS=10_000, FAIRPLAY_NPLUSONE='off'
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        self.owner = User.objects.create_user(username='coach', password='pass12345')
+        make_roster(self.owner, 12)
+        generate_teams(self.owner)
+
+    def entries(self):
+        with open(self.path) as file:
+            return [json.loads(line) for line in file]
+
+    def test_fingerprints(self):
+        self.assertEqual(
+            normalize("SELECT * FROM t WHERE a = 'it''s' AND b IN (%s, %s, %s) AND c > 3.5\n LIMIT 21"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) AND c > ? LIMIT ?'
+        )
+        self.assertEqual(normalize('SELECT * FROM t WHERE b IN (%s)'), normalize('SELECT * FROM t WHERE b IN (%s, %s)'))
+        self.assertEqual(normalize('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)'), 'INSERT INTO t (a, b) VALUES (...)')
+        self.assertEqual(normalize('SAVEPOINT "s1403_x12"'), 'SAVEPOINT "s?"')
+        # Digits in names are kept
+        self.assertEqual(normalize('SELECT "t1"."col2" FROM "t1"'), 'SELECT "t1"."col2" FROM "t1"')
+
+    def test_repeated_queries_are_logged_with_their_origin(self):
+        with track('loop'):
+            for player in Player.objects.filter(owner=self.owner):
+                player.user.username
+        loop_line = sys._getframe().f_lineno - 1
+        entries = self.entries()
+        self.assertEqual(len(entries), 1)
+        entry = entries[0]
+        self.assertEqual((entry['source'], entry['count']), ('loop', 12))
+        self.assertEqual(entry['location'], f'fair_play/tests.py:{loop_line} in test_repeated_queries_are_logged_with_their_origin')
+        self.assertIn('WHERE "auth_user"."id" = ? LIMIT ?', entry['sql'])
+
+        # Fewer runs than FAIRPLAY_REPEATED_QUERY_COUNT, and nothing slow
+        with track('short'):
+            list(User.objects.all())
+        self.assertEqual(len(self.entries()), 1)
+
+    def test_requests_log_template_origins(self):
+        self.client.force_login(self.owner)
+        with override_settings(FAIRPLAY_SLOW_QUERY_MS=0):
+            self.client.get(reverse('teams_display'))
+        entries = [entry for entry in self.entries() if entry['source'] == 'teams_display']
+        self.assertTrue(entries)
+        self.assertTrue(any(entry['location'].startswith('teams_display.html:') for entry in entries))
+        self.assertTrue(all(entry['location'] != '<unknown>' for entry in entries))
+
+    def test_report(self):
+        for _ in range(2):
+            with track('loop'):
+                for player in Player.objects.filter(owner=self.owner):
+                    player.user.username
+        summaries = summarize(log_files())
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual((summaries[0]['count'], summaries[0]['requests']), (24, 2))
+
+        out = StringIO()
+        call_command('slowqueries', '--top', '5', stdout=out)
+        report = out.getvalue()
+        self.assertIn(summaries[0]['fingerprint'], report)
+        self.assertIn('loop: fair_play/tests.py:', report)
+        with self.assertRaises(CommandError):
+            call_command('slowqueries', log=self.path + '.missing', stdout=StringIO())
+
+
+@override_settings(FAIRPLAY_NPLUSONE='raise')
+class NPlusOneTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='coach', password='pass12345')
+        make_roster(self.owner, 6)
+        generate_teams(self.owner, ('Red', 'Blue', 'Green'))
+
+    def test_lazy_loads_in_a_loop_fail(self):
+        with self.assertRaises(NPlusOneError) as caught:
+            with track('loop'):
+                for player in Player.objects.filter(owner=self.owner):
+                    player.user.username
+        loop_line = sys._getframe().f_lineno - 1
+        message = str(caught.exception)
+        self.assertIn('N+1 queries in loop', message)
+        self.assertIn(
+            f'Player.user loaded lazily 6 times at fair_play/tests.py:{loop_line} in test_lazy_loads_in_a_loop_fail',
+            message
+        )
+
+    def test_related_managers_are_named(self):
+        with self.assertRaises(NPlusOneError) as caught:
+            with track('loop'):
+                for team in Team.objects.filter(owner=self.owner):
+                    team.players.count()
+                    list(team.members.all())
+                    team.owner.username
+        message = str(caught.exception)
+        for relation in ('Team.players', 'Team.members', 'Team.owner'):
+            self.assertIn(f'{relation} loaded lazily 3 times', message)
+
+    def test_prefetched_and_single_loads_pass(self):
+        with track('prefetched'):
+            teams = Team.objects.filter(owner=self.owner).select_related('owner').prefetch_related('players__user', 'members')
+            for team in teams:
+                [player.user.username for player in team.players.all()]
+                list(team.members.all())
+                team.owner.username
+            # Once is not a pattern
+            Player.objects.filter(owner=self.owner).first().user
+
+    def test_requests_are_checked(self):
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(reverse('teams_display')).status_code, 200)
+        # A template showing each team's owner without select_related
+        with mock.patch('fair_play.views.render', lambda request, name, context: HttpResponse(
+            Template('{% for team in teams %}{{ team.owner.username }}{% endfor %}').render(
+                Context({'teams': Team.objects.filter(owner=self.owner)})
+            )
+        )):
+            with self.assertRaises(NPlusOneError):
+                self.client.get(reverse('standings'))
+
+    def test_modes(self):
+        with self.assertLogs('fair_play.nplusone', 'WARNING'), override_settings(FAIRPLAY_NPLUSONE='warn'):
+            with track('loop'):
+                for player in Player.objects.filter(owner=self.owner):
+                    player.user
+        with override_settings(FAIRPLAY_NPLUSONE=None, DEBUG=True):
+            self.assertEqual(nplusone_mode(), 'warn')
+        with override_settings(FAIRPLAY_NPLUSONE=None, DEBUG=False):
+            self.assertEqual(nplusone_mode(), 'off')
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='coach', password='pass12345')
+        make_roster(self.owner, 8)
+        self.red, self.blue = generate_teams(self.owner)
+        self.client.force_login(self.owner)
+
+    def send(self, method, name, data=None, args=(), **headers):
+        return getattr(self.client, method)(
+            reverse(name, args=args), json.dumps(data or {}), content_type='application/json', headers=headers
+        )
+
+    def schedule(self, **extra):
+        response = self.send('post', 'api_matches', {'team_a_id': self.red.pk, 'team_b_id': self.blue.pk, **extra})
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_reads_carry_etags_and_unchanged_data_is_not_read_again(self):
+        match = self.schedule(location='Park')
+        self.assertEqual(len(match['participations']), 8)
+        for name, args in (
+            ('api_players', ()), ('api_player', (self.red.players.first().pk,)), ('api_teams', ()),
+            ('api_team', (self.red.pk,)), ('api_matches', ()), ('api_match', (match['id'],)), ('api_history', ()),
+        ):
+            response = self.client.get(reverse(name, args=args))
+            self.assertEqual(response.status_code, 200, name)
+            self.assertIn('no-cache', response['Cache-Control'])
+            with CaptureQueriesContext(connection) as ctx:
+                again = self.client.get(reverse(name, args=args), HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(again.status_code, 304, name)
+            self.assertEqual(again['ETag'], response['ETag'])
+            # Nothing but the version lookups: no rows are read for a 304
+            self.assertLessEqual(len(ctx.captured_queries), 4, name)
+
+        teams = self.client.get(reverse('api_teams')).json()['results']
+        self.assertEqual({team['name'] for team in teams}, {'Red', 'Blue'})
+        self.assertEqual(sum(len(team['players']) for team in teams), 8)
+        self.assertIn('coach', teams[0]['members'] + teams[1]['members'])
+        self.assertEqual(match['team_a'], 'Red')
+        self.assertEqual(self.client.get(reverse('api_history')).json()['results'][0]['location'], 'Park')
+
+    def test_writes_change_the_etag(self):
+        url = reverse('api_players')
+        etag = self.client.get(url)['ETag']
+        player = Player.objects.filter(owner=self.owner).exclude(user=self.owner).first()
+        response = self.send('patch', 'api_player', {'rating': 99}, args=[player.pk])
+        self.assertEqual(response.json()['rating'], 99)
+        self.assertEqual(response.json()['position'], player.position)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Stats entered on the match page count too
+        match = self.schedule()
+        match_url = reverse('api_match', args=[match['id']])
+        etag = self.client.get(match_url)['ETag']
+        participation = MatchParticipation.objects.filter(match_id=match['id']).first()
+        participation.match_rating = 9
+        MatchParticipation.objects.update_stats([participation])
+        self.assertEqual(self.client.get(match_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_match_guards_writes(self):
+        match = self.schedule()
+        url = reverse('api_match', args=[match['id']])
+        etag = self.client.get(url)['ETag']
+        player = Player.objects.filter(owner=self.owner).first()
+        # Someone else changes the roster meanwhile
+        self.send('patch', 'api_player', {'rating': 60}, args=[player.pk])
+        stale = self.send('patch', 'api_match', {'score_a': 1, 'score_b': 0}, args=[match['id']], **{'If-Match': etag})
+        self.assertEqual(stale.status_code, 412)
+        self.assertIsNone(Match.objects.get(pk=match['id']).score_a)
+
+        etag = self.client.get(url)['ETag']
+        response = self.send(
+            'patch', 'api_match', {'score_a': 1, 'score_b': 0, 'status': Match.Status.PLAYED}, args=[match['id']],
+            **{'If-Match': etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], Match.Status.PLAYED)
+        career = self.client.get(reverse('api_history')).json()['career']
+        self.assertEqual(career['wins'] + career['losses'], 1)
+
+    def test_access_and_errors(self):
+        match = self.schedule()
+        player = Player.objects.filter(owner=self.owner).first()
+        self.assertEqual(Client().get(reverse('api_players')).status_code, 401)
+        self.assertEqual(self.send('put', 'api_players').status_code, 405)
+
+        other = User.objects.create_user(username='rival', password='pass12345')
+        self.client.force_login(other)
+        for name, pk in (('api_player', player.pk), ('api_team', self.red.pk), ('api_match', match['id'])):
+            self.assertEqual(self.client.get(reverse(name, args=[pk])).status_code, 404, name)
+        self.assertEqual(self.send('delete', 'api_player', args=[player.pk]).status_code, 404)
+        # A member sees the match but may not record its result
+        self.red.members.add(other)
+        self.assertEqual(self.client.get(reverse('api_match', args=[match['id']])).status_code, 200)
+        self.assertEqual(self.send('patch', 'api_match', {'score_a': 3}, args=[match['id']]).status_code, 403)
+
+        self.client.force_login(self.owner)
+        bad_json = self.client.post(reverse('api_players'), '{', content_type='application/json')
+        self.assertEqual(bad_json.status_code, 400)
+        errors = self.send('post', 'api_players', {'username': 'nobody'}).json()['errors']
+        self.assertIn('username', errors)
+        errors = self.send('patch', 'api_player', {'rating': 500}, args=[player.pk]).json()['errors']
+        self.assertIn('rating', errors)
+        errors = self.send('post', 'api_matches', {'team_a_id': self.red.pk}).json()['errors']
+        self.assertIn('team_b_id', errors)
+
+    def test_roster_writes(self):
+        User.objects.create_user(username='newcomer', password='pass12345')
+        response = self.send('post', 'api_players', {
+            'username': 'newcomer', 'position': Player.Position.GK, 'rating': 80
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['position'], Player.Position.GK)
+        self.assertEqual(self.client.get(response['Location']).json()['username'], 'newcomer')
+        self.assertEqual(self.send('delete', 'api_player', args=[response.json()['id']]).status_code, 204)
+        self.assertFalse(Player.objects.filter(user__username='newcomer').exists())
+
+        response = self.send('post', 'api_teams', {'team_names': ['North', 'South', ' ']})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([len(team['players']) for team in response.json()['results']], [4, 4])
+        self.assertEqual(self.send('post', 'api_teams', {'team_names': ['A', 'B'], 'engine': 'nope'}).status_code, 400)
+        with override_settings(FAIRPLAY_BACKGROUND_JOBS=True):
+            response = self.send('post', 'api_teams', {'team_names': ['East', 'West']}, **{'Idempotency-Key': 'k1'})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(self.send('post', 'api_teams', {'team_names': ['East', 'West']}, **{
+                'Idempotency-Key': 'k1'
+            }).json()['id'], response.json()['id'])
+        self.assertEqual(response['Location'], reverse('job_status', args=[response.json()['id']]))
+
+    def test_lists_are_paged(self):
+        with mock.patch('fair_play.api.API_PAGE_SIZE', 3):
+            usernames, url = [], reverse('api_players')
+            while url:
+                page = self.client.get(url).json()
+                usernames += [player['username'] for player in page['results']]
+                url = page['next']
+        roster = Player.objects.filter(owner=self.owner).values_list('user__username', flat=True)
+        self.assertEqual(usernames, sorted(roster))
+        self.assertNotIn('_keyset_0', page['results'][0])
@@ -1,6 +1,10 @@
-from . import views
+from . import api, async_views, views
+from django.conf import settings
 from django.urls import path
 
+# Under ASGI the busiest read views are served by their async versions
+read_views = async_views if settings.FAIRPLAY_ASYNC_VIEWS else views
+
 urlpatterns = [
     # Authentication URLs
     path('register/', views.register_view, name='register'),
@@ -9,6 +13,8 @@ urlpatterns = [
     
     # Player URLs
     path('player/add/', views.add_player_view, name='playeradd'),
+    path('player/import/', views.import_players_view, name='playerimport'),
+    path('player/autocomplete/', views.username_autocomplete_view, name='player_autocomplete'),
     path('players/', views.PlayerListView.as_view(), name='playerslist'),
     path('player/<int:pk>/delete/', views.DeletePlayerView.as_view(), name='playerdelete'),
     path('player/<int:pk>/update/', views.UpdatePlayerView.as_view(), name='playerupdate'),
@@ -17,15 +23,43 @@ urlpatterns = [
     # Team URLs
     path('teams/generate/', views.team_form_view, name='team_form'),
     path('teams/create/', views.generate_teams_view, name='generate_teams'),
-    path('teams/', views.teams_display_view, name='teams_display'),
+    path('teams/', read_views.teams_display_view, name='teams_display'),
     path('teams/<int:team_id>/history/', views.team_history_view, name='team_history'),
+    path(
+        'teams/<int:team_id>/roster/export.<str:fmt>', views.team_export_view, {'table': 'roster'},
+        name='team_roster_export'
+    ),
+    path(
+        'teams/<int:team_id>/matches/export.<str:fmt>', views.team_export_view, {'table': 'matches'},
+        name='team_matches_export'
+    ),
+    path('teams/standings/', views.standings_view, name='standings'),
     
     # Match URLs
-    path('matches/', views.match_list_view, name='match_list'),
+    path('matches/', read_views.match_list_view, name='match_list'),
+    path('matches/export.<str:fmt>', views.match_export_view, name='match_export'),
     path('matches/create/', views.match_create_view, name='match_create'),
-    path('matches/<int:pk>/', views.match_detail_view, name='match_detail'),
+    path('matches/<int:pk>/', read_views.match_detail_view, name='match_detail'),
+    path('matches/<int:pk>/stats/', views.match_stats_view, name='match_stats'),
     path('matches/<int:pk>/result/', views.match_record_result_view, name='match_record_result'),
     
     # History URLs
     path('history/', views.my_history_view, name='my_history'),
+    path('history/export.<str:fmt>', views.my_history_export_view, name='my_history_export'),
+
+    # Background job URLs
+    path('jobs/<int:pk>/', views.job_detail_view, name='job_detail'),
+    path('jobs/<int:pk>/status/', views.job_status_view, name='job_status'),
+
+    # JSON API
+    path('api/players/', api.players_view, name='api_players'),
+    path('api/players/<int:pk>/', api.player_view, name='api_player'),
+    path('api/teams/', api.teams_view, name='api_teams'),
+    path('api/teams/<int:pk>/', api.team_view, name='api_team'),
+    path('api/matches/', api.matches_view, name='api_matches'),
+    path('api/matches/<int:pk>/', api.match_view, name='api_match'),
+    path('api/history/', api.history_view, name='api_history'),
+
+    # Prometheus scrape target
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
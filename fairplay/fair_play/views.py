@@ -1,5 +1,10 @@
+from uuid import uuid4
+
+from django.conf import settings
 from django.shortcuts import render, redirect
-from .forms import PlayerSearchForm, CustomUserCreationForm, MatchForm, MatchResultForm
+from .forms import (
+    PlayerSearchForm, CustomUserCreationForm, MatchForm, MatchResultForm, RosterImportForm, StatSheetFormSet
+)
 from django.contrib.auth.models import User
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import AuthenticationForm
@@ -9,12 +14,41 @@ from django.views.generic import CreateView, ListView, DeleteView, UpdateView
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.utils import timezone
-from .models import Player, Team, TeamMembership, Match, MatchParticipation
+from .models import Job, Player, Team, TeamMembership, Match, MatchParticipation, PlayerCareerStats
+from .access import access_for
+from .balancing import BALANCERS, DEFAULT_BALANCER, balancer_choices
+from .caching import cached_for_owners, fragment_timeout, roster_version
+from .db import retry_on_locked, save_fresh
+from .exports import (
+    EXPORT_FORMATS, MATCH_COLUMNS, PARTICIPATION_COLUMNS, ROSTER_COLUMNS, export_response, owner_history_rows,
+    player_history_rows, team_match_rows, team_roster_rows
+)
+from .jobs import enqueue, job_status
+from .metrics import REGISTRY
+from .imports import detect_format, import_roster, read_rows
+from .pagination import KeysetPaginator
+from .ratings import is_decided, update_match_ratings
+from .roster import MIN_TEAMS, add_owner_as_player, regenerate_teams, reset_roster
+from .routers import for_analytics
+from .standings import owner_standings
 from .forms import CustomUserCreationForm
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import Lower
+from django.http import Http404, HttpResponse, JsonResponse
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 
+# Rows per page of the paginated lists
+PLAYERS_PER_PAGE = 50
+MATCHES_PER_PAGE = 20
+HISTORY_PER_PAGE = 20
+# Suggestions returned by the username autocomplete
+AUTOCOMPLETE_LIMIT = 10
+# Sorts after every character, so [prefix, prefix + PREFIX_END) holds exactly
+# the strings that start with prefix
+PREFIX_END = '\U0010ffff'
+
 # Create your views here.
 def index(request):
     """Main page view - redirect authenticated users to their player list"""
@@ -51,6 +85,60 @@ def add_player_view(request):
     return render(request, 'playeradd.html', {'form': form})
 
 
+@login_required
+def import_players_view(request):
+    """Add many players at once from an uploaded CSV or JSON file"""
+    result = None
+    if request.method == 'POST':
+        form = RosterImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            fmt = form.cleaned_data['format'] or detect_format(upload.name)
+            if fmt is None:
+                form.add_error('format', 'Pick a format, the file name does not tell.')
+            else:
+                # The upload is read row by row, never loaded whole
+                result = import_roster(request.user, read_rows(upload.file, fmt))
+                if result.created:
+                    messages.success(request, f'Added {result.created} players to your roster!')
+                if result.errors:
+                    messages.error(request, f'{len(result.errors)} rows could not be imported.')
+                else:
+                    return redirect('playerslist')
+    else:
+        form = RosterImportForm()
+
+    return render(request, 'playerimport.html', {'form': form, 'result': result})
+
+
+@login_required
+def username_autocomplete_view(request):
+    """Usernames starting with ``?q=`` (any case) that are not on the user's roster yet, as JSON"""
+    prefix = request.GET.get('q', '').strip().lower()[:150]
+    if not prefix:
+        return JsonResponse({'results': []})
+    # A range on LOWER(username) rather than LIKE, so it is served (and
+    # ordered) by fair_play_user_username_lower_idx
+    users = User.objects.annotate(
+        username_lower=Lower('username')
+    ).filter(
+        username_lower__gte=prefix, username_lower__lt=prefix + PREFIX_END
+    ).exclude(
+        pk__in=Player.objects.filter(owner=request.user).values('user')
+    ).order_by('username_lower').values(
+        'username', 'first_name', 'last_name', 'profile__preferred_position'
+    )[:AUTOCOMPLETE_LIMIT]
+    results = [
+        {
+            'username': user['username'],
+            'name': f"{user['first_name']} {user['last_name']}".strip(),
+            'preferred_position': user['profile__preferred_position'],
+        }
+        for user in users
+    ]
+    return JsonResponse({'results': results})
+
+
 class PlayerListView(LoginRequiredMixin, ListView):
     model = Player
     template_name = 'playerslist.html'
@@ -58,7 +146,18 @@ class PlayerListView(LoginRequiredMixin, ListView):
     
     def get_queryset(self):
         # Only show players owned by the current user
-        return Player.objects.filter(owner=self.request.user)
+        return Player.objects.filter(owner=self.request.user).select_related('user')
+
+    def get_context_data(self, **kwargs):
+        # The player table is cached until the roster changes; the page and
+        # the roster count are lazy, so a cached render runs no player queries
+        page = KeysetPaginator(self.object_list, ['user__username'], PLAYERS_PER_PAGE).page(self.request.GET)
+        context = super().get_context_data(object_list=page, **kwargs)
+        context['page'] = page
+        context['roster'] = self.object_list
+        context['roster_version'] = roster_version(self.request.user.pk)
+        context['fragment_timeout'] = fragment_timeout()
+        return context
 
 #Remove a player from the original list 
 class DeletePlayerView(LoginRequiredMixin, DeleteView):
@@ -69,10 +168,7 @@ class DeletePlayerView(LoginRequiredMixin, DeleteView):
     
     def get_queryset(self):
         # Only allow deletion of own players
-        return Player.objects.filter(
-            Q(owner=self.request.user)|
-            Q(team__owner = self.request.user)
-        )
+        return access_for(self.request).players()
 
     def delete(self,request,*args,**kwargs):
         messages.success(self.request,"Player removed successfully")
@@ -87,63 +183,52 @@ class UpdatePlayerView(LoginRequiredMixin, UpdateView):
     
     def get_queryset(self):
         # Only allow deletion of own players
-        return Player.objects.filter(
-            Q(owner=self.request.user)|
-            Q(team__owner = self.request.user)
-        )
+        return access_for(self.request).players()
 
     def form_valid(self, form):
+        # Only the edited fields are written, so a team assigned meanwhile by
+        # a concurrent team generation is not overwritten with a stale one
+        self.object = save_fresh(form.instance, self.fields)
         messages.success(self.request, 'Player updated successfully')
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
 
 # Reset all players
 @login_required
 def reset_players(request):
     if request.method == 'POST':
-        # Close all open memberships
-        TeamMembership.objects.filter(
-            player__owner=request.user,
-            left_at__isnull=True
-        ).update(left_at=timezone.now())
-        
-        # Only delete current user's players
-        Player.objects.filter(owner=request.user).delete()
+        if settings.FAIRPLAY_BACKGROUND_JOBS:
+            job = enqueue('reset_players', owner=request.user, idempotency_key=_idempotency_key(request))
+            return redirect('job_detail', pk=job.pk)
+        # Close all open memberships and delete only the current user's players
+        retry_on_locked(reset_roster)(request.user.pk)
         messages.success(request, 'All your players have been removed. Starting fresh!')
         return redirect('index')
-    return render(request, 'reset_confirm.html')
-
-#Snake Draft Algorithm
-def generate_balanced_teams(player_ids,team_names):
-    #Step1- Get the players by ratings (high to low)
-    players = list(
-        Player.objects.filter(id__in=player_ids)
-        .order_by('-rating','position')
-    )
-
-    #Step2- Create empty teams
-    teams = {name: [] for name in team_names}
-    team_ratings = {name: 0 for name in team_names}
-
-    #Distribute the players
-    num_teams = len(team_names)
-
-    for index,player in enumerate(players):
-        iteration_number = index // num_teams
-        position_in_iteration = index % num_teams
-
-        if iteration_number % 2 == 1:
-            position_in_iteration = num_teams - 1 - position_in_iteration
-
-        team_name = team_names[position_in_iteration]
-        teams[team_name].append(player)
-        team_ratings[team_name] += player.rating
-    return teams, team_ratings
+    return render(request, 'reset_confirm.html', {'idempotency_key': uuid4().hex})
 
 @login_required
 def team_form_view(request):
     """Display the form to input team names and count"""
     player_count = Player.objects.filter(owner=request.user).count()
-    return render(request, 'team_form.html', {'player_count': player_count})
+    return render(request, 'team_form.html', {
+        'player_count': player_count,
+        'engines': balancer_choices(),
+        'default_engine': DEFAULT_BALANCER,
+        'positions': [(position.name, position.value) for position in Player.Position],
+        'idempotency_key': uuid4().hex,
+    })
+
+def _idempotency_key(request):
+    """The client's key for a request that queues a job; the forms render one per page view"""
+    return request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key') or None
+
+def _position_limits(data, prefix):
+    """Read the optional per-position quota fields (e.g. max_GK) of the team form"""
+    limits = {}
+    for code in Player.Position.names:
+        value = data.get(f'{prefix}_{code}', '').strip()
+        if value.isdigit():
+            limits[code] = int(value)
+    return limits
 
 @login_required
 def generate_teams_view(request):
@@ -158,88 +243,55 @@ def generate_teams_view(request):
         # Filter out any empty team names and ensure they're not None
         team_names = [name for name in team_names if name]
         
-        if not team_names:
-            messages.error(request, 'Please provide at least one team name.')
+        if len(set(team_names)) < MIN_TEAMS:
+            messages.error(request, f'Please provide at least {MIN_TEAMS} different team names.')
+            return redirect('team_form')
+
+        engine = request.POST.get('engine', DEFAULT_BALANCER)
+        if engine not in BALANCERS:
+            messages.error(request, 'Please choose a valid balancing method.')
             return redirect('team_form')
         
         # Automatically add current user as a player if not already in roster
-        user_as_player = Player.objects.filter(owner=request.user, user=request.user).first()
-        if not user_as_player:
-            # Create player for current user with their preferred position
-            user_as_player = Player.objects.create(
-                user=request.user,
-                owner=request.user,
-                position=request.user.profile.preferred_position,
-                rating=70  # Default rating
-            )
+        _, added = add_owner_as_player(request.user)
+        if added:
             messages.info(request, f'Added yourself ({request.user.username}) to your roster!')
         
-        #Get the player ids for the snake draft algorithm (only current user's players)
-        player_ids = list(Player.objects.filter(owner=request.user).values_list('id', flat=True))
-        
-        if not player_ids:
-            messages.error(request, 'No players available. Please add players first.')
-            return redirect('playeradd')
-
-        teams_dict, ratings = generate_balanced_teams(player_ids, team_names)
-        
-        # Close all current memberships before resetting teams
-        TeamMembership.objects.filter(
-            player__owner=request.user,
-            left_at__isnull=True
-        ).update(left_at=timezone.now())
-        
-        #Clear old teams owned by current user
-        Team.objects.filter(owner=request.user).delete()
-        Player.objects.filter(owner=request.user).update(team=None)
-
-        for team_name, players in teams_dict.items():
-            #Create a team
-            team = Team.objects.create(name=team_name, owner=request.user)
+        minimums, maximums = _position_limits(request.POST, 'min'), _position_limits(request.POST, 'max')
+        learned = bool(request.POST.get('learned_ratings'))
+        if settings.FAIRPLAY_BACKGROUND_JOBS:
+            job = enqueue(
+                'generate_teams', owner=request.user, idempotency_key=_idempotency_key(request),
+                team_names=team_names, engine=engine, minimums=minimums, maximums=maximums, learned=learned
+            )
+            return redirect('job_detail', pk=job.pk)
 
-            for player in players:
-                player.team = team
-                player.save()
-                
-                # Only add the player's user to THIS team's members
-                team.members.add(player.user)
-                
-                # Create new membership record
-                TeamMembership.objects.create(
-                    player=player,
-                    team=team
-                )
-        
-        messages.success(request, f'Created {len(team_names)} teams!')
+        #Snapshot the roster (only current user's players), draft the teams and save them
+        try:
+            teams = regenerate_teams(request.user.pk, team_names, engine, minimums, maximums, learned)
+        except ValueError as error:
+            messages.error(request, str(error))
+            return redirect('team_form')
+        messages.success(request, f'Created {len(teams)} teams!')
         return redirect('teams_display')
     return redirect('team_form')
 
 @login_required
 def teams_display_view(request):
     """Display the generated teams with their players"""
-    owned_teams = Team.objects.filter(owner=request.user).prefetch_related('players', 'members')
-    member_teams = Team.objects.filter(members=request.user).exclude(owner=request.user).prefetch_related('players', 'members', 'owner')
-    
-    # Calculate total and average ratings for each team
-    teams_owned_with_stats = []
-    for team in owned_teams:
-        total_rating = sum(player.rating for player in team.players.all())
-        count = team.players.count()
-        team.total_rating = total_rating
-        team.avg_rating = (total_rating / count) if count > 0 else 0
-        teams_owned_with_stats.append(team)
-    
-    teams_member_with_stats = []
-    for team in member_teams:
-        total_rating = sum(player.rating for player in team.players.all())
-        count = team.players.count()
-        team.total_rating = total_rating
-        team.avg_rating = (total_rating / count) if count > 0 else 0
-        teams_member_with_stats.append(team)
+    # Player count and ratings are stored on the team, no need to aggregate here
+    access = access_for(request)
+    owned_teams = access.owned_teams().prefetch_related('players__user', 'members')
+    member_teams = access.member_teams().prefetch_related('players__user', 'members', 'owner')
     
+    # Both sections are cached fragments, keyed on the roster versions of the
+    # owners whose teams they show
     return render(request, 'teams_display.html', {
-        'owned_teams': teams_owned_with_stats,
-        'member_teams': teams_member_with_stats
+        'owned_teams': owned_teams,
+        'member_teams': member_teams,
+        'owned_version': roster_version(request.user.pk),
+        'member_version': roster_version(*access.member_team_owners()),
+        'fragment_timeout': fragment_timeout()
     })
 
 
@@ -295,23 +347,13 @@ def match_create_view(request):
     if request.method == 'POST':
         form = MatchForm(request.user, request.POST)
         if form.is_valid():
-            match = form.save(commit=False)
-            match.save()
-            
-            # Auto-create participations for current team rosters
-            for player in match.team_A.players.all():
-                MatchParticipation.objects.create(
-                    match=match,
-                    team=match.team_A,
-                    player=player
-                )
-            
-            for player in match.team_B.players.all():
-                MatchParticipation.objects.create(
-                    match=match,
-                    team=match.team_B,
-                    player=player
-                )
+            with transaction.atomic():
+                match = form.save()
+                # Auto-create participations for current team rosters, in one INSERT
+                MatchParticipation.objects.create_for_match(match)
+                if is_decided(match):
+                    # Entered with its result: rate it now that it has players
+                    update_match_ratings(match)
             
             messages.success(request, f'Match scheduled: {match.team_A} vs {match.team_B}')
             return redirect('match_list')
@@ -325,52 +367,52 @@ def match_create_view(request):
 def match_list_view(request):
     """Display all matches for teams the user owns or is a member of"""
     # Get matches where user owns either team or is a member
-    matches = Match.objects.filter(
-        Q(team_A__owner=request.user) | 
-        Q(team_B__owner=request.user) |
-        Q(team_A__members=request.user) |
-        Q(team_B__members=request.user)
-    ).distinct().select_related('team_A', 'team_B').order_by('-played_at', '-date_created')
-    
-    # Separate by status
-    upcoming = matches.filter(status=Match.Status.SCHEDULED)
-    played = matches.filter(status=Match.Status.PLAYED)
-    
+    access = access_for(request)
+    matches = access.matches().select_related('team_A', 'team_B').order_by('-played_at', '-date_created')
+    
+    # Separate by status, each list paged on its own cursor
+    ordering = ['-played_at', '-date_created']
+    upcoming = KeysetPaginator(
+        matches.filter(status=Match.Status.SCHEDULED), ordering, MATCHES_PER_PAGE
+    ).page(request.GET, 'upcoming')
+    played = KeysetPaginator(
+        matches.filter(status=Match.Status.PLAYED), ordering, MATCHES_PER_PAGE
+    ).page(request.GET, 'played')
+    
+    # The lists are cached until a roster of one of the visible teams changes
     return render(request, 'match_list.html', {
         'upcoming_matches': upcoming,
-        'played_matches': played
+        'played_matches': played,
+        'matches_version': roster_version(request.user.pk, *access.team_owners.values()),
+        'fragment_timeout': fragment_timeout()
     })
 
 
 @login_required
 def match_detail_view(request, pk):
     """Display match details with rosters and participations"""
-    match = get_object_or_404(
-        Match.objects.select_related('team_A', 'team_B').prefetch_related(
-            'participations__player__user',
-            'team_A__players__user',
-            'team_B__players__user'
-        ),
-        pk=pk
-    )
+    match = get_object_or_404(Match.objects.select_related('team_A', 'team_B'), pk=pk)
     
     # Check if user has access to this match
-    if not (match.team_A.owner == request.user or 
-            match.team_B.owner == request.user or
-            request.user in match.team_A.members.all() or
-            request.user in match.team_B.members.all()):
+    access = access_for(request)
+    if not access.can_view_match(match):
         messages.error(request, 'You do not have access to this match.')
         return redirect('match_list')
     
-    # Get participations grouped by team
-    team_a_participations = match.participations.filter(team=match.team_A).select_related('player__user')
-    team_b_participations = match.participations.filter(team=match.team_B).select_related('player__user')
+    # Get participations grouped by team, from one query
+    team_a_participations = []
+    team_b_participations = []
+    for participation in match.participations.select_related('player__user').order_by('pk'):
+        if participation.team_id == match.team_A_id:
+            team_a_participations.append(participation)
+        elif participation.team_id == match.team_B_id:
+            team_b_participations.append(participation)
     
     context = {
         'match': match,
         'team_a_participations': team_a_participations,
         'team_b_participations': team_b_participations,
-        'can_edit': match.team_A.owner == request.user or match.team_B.owner == request.user
+        'can_edit': access.can_edit_match(match)
     }
     
     return render(request, 'match_detail.html', context)
@@ -379,17 +421,17 @@ def match_detail_view(request, pk):
 @login_required
 def match_record_result_view(request, pk):
     """Record the result of a match"""
-    match = get_object_or_404(Match, pk=pk)
+    match = get_object_or_404(Match.objects.select_related('team_A', 'team_B'), pk=pk)
     
     # Only team owners can record results
-    if match.team_A.owner != request.user and match.team_B.owner != request.user:
+    if not access_for(request).can_edit_match(match):
         messages.error(request, 'Only team owners can record match results.')
         return redirect('match_detail', pk=pk)
     
     if request.method == 'POST':
         form = MatchResultForm(request.POST, instance=match)
         if form.is_valid():
-            form.save()
+            save_fresh(match, MatchResultForm._meta.fields)
             messages.success(request, f'Result recorded: {match}')
             return redirect('match_detail', pk=pk)
     else:
@@ -400,52 +442,72 @@ def match_record_result_view(request, pk):
         'match': match
     })
 
+@login_required
+def match_stats_view(request, pk):
+    """Enter minutes, goals, assists and ratings for every player of a match at once"""
+    match = get_object_or_404(Match.objects.select_related('team_A', 'team_B'), pk=pk)
+
+    # Only team owners can edit match stats
+    if not access_for(request).can_edit_match(match):
+        messages.error(request, 'Only team owners can edit match stats.')
+        return redirect('match_detail', pk=pk)
+
+    participations = match.participations.select_related('player__user').order_by(
+        Case(When(team_id=match.team_A_id, then=Value(0)), default=Value(1)), 'player__user__username'
+    )
+    if request.method == 'POST':
+        formset = StatSheetFormSet(request.POST, queryset=participations, match=match)
+        if formset.is_valid():
+            changed = []
+            for form in formset.forms:
+                if form.has_changed():
+                    # Every row belongs to this match; share the loaded instance
+                    form.instance.match = match
+                    changed.append(form.instance)
+            # One bulk UPDATE for the whole sheet, and the careers it changes
+            MatchParticipation.objects.update_stats(changed)
+            messages.success(request, f'Stats saved for {len(changed)} players.')
+            return redirect('match_detail', pk=pk)
+    else:
+        formset = StatSheetFormSet(queryset=participations, match=match)
+
+    return render(request, 'match_stats.html', {'formset': formset, 'match': match})
+
+
 @login_required
 def my_history_view(request):
     """Show user's participation history across all teams and matches"""
-    # Get all players associated with this user
-    user_players = Player.objects.filter(user=request.user)
-    
-    # Get all team memberships (current and past)
-    memberships = TeamMembership.objects.filter(
-        player__user=request.user
-    ).select_related('team', 'player').order_by('-joined_at')
-    
-    # Get all match participations
-    participations = MatchParticipation.objects.filter(
-        player__user=request.user
-    ).select_related('match__team_A', 'match__team_B', 'team', 'player').order_by('-match__played_at', '-match__date_created')
-    
-    # Calculate stats
-    total_matches = participations.count()
-    total_goals = sum(p.goals for p in participations)
-    total_assists = sum(p.assists for p in participations)
-    
-    # Count wins/draws/losses
-    wins = 0
-    draws = 0
-    losses = 0
-    
-    for participation in participations:
-        if participation.match.status == Match.Status.PLAYED:
-            winner = participation.match.winner
-            if winner == participation.team:
-                wins += 1
-            elif winner is None:
-                draws += 1
-            else:
-                losses += 1
+    # Team memberships (current and past), a page at a time
+    memberships = KeysetPaginator(
+        for_analytics(TeamMembership.objects.filter(player__user=request.user).select_related('team', 'player')),
+        ['-joined_at'],
+        HISTORY_PER_PAGE
+    ).page(request.GET, 'memberships')
+    
+    # Match participations, a page at a time
+    participations = KeysetPaginator(
+        for_analytics(MatchParticipation.objects.filter(
+            player__user=request.user
+        ).select_related('match__team_A', 'match__team_B', 'team', 'player')),
+        ['-match__played_at', '-match__date_created'],
+        HISTORY_PER_PAGE
+    ).page(request.GET, 'matches')
+    
+    # Headline stats cover the whole career, not the page. The totals are
+    # maintained as results come in, so this is one lookup
+    career = for_analytics(PlayerCareerStats.objects.filter(user=request.user)).first() or PlayerCareerStats()
     
     context = {
         'memberships': memberships,
         'participations': participations,
         'stats': {
-            'total_matches': total_matches,
-            'wins': wins,
-            'draws': draws,
-            'losses': losses,
-            'goals': total_goals,
-            'assists': total_assists
+            'total_matches': career.matches,
+            'wins': career.wins,
+            'draws': career.draws,
+            'losses': career.losses,
+            'goals': career.goals,
+            'assists': career.assists,
+            'minutes': career.minutes
         }
     }
     
@@ -458,60 +520,95 @@ def team_history_view(request, team_id):
     team = get_object_or_404(Team, pk=team_id)
     
     # Check if user has access
-    if team.owner != request.user and request.user not in team.members.all():
+    if not access_for(request).can_view_team(team):
         messages.error(request, 'You do not have access to this team.')
         return redirect('teams_display')
     
-    # Get all matches involving this team
-    matches = Match.objects.filter(
+    # Get all matches involving this team, from the analytics database
+    matches = for_analytics(Match.objects.filter(
         Q(team_A=team) | Q(team_B=team)
-    ).select_related('team_A', 'team_B').order_by('-played_at', '-date_created')
+    )).select_related('team_A', 'team_B').order_by('-played_at', '-date_created')
     
     # Get membership history
-    memberships = TeamMembership.objects.filter(
+    memberships = for_analytics(TeamMembership.objects.filter(
         team=team
-    ).select_related('player__user').order_by('-joined_at')
-    
-    # Calculate team stats
-    wins = 0
-    draws = 0
-    losses = 0
-    goals_for = 0
-    goals_against = 0
-    
-    for match in matches:
-        if match.status == Match.Status.PLAYED and match.score_a is not None and match.score_b is not None:
-            if match.team_A == team:
-                goals_for += match.score_a
-                goals_against += match.score_b
-                if match.score_a > match.score_b:
-                    wins += 1
-                elif match.score_a < match.score_b:
-                    losses += 1
-                else:
-                    draws += 1
-            else:  # team_B
-                goals_for += match.score_b
-                goals_against += match.score_a
-                if match.score_b > match.score_a:
-                    wins += 1
-                elif match.score_b < match.score_a:
-                    losses += 1
-                else:
-                    draws += 1
+    )).select_related('player__user').order_by('-joined_at')
     
     context = {
         'team': team,
         'matches': matches,
         'memberships': memberships,
-        'stats': {
-            'wins': wins,
-            'draws': draws,
-            'losses': losses,
-            'goals_for': goals_for,
-            'goals_against': goals_against,
-            'total_matches': wins + draws + losses
-        }
+        'stats': cached_for_owners(
+            f'team_record:{team.pk}', [team.owner_id], lambda: for_analytics(Match.objects.all()).record(team)
+        )
     }
     
-    return render(request, 'team_history.html', context)
\ No newline at end of file
+    return render(request, 'team_history.html', context)
+
+
+def _export_format(fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise Http404(f'Unknown export format "{fmt}"')
+    return fmt
+
+
+@login_required
+def my_history_export_view(request, fmt):
+    """Download every match the user played in, as CSV or NDJSON"""
+    rows = player_history_rows(request.user)
+    return export_response(f'{request.user.username}-history', PARTICIPATION_COLUMNS, rows, _export_format(fmt))
+
+
+@login_required
+def match_export_view(request, fmt):
+    """Download every participation in matches of the user's teams"""
+    rows = owner_history_rows(request.user)
+    return export_response(f'{request.user.username}-matches', PARTICIPATION_COLUMNS, rows, _export_format(fmt))
+
+
+@login_required
+def team_export_view(request, team_id, table, fmt):
+    """Download a team's roster (current and past members) or its matches"""
+    fmt = _export_format(fmt)
+    team = get_object_or_404(Team, pk=team_id)
+    if not access_for(request).can_view_team(team):
+        messages.error(request, 'You do not have access to this team.')
+        return redirect('teams_display')
+    if table == 'roster':
+        return export_response(f'team-{team.pk}-roster', ROSTER_COLUMNS, team_roster_rows(team), fmt)
+    return export_response(f'team-{team.pk}-matches', MATCH_COLUMNS, team_match_rows(team), fmt)
+
+
+@login_required
+def standings_view(request):
+    """League table of the user's teams"""
+    return render(request, 'standings.html', {'standings': owner_standings(request.user.pk)})
+
+@login_required
+def job_detail_view(request, pk):
+    """Progress of a background job; the page polls job_status_view until the job is done"""
+    job = get_object_or_404(Job, pk=pk, owner=request.user)
+    status = job_status(job)
+    if status['next_url'] and request.GET.get('follow'):
+        if status['result'] and status['result'].get('message'):
+            messages.success(request, status['result']['message'])
+        return redirect(status['next_url'])
+    return render(request, 'job_detail.html', {'job': job, 'status': status})
+
+
+@login_required
+def job_status_view(request, pk):
+    """A background job's status, as JSON"""
+    job = get_object_or_404(Job, pk=pk, owner=request.user)
+    return JsonResponse(job_status(job))
+
+
+def metrics_view(request):
+    """Request histograms of this process, in the Prometheus text format.
+
+    Served to the addresses in FAIRPLAY_METRICS_IPS (the scraper) and to staff.
+    """
+    allowed = request.META.get('REMOTE_ADDR') in settings.FAIRPLAY_METRICS_IPS
+    if not (allowed or request.user.is_staff):
+        raise Http404
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -12,5 +12,10 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fairplay.settings')
+# Serve the read-heavy views with their async versions (see fair_play/async_views.py)
+os.environ.setdefault('FAIRPLAY_ASYNC_VIEWS', '1')
+# Async requests run their queries in a new thread each, so keeping
+# connections would only leave them open in finished threads
+os.environ.setdefault('FAIRPLAY_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its timings include every other middleware
+    'fair_play.metrics.performance_middleware',
+    # Next, so it also sees the session being saved
+    'fair_play.routers.primary_pin_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,7 +59,8 @@ ROOT_URLCONF = 'fairplay.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django templates, with render times reported by performance_middleware
+        'BACKEND': 'fair_play.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -78,9 +84,99 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds a connection is kept for the next request of its thread.
+        # asgi.py sets 0: async requests run in short-lived threads.
+        'CONN_MAX_AGE': int(os.environ.get('FAIRPLAY_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read-only copy of the primary, refreshed with `manage.py snapshot_replica`.
+# History, exports and standings read from the alias named by
+# FAIRPLAY_ANALYTICS_DB (e.g. FAIRPLAY_ANALYTICS_DB=replica); unset, every
+# query goes to 'default'. See fair_play/routers.py.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.environ.get('FAIRPLAY_REPLICA_DB', str(BASE_DIR / 'replica.sqlite3')),
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['fair_play.routers.AnalyticsRouter']
+FAIRPLAY_ANALYTICS_DB = os.environ.get('FAIRPLAY_ANALYTICS_DB') or None
+# Seconds a user's reads stay on the primary after they write
+FAIRPLAY_PRIMARY_PIN_SECONDS = 60
+
+# Applied to every new SQLite connection by fair_play.db.configure_sqlite
+FAIRPLAY_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # milliseconds to wait for a lock
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,  # in KiB when negative: 64 MB of page cache
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# FAIRPLAY_CACHE=locmem keeps the cache per process (the default), while
+# FAIRPLAY_CACHE=file shares it between the processes of one machine.
+
+FAIRPLAY_CACHE = os.environ.get('FAIRPLAY_CACHE', 'locmem')
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fairplay',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('FAIRPLAY_CACHE_DIR', str(BASE_DIR / 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+CACHES = {
+    'default': CACHE_BACKENDS[FAIRPLAY_CACHE],
+}
+
+# Seconds a rendered fragment may live; roster versions invalidate it sooner
+FAIRPLAY_FRAGMENT_TIMEOUT = 60 * 60
+
+# Serve the busiest read views with their async versions (fair_play/async_views.py).
+# asgi.py turns this on; under WSGI the sync views avoid an event loop per request.
+FAIRPLAY_ASYNC_VIEWS = os.environ.get('FAIRPLAY_ASYNC_VIEWS', '0') == '1'
+
+# Queue team generation and roster resets as background jobs (fair_play/jobs.py),
+# run by `manage.py run_jobs`; off, the views do the work within the request.
+FAIRPLAY_BACKGROUND_JOBS = os.environ.get('FAIRPLAY_BACKGROUND_JOBS', '0') == '1'
+
+# Send each response's total, SQL and template times as a Server-Timing header.
+# Any client can read it, so it is on by default only with DEBUG.
+FAIRPLAY_SERVER_TIMING = os.environ.get('FAIRPLAY_SERVER_TIMING', '1' if DEBUG else '0') == '1'
+# Addresses allowed to scrape /metrics without logging in as staff (comma
+# separated); none by default, as behind a local proxy every client is 127.0.0.1
+FAIRPLAY_METRICS_IPS = [
+    address.strip() for address in os.environ.get('FAIRPLAY_METRICS_IPS', '').split(',') if address.strip()
+]
+
+# JSON-lines log of the costly and repeated SQL statements of each request
+# (fair_play/querylog.py), read by `manage.py slowqueries`; off when unset.
+FAIRPLAY_QUERY_LOG = os.environ.get('FAIRPLAY_QUERY_LOG') or None
+FAIRPLAY_QUERY_LOG_BYTES = 10 * 1024 * 1024
+FAIRPLAY_QUERY_LOG_BACKUPS = 5
+# A statement is logged when one run, or all its runs in a request, take this
+# long, or when a request runs it this many times
+FAIRPLAY_SLOW_QUERY_MS = 100
+FAIRPLAY_REPEATED_QUERY_COUNT = 10
+
+# N+1 query detection (fair_play/nplusone.py): 'warn', 'raise' or 'off'.
+# Unset, it warns under DEBUG and is off otherwise; the test runner raises.
+FAIRPLAY_NPLUSONE = os.environ.get('FAIRPLAY_NPLUSONE') or None
+# Lazy loads of one relation from one place that make an N+1 pattern
+FAIRPLAY_NPLUSONE_THRESHOLD = 2
+
+TEST_RUNNER = 'fair_play.testing.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators